@@ -1,2 +1,2 @@
 # images/__init__.py
-from .validations import validate_image_type, validate_image_size
+from .validations import validate_image_type, validate_image_size, validate_image_header
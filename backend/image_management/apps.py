@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ImageManagementConfig(AppConfig):
     name = 'image_management'
+
+    def ready(self):
+        from PIL import Image as PilImage
+
+        # Make every full decode refuse images over the same pixel budget as uploads
+        PilImage.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
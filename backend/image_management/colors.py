@@ -0,0 +1,96 @@
+"""
+Color statistics computed once at ingest, for filtering and sorting the library.
+
+Everything is computed on the small proxy read for the perceptual hash (see
+metadata.read_proxy), with NumPy over all its pixels at once:
+    - mean luminance, from 0 (black) to 1 (white)
+    - a coarse histogram: the share of pixels in each color family (hue ranges,
+      plus black, gray and white for dark or unsaturated pixels)
+    - a palette of up to PALETTE_SIZE dominant colors, by median cut
+
+Transparent pixels are left out.
+"""
+import numpy as np
+from PIL import Image as PilImage
+
+# Color families of the histogram, in the order of their index
+FAMILIES = ('black', 'gray', 'white', 'red', 'orange', 'yellow', 'green', 'cyan', 'blue', 'purple', 'pink', 'brown')
+
+# Hue ranges of the saturated families, as (upper bound in degrees, family); red wraps around
+HUE_FAMILIES = ((15, 'red'), (45, 'orange'), (70, 'yellow'), (165, 'green'), (200, 'cyan'), (260, 'blue'), (290, 'purple'), (345, 'pink'), (360, 'red'))
+
+# Below this value (0-1) a pixel is black; below this saturation it is gray or white
+BLACK_VALUE = 0.2
+GRAY_SATURATION = 0.15
+WHITE_VALUE = 0.85
+
+# Orange pixels darker than this are brown
+BROWN_VALUE = 0.6
+
+# Histogram bins below this share are not stored
+MIN_SHARE = 0.01
+
+PALETTE_SIZE = 5
+
+# ITU-R 601 luma weights, as used by PIL's grayscale conversion
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+_HUE_BOUNDS = np.array([bound for bound, _ in HUE_FAMILIES], dtype=np.float32)
+_HUE_INDEXES = np.array([FAMILIES.index(family) for _, family in HUE_FAMILIES])
+
+
+def families(hsv):
+    """Family index of each pixel of an (N, 3) float array of hue (degrees), saturation and value (0-1)."""
+    hue, saturation, value = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+    index = _HUE_INDEXES[np.searchsorted(_HUE_BOUNDS, hue, side='right').clip(max=len(_HUE_BOUNDS) - 1)]
+    index = np.where((index == FAMILIES.index('orange')) & (value < BROWN_VALUE), FAMILIES.index('brown'), index)
+    neutral = np.where(value > WHITE_VALUE, FAMILIES.index('white'), FAMILIES.index('gray'))
+    index = np.where(saturation < GRAY_SATURATION, neutral, index)
+    return np.where(value < BLACK_VALUE, FAMILIES.index('black'), index)
+
+
+def _hex(rgb):
+    return '#{:02x}{:02x}{:02x}'.format(*(int(channel) for channel in rgb))
+
+
+def color_stats(img):
+    """
+    Color statistics of a proxy image (RGB or RGBA).
+
+    Returns:
+        dict: mean_luminance, histogram ({family: share}, shares of at least
+        MIN_SHARE), dominant_family (the largest bin), palette ([{'color':
+        '#rrggbb', 'share': float}], largest share first) and dominant_color
+        (the first palette color). None if the image has no opaque pixels.
+    """
+    rgb = img.convert('RGB')
+    pixels = np.asarray(rgb).reshape(-1, 3)
+    if img.mode == 'RGBA':
+        opaque = np.asarray(img.getchannel('A')).reshape(-1) >= 128
+        pixels = pixels[opaque]
+    if not len(pixels):
+        return None
+
+    hsv = np.asarray(rgb.convert('HSV'), dtype=np.float32).reshape(-1, 3)
+    if img.mode == 'RGBA':
+        hsv = hsv[opaque]
+    hsv *= np.array([360 / 256, 1 / 255, 1 / 255], dtype=np.float32)
+    shares = np.bincount(families(hsv), minlength=len(FAMILIES)) / len(pixels)
+    histogram = {family: round(float(share), 4) for family, share in zip(FAMILIES, shares) if share >= MIN_SHARE}
+
+    # Median cut over the opaque pixels only, laid out as a one-row image
+    quantized = PilImage.fromarray(np.ascontiguousarray(pixels[None])).quantize(PALETTE_SIZE, method=PilImage.Quantize.MEDIANCUT)
+    colors = np.asarray(quantized.getpalette()[:PALETTE_SIZE * 3]).reshape(-1, 3)
+    counts = np.bincount(np.asarray(quantized).reshape(-1), minlength=PALETTE_SIZE)[:len(colors)]
+    palette = [
+        {'color': _hex(colors[index]), 'share': round(float(counts[index]) / len(pixels), 4)}
+        for index in np.argsort(-counts, kind='stable') if counts[index]
+    ]
+
+    return {
+        'mean_luminance': round(float((pixels @ LUMA).mean()) / 255, 4),
+        'histogram': histogram,
+        'dominant_family': FAMILIES[int(np.argmax(shares))],
+        'palette': palette,
+        'dominant_color': palette[0]['color'],
+    }
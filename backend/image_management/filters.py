@@ -0,0 +1,45 @@
+import django_filters
+from .models import Image, COLOR_FAMILY_CHOICES
+
+# Share of an image a color family must cover to match the "color" filter, unless "color_share" is given
+DEFAULT_COLOR_SHARE = 0.1
+
+
+# Ordering filter for keyset-paginated listings
+class KeysetOrderingFilter(django_filters.OrderingFilter):
+    """Leaves out rows whose sort field is null: keyset pagination needs a comparable key on every row."""
+    def filter(self, qs, value):
+        for param in value or []:
+            if param:
+                qs = qs.filter(**{f"{self.get_ordering_value(param).lstrip('-')}__isnull": False})
+        return super().filter(qs, value)
+
+
+# Image filter set
+class ImageFilter(django_filters.FilterSet):
+    """
+        Filters on the color statistics computed at ingest (all indexed columns).
+            - color: images where the family covers at least color_share of the pixels (default 0.1)
+            - dominant_color: images whose largest color family is this one
+            - luminance_min / luminance_max: mean luminance, from 0 (black) to 1 (white)
+            - ordering: luminance or created_at, "-" for descending (images without statistics are left out of luminance orderings)
+    """
+    color = django_filters.ChoiceFilter(choices=COLOR_FAMILY_CHOICES, method='filter_color')
+    color_share = django_filters.NumberFilter(method='filter_color_share')
+    dominant_color = django_filters.ChoiceFilter(field_name='dominant_family', choices=COLOR_FAMILY_CHOICES)
+    luminance_min = django_filters.NumberFilter(field_name='mean_luminance', lookup_expr='gte')
+    luminance_max = django_filters.NumberFilter(field_name='mean_luminance', lookup_expr='lte')
+    ordering = KeysetOrderingFilter(fields=(('mean_luminance', 'luminance'), ('created_at', 'created_at')))
+
+    class Meta:
+        model = Image
+        fields = ['status', 'original_format']
+
+    def filter_color(self, queryset, name, value):
+        share = self.form.cleaned_data.get('color_share')
+        # Both conditions in one filter() call, so they apply to the same histogram row
+        return queryset.filter(colors__family=value, colors__share__gte=DEFAULT_COLOR_SHARE if share is None else share)
+
+    def filter_color_share(self, queryset, name, value):
+        # Only read by filter_color
+        return queryset
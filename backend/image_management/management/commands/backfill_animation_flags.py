@@ -0,0 +1,50 @@
+# images/management/commands/backfill_animation_flags.py
+
+import io
+import requests
+from django.core.management.base import BaseCommand
+from image_management.models import Image
+from image_management.metadata import read_upload_metadata
+from image_service.http_client import get_client
+
+
+class Command(BaseCommand):
+    help = 'Records whether stored images are animated, for images stored before it was recorded at ingest.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of rows written per UPDATE batch.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = (
+            Image.objects
+            .filter(is_animated__isnull=True, status=Image.Status.READY)
+            .exclude(original='')
+            .only('image_id', 'original', 'image_url')
+        )
+        self.stdout.write(self.style.SUCCESS(f'Backfilling animation flags for {queryset.count()} images...'))
+
+        batch, updated, failed = [], 0, 0
+        for image in queryset.iterator(chunk_size=batch_size):
+            try:
+                image.is_animated = self.read_is_animated(image)
+            except (requests.exceptions.RequestException, OSError, ValueError) as e:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'Failed to read image {image.image_id}: {e}'))
+                continue
+            batch.append(image)
+            if len(batch) >= batch_size:
+                updated += Image.objects.bulk_update(batch, ['is_animated'])
+                batch = []
+        if batch:
+            updated += Image.objects.bulk_update(batch, ['is_animated'])
+
+        self.stdout.write(self.style.SUCCESS(f'Animation flag backfill completed: {updated} updated, {failed} failed.'))
+
+    def read_is_animated(self, image):
+        if image.is_stored_remotely:
+            response = get_client().get(image.image_url)
+            response.raise_for_status()
+            return read_upload_metadata(io.BytesIO(response.content))['is_animated']
+        with image.open_original() as stored:
+            return read_upload_metadata(stored)['is_animated']
@@ -0,0 +1,54 @@
+# images/management/commands/backfill_color_stats.py
+
+import requests
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from image_management.models import Image, COLOR_FIELDS
+from image_management.colors import color_stats
+
+
+class Command(BaseCommand):
+    help = 'Computes the color statistics of stored images that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of rows written per UPDATE batch.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = (
+            Image.objects
+            .filter(mean_luminance__isnull=True, status=Image.Status.READY)
+            .exclude(original='')
+            .only('image_id', 'original', 'image_url')
+        )
+        self.stdout.write(self.style.SUCCESS(f'Backfilling color statistics for {queryset.count()} images...'))
+
+        batch, histograms, updated, failed = [], [], 0, 0
+        for image in queryset.iterator(chunk_size=batch_size):
+            try:
+                proxy = image.read_stored_proxy()
+            except (requests.exceptions.RequestException, OSError) as e:
+                proxy, error = None, e
+            else:
+                error = 'could not decode the image' if proxy is None else 'no opaque pixels'
+            stats = color_stats(proxy) if proxy is not None else None
+            if stats is None:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'Failed to analyze image {image.image_id}: {error}'))
+                continue
+            image.set_color_stats(stats)
+            batch.append(image)
+            histograms.append(stats['histogram'])
+            if len(batch) >= batch_size:
+                updated += self.write(batch, histograms)
+                batch, histograms = [], []
+        if batch:
+            updated += self.write(batch, histograms)
+
+        self.stdout.write(self.style.SUCCESS(f'Color statistics backfill completed: {updated} updated, {failed} failed.'))
+
+    def write(self, batch, histograms):
+        with transaction.atomic():
+            for image, histogram in zip(batch, histograms):
+                image.set_color_histogram(histogram)
+            return Image.objects.bulk_update(batch, COLOR_FIELDS)
@@ -0,0 +1,69 @@
+# images/management/commands/backfill_content_hashes.py
+
+import hashlib
+import requests
+from django.core.management.base import BaseCommand
+from image_management.metadata import compute_content_hash
+from image_management.models import Image
+from image_service.http_client import get_client
+
+# Size of the reads used while streaming an image to hash it
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def hash_remote_image(url):
+    """
+    Stream an image from its URL and return the SHA-256 hex digest of its content.
+    """
+    digest = hashlib.sha256()
+    with get_client().get(url, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_stored_image(image):
+    """
+    Return the SHA-256 hex digest of an image's stored original, read through
+    its storage, or streamed from its URL for remote rows.
+    """
+    if image.is_stored_remotely:
+        return hash_remote_image(image.image_url)
+    with image.open_original() as stored:
+        return compute_content_hash(stored)
+
+
+class Command(BaseCommand):
+    help = 'Computes the content hash of stored images that do not have one yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of rows written per UPDATE batch.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = (
+            Image.objects
+            .filter(content_hash__isnull=True, status=Image.Status.READY)
+            .exclude(original='')
+            .only('image_id', 'original', 'image_url')
+        )
+        self.stdout.write(self.style.SUCCESS(f'Backfilling content hashes for {queryset.count()} images...'))
+
+        batch, updated, failed = [], 0, 0
+        for image in queryset.iterator(chunk_size=batch_size):
+            try:
+                image.content_hash = hash_stored_image(image)
+            except (requests.exceptions.RequestException, OSError) as e:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'Failed to read image {image.image_id}: {e}'))
+                continue
+            batch.append(image)
+            if len(batch) >= batch_size:
+                updated += Image.objects.bulk_update(batch, ['content_hash'])
+                batch = []
+        if batch:
+            updated += Image.objects.bulk_update(batch, ['content_hash'])
+
+        self.stdout.write(self.style.SUCCESS(f'Content hash backfill completed: {updated} updated, {failed} failed.'))
+        self.stdout.write(f'HTTP client stats: {get_client().stats()}')
@@ -0,0 +1,45 @@
+# images/management/commands/backfill_perceptual_hashes.py
+
+import requests
+from django.core.management.base import BaseCommand
+from image_management.models import Image, PERCEPTUAL_HASH_FIELDS
+from image_management.similarity import dhash
+
+
+class Command(BaseCommand):
+    help = 'Computes the perceptual hash of stored images that do not have one yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of rows written per UPDATE batch.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = (
+            Image.objects
+            .filter(perceptual_hash__isnull=True, status=Image.Status.READY)
+            .exclude(original='')
+            .only('image_id', 'original', 'image_url')
+        )
+        self.stdout.write(self.style.SUCCESS(f'Backfilling perceptual hashes for {queryset.count()} images...'))
+
+        batch, updated, failed = [], 0, 0
+        for image in queryset.iterator(chunk_size=batch_size):
+            try:
+                proxy = image.read_stored_proxy()
+            except (requests.exceptions.RequestException, OSError) as e:
+                proxy, error = None, e
+            else:
+                error = 'could not decode the image'
+            if proxy is None:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'Failed to hash image {image.image_id}: {error}'))
+                continue
+            image.set_perceptual_hash(dhash(proxy))
+            batch.append(image)
+            if len(batch) >= batch_size:
+                updated += Image.objects.bulk_update(batch, PERCEPTUAL_HASH_FIELDS)
+                batch = []
+        if batch:
+            updated += Image.objects.bulk_update(batch, PERCEPTUAL_HASH_FIELDS)
+
+        self.stdout.write(self.style.SUCCESS(f'Perceptual hash backfill completed: {updated} updated, {failed} failed.'))
@@ -2,11 +2,13 @@
 
 import io
 import random
+from concurrent.futures import ThreadPoolExecutor
+from django.core.files.base import ContentFile
+from django.db import connection
 from django.core.management.base import BaseCommand
 from PIL import Image as PilImage, ImageDraw, ImageFont
 from faker import Faker
 from image_management.models import Image  # Your Image model
-import cloudinary.uploader
 
 fake = Faker()
 
@@ -45,35 +47,39 @@ def generate_fake_image():
     return img_byte_arr
 
 class Command(BaseCommand):
-    help = 'Generates fake images and uploads them to Cloudinary, saving the URL in the database.'
+    help = 'Generates fake images and saves them through the configured image storage.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50, help='Number of fake images to generate.')
+        parser.add_argument('--workers', type=int, default=4, help='Number of uploads running concurrently.')
 
     def handle(self, *args, **kwargs):
         self.stdout.write(self.style.SUCCESS('Starting fake image generation...'))
 
-        # Generate and upload 10 fake images as an example
-        for _ in range(50):
-            # Generate a fake image
-            fake_image = generate_fake_image()
-
-            # Upload the image to Cloudinary
-            upload_result = cloudinary.uploader.upload(fake_image, folder="fake_images/")
-
-            # Get the image URL from Cloudinary
-            image_url = upload_result.get("url")
-
-            # Save the image URL to the database
-            self.save_image_url_to_database(image_url)
-
-            self.stdout.write(self.style.SUCCESS(f'Fake image uploaded and URL saved: {image_url}'))
+        # Uploads are network bound, so several run at once over the storage's pooled connections
+        with ThreadPoolExecutor(max_workers=kwargs['workers']) as executor:
+            for image in executor.map(self.generate_and_save, range(kwargs['count'])):
+                self.stdout.write(self.style.SUCCESS(f'Fake image uploaded and URL saved: {image.image_url}'))
 
         self.stdout.write(self.style.SUCCESS('Fake image generation completed.'))
 
-    def save_image_url_to_database(self, image_url):
+    def generate_and_save(self, _):
+        """
+        Generate one fake image and store it (runs in a worker thread).
+        """
+        try:
+            return self.save_image_to_database(generate_fake_image())
+        finally:
+            # Each worker thread has its own database connection
+            connection.close()
+
+    def save_image_to_database(self, fake_image):
         """
-        Save the image URL into the database.
+        Store the image and save it into the database.
         """
         image = Image(
             owner=None,  # Or assign the appropriate user
-            original=image_url  # Save Cloudinary image URL
+            original=ContentFile(fake_image.getvalue(), name='fake.png')
         )
         image.save()
+        return image
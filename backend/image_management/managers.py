@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.db import models
+from .similarity import bands, band_neighbours, from_signed, hamming, search_radius
+
+
+# Manager for the Image model
+class ImageManager(models.Manager):
+    """
+         Adds lookups by content hash used to deduplicate uploads, and by
+         perceptual hash to find near duplicates.
+    """
+    def find_duplicate(self, content_hash, owner=None):
+        """
+        Return an existing image with the same content, or None.
+
+        Depending on IMAGE_DEDUP_SCOPE the lookup covers the owner's images only
+        ('owner'), every image ('global'), or is disabled ('off'). An image of the
+        same owner is preferred, since it can be returned as-is.
+        """
+        scope = getattr(settings, 'IMAGE_DEDUP_SCOPE', 'owner')
+        if not content_hash or scope == 'off':
+            return None
+
+        candidates = self.filter(content_hash=content_hash).exclude(status='failed')
+        own = candidates.filter(owner=owner) if owner is not None else candidates.filter(owner__isnull=True)
+        duplicate = own.order_by('created_at').first()
+        if duplicate is None and scope == 'global':
+            # Another owner's image can only be shared once it is stored
+            duplicate = candidates.filter(status='ready').order_by('created_at').first()
+        return duplicate
+
+    def find_similar(self, perceptual_hash, distance, exclude=None):
+        """
+        Return (distance, image id) pairs of the images whose perceptual hash is
+        within ``distance`` bits of ``perceptual_hash`` (unsigned), closest first.
+
+        Only rows sharing a band with the hash, up to distance // 4 bits, are read
+        (multi-index hashing, see similarity.py); each lookup is an index scan.
+        """
+        radius = search_radius(distance)
+        query = models.Q()
+        for index, band in enumerate(bands(perceptual_hash)):
+            query |= models.Q(**{f'perceptual_band_{index}__in': band_neighbours(band, radius)})
+        candidates = self.filter(query).exclude(status='failed')
+        if exclude is not None:
+            candidates = candidates.exclude(pk=exclude)
+
+        matches = []
+        for pk, value in candidates.values_list('pk', 'perceptual_hash').iterator():
+            bits = hamming(perceptual_hash, from_signed(value))
+            if bits <= distance:
+                matches.append((bits, pk))
+        matches.sort(key=lambda match: match[0])
+        return matches
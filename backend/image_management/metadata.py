@@ -0,0 +1,143 @@
+from PIL import ExifTags, Image as PilImage, ImageFile, ImageOps
+import hashlib
+from image_service.http_client import get_client
+
+# Number of bytes pulled from a remote image per read while looking for its header
+REMOTE_HEADER_CHUNK_SIZE = 16 * 1024
+
+# Longest side of the proxy the perceptual hash and color statistics are computed on
+PROXY_SIZE = 128
+
+# EXIF orientations stored a quarter turn from upright (width and height swap)
+QUARTER_TURNS = (5, 6, 7, 8)
+
+
+def upright_size(img):
+    """Dimensions of an opened image once its EXIF orientation is applied, as transforms see it."""
+    if img.getexif().get(ExifTags.Base.Orientation) in QUARTER_TURNS:
+        return img.height, img.width
+    return img.size
+
+
+def _file_size(file):
+    """Return the size of an uploaded or local file without reading its content."""
+    size = getattr(file, 'size', None)
+    if isinstance(size, int):
+        return size
+    position = file.tell()
+    file.seek(0, 2)
+    size = file.tell()
+    file.seek(position)
+    return size
+
+
+def compute_content_hash(file):
+    """
+    Return the SHA-256 hex digest of a file's content.
+
+    The file is read chunk by chunk (``chunks()`` for uploads), so large uploads
+    are never loaded into memory at once. The file position is restored.
+    """
+    digest = hashlib.sha256()
+    position = file.tell()
+    file.seek(0)
+    if hasattr(file, 'chunks'):
+        for chunk in file.chunks():
+            digest.update(chunk)
+    else:
+        for chunk in iter(lambda: file.read(REMOTE_HEADER_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    file.seek(position)
+    return digest.hexdigest()
+
+
+def read_upload_metadata(file):
+    """
+    Read format, dimensions and size from an uploaded file before it is stored.
+
+    Args:
+        file: An in-memory or temporary uploaded file (any seekable file object).
+
+    Returns:
+        dict: original_format, width, height (upright, see upright_size),
+        size_bytes and is_animated.
+
+    PIL only parses the image header here (and, for GIFs, skips over the first
+    frame to find a second one); the pixel data is never decoded.
+    The file position is restored so the storage backend uploads the full content.
+    """
+    if hasattr(file, 'seekable') and not file.seekable():
+        raise ValueError("Uploaded file is not seekable.")
+    position = file.tell()
+    try:
+        file.seek(0)
+        with PilImage.open(file) as img:
+            width, height = upright_size(img)
+            metadata = {
+                'original_format': img.format.lower(),
+                'width': width,
+                'height': height,
+                'is_animated': bool(getattr(img, 'is_animated', False)),
+            }
+    finally:
+        file.seek(position)
+    metadata['size_bytes'] = _file_size(file)
+    return metadata
+
+
+def read_proxy(file):
+    """
+    Decode a small RGB or RGBA copy of an image (at most PROXY_SIZE pixels a side),
+    for the features computed at ingest. Returns None if it cannot be decoded.
+
+    JPEGs are decoded at reduced scale, so the full image is never in memory.
+    The EXIF orientation is applied. The file position is restored.
+    """
+    position = file.tell()
+    try:
+        file.seek(0)
+        with PilImage.open(file) as img:
+            img.draft('RGB', (PROXY_SIZE, PROXY_SIZE))
+            proxy = ImageOps.exif_transpose(img)
+            proxy = proxy.convert('RGBA' if proxy.has_transparency_data else 'RGB')
+            proxy.thumbnail((PROXY_SIZE, PROXY_SIZE), PilImage.Resampling.LANCZOS, reducing_gap=2.0)
+            return proxy
+    except (OSError, ValueError):
+        return None
+    finally:
+        file.seek(position)
+
+
+def fetch_remote_metadata(url):
+    """
+    Read format, dimensions and size of an image that is only known by its URL.
+
+    Only used for rows created from an already uploaded URL (e.g. the fake image
+    generator). The response is streamed and fed to PIL's incremental parser until
+    the header is parsed, so the full body is not downloaded.
+    """
+    with get_client().get(url, stream=True) as response:
+        response.raise_for_status()
+        parser = ImageFile.Parser()
+        received = 0
+        for chunk in response.iter_content(REMOTE_HEADER_CHUNK_SIZE):
+            parser.feed(chunk)
+            received += len(chunk)
+            if parser.image is not None:
+                break
+        img = parser.image
+        if img is None:
+            raise ValueError("Could not read image header.")
+        width, height = upright_size(img)
+        size_bytes = response.headers.get('Content-Length')
+        if size_bytes is None:
+            # No length advertised; count the rest of the body without keeping it
+            for chunk in response.iter_content(REMOTE_HEADER_CHUNK_SIZE):
+                received += len(chunk)
+            size_bytes = received
+    return {
+        'original_format': img.format.lower(),
+        'width': width,
+        'height': height,
+        'size_bytes': int(size_bytes),
+    }
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-18 05:28
+
+import image_management.storage
+import re
+from django.db import migrations, models
+
+# Value stored by CloudinaryField, e.g. "image/upload/v1712345678/abc123.png"
+CLOUDINARY_FIELD_RE = re.compile(r'^(?:image|raw|video)/(?:upload|private|authenticated)/(?:v\d+/)?(?P<public_id>.+)$')
+
+
+def cloudinary_values_to_names(apps, schema_editor):
+    """Rewrite CloudinaryField values as storage names (the public id, with its extension)."""
+    Image = apps.get_model('image_management', 'Image')
+    for image in Image.objects.exclude(original='').only('image_id', 'original').iterator():
+        match = CLOUDINARY_FIELD_RE.match(image.original.name)
+        if match:
+            Image.objects.filter(pk=image.pk).update(original=match.group('public_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_management', '0005_image_content_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='original',
+            field=models.FileField(max_length=255, storage=image_management.storage.get_image_storage, upload_to='images/', verbose_name='image'),
+        ),
+        migrations.RunPython(cloudinary_values_to_names, migrations.RunPython.noop),
+    ]
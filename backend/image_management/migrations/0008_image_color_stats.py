@@ -0,0 +1,47 @@
+# Generated by Django 6.0 on 2026-10-18 06:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_management', '0007_image_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='dominant_color',
+            field=models.CharField(blank=True, max_length=7, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='dominant_family',
+            field=models.CharField(blank=True, choices=[('black', 'Black'), ('gray', 'Gray'), ('white', 'White'), ('red', 'Red'), ('orange', 'Orange'), ('yellow', 'Yellow'), ('green', 'Green'), ('cyan', 'Cyan'), ('blue', 'Blue'), ('purple', 'Purple'), ('pink', 'Pink'), ('brown', 'Brown')], db_index=True, max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='mean_luminance',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='palette',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ImageColor',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('family', models.CharField(choices=[('black', 'Black'), ('gray', 'Gray'), ('white', 'White'), ('red', 'Red'), ('orange', 'Orange'), ('yellow', 'Yellow'), ('green', 'Green'), ('cyan', 'Cyan'), ('blue', 'Blue'), ('purple', 'Purple'), ('pink', 'Pink'), ('brown', 'Brown')], max_length=10)),
+                ('share', models.FloatField()),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='colors', to='image_management.image')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['family', 'share'], name='image_color_family_share')],
+                'constraints': [models.UniqueConstraint(fields=('image', 'family'), name='unique_image_color_family')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_management', '0009_image_created_at_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='is_animated',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 06:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_management', '0010_image_is_animated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='token_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -1,52 +1,268 @@
 from django.db import models
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from cloudinary.models import CloudinaryField
-from PIL import Image as PilImage
-from io import BytesIO
+from .metadata import read_upload_metadata, fetch_remote_metadata, compute_content_hash, read_proxy
+from .managers import ImageManager
+from .similarity import dhash, bands, to_signed
+from .colors import FAMILIES, color_stats
+from .storage import get_image_storage, is_remote_name, CloudinaryImageStorage
+from image_service.http_client import get_client
+import hashlib
+import io
 import requests
+import secrets
 import uuid
 
+# Fields filled in from the image itself
+METADATA_FIELDS = ('original_format', 'width', 'height', 'size_bytes')
+
+# Perceptual hash and its indexed bands (see similarity.py)
+PERCEPTUAL_HASH_FIELDS = ('perceptual_hash', 'perceptual_band_0', 'perceptual_band_1', 'perceptual_band_2', 'perceptual_band_3')
+
+# Color statistics stored on the image (see colors.py); the histogram is in ImageColor
+COLOR_FIELDS = ('mean_luminance', 'dominant_family', 'dominant_color', 'palette')
+
+# Everything read from the stored original, recomputed when it is replaced
+DERIVED_FIELDS = ('image_url', *METADATA_FIELDS, 'is_animated', 'content_hash', *PERCEPTUAL_HASH_FIELDS, *COLOR_FIELDS)
+
+COLOR_FAMILY_CHOICES = [(family, family.capitalize()) for family in FAMILIES]
+
 # Model to represent an image uploaded by a user
 class Image(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        PROCESSING = 'processing', 'Processing'
+        READY = 'ready', 'Ready'
+        FAILED = 'failed', 'Failed'
+
     image_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
-    original = CloudinaryField('image')
+    original = models.FileField('image', upload_to='images/', storage=get_image_storage, max_length=255)
     image_url = models.URLField(blank=True, null=True)
     original_format = models.CharField(max_length=10, blank=True, null=True)
     width = models.PositiveIntegerField(blank=True, null=True)
     height = models.PositiveIntegerField(blank=True, null=True)
     size_bytes = models.PositiveIntegerField(blank=True, null=True)
+    is_animated = models.BooleanField(blank=True, null=True)  # None: not known (rows from before it was recorded)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.READY, db_index=True)
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    perceptual_hash = models.BigIntegerField(blank=True, null=True)  # 64-bit dHash, stored signed
+    perceptual_band_0 = models.IntegerField(blank=True, null=True, db_index=True)
+    perceptual_band_1 = models.IntegerField(blank=True, null=True, db_index=True)
+    perceptual_band_2 = models.IntegerField(blank=True, null=True, db_index=True)
+    perceptual_band_3 = models.IntegerField(blank=True, null=True, db_index=True)
+    mean_luminance = models.FloatField(blank=True, null=True, db_index=True)  # 0 (black) to 1 (white)
+    dominant_family = models.CharField(max_length=10, choices=COLOR_FAMILY_CHOICES, blank=True, null=True, db_index=True)
+    dominant_color = models.CharField(max_length=7, blank=True, null=True)  # "#rrggbb"
+    palette = models.JSONField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ImageManager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the listing (users.pagination.KeysetPagination)
+            models.Index(fields=['created_at', 'image_id'], name='image_created_at_id'),
+        ]
+
+    def has_metadata(self):
+        """Whether every metadata field is already set."""
+        return all(getattr(self, f) for f in METADATA_FIELDS)
+
+    def set_metadata(self, metadata):
+        """Copy format, dimensions and size onto the instance, and whether it is animated when known."""
+        for field in METADATA_FIELDS:
+            setattr(self, field, metadata[field])
+        if 'is_animated' in metadata:
+            self.is_animated = metadata['is_animated']
+
+    def set_perceptual_hash(self, value):
+        """Set the perceptual hash (unsigned, or None) and its bands."""
+        values = (to_signed(value), *bands(value)) if value is not None else (None,) * len(PERCEPTUAL_HASH_FIELDS)
+        for field, field_value in zip(PERCEPTUAL_HASH_FIELDS, values):
+            setattr(self, field, field_value)
+
+    def set_color_stats(self, stats):
+        """Set the color fields from color_stats() output, or clear them for None."""
+        for field in COLOR_FIELDS:
+            setattr(self, field, stats[field] if stats else None)
+
+    def set_color_histogram(self, histogram):
+        """Replace the image's color histogram rows ({family: share})."""
+        self.colors.all().delete()
+        ImageColor.objects.bulk_create([ImageColor(image=self, family=family, share=share) for family, share in histogram.items()])
+
+    @property
+    def is_stored_remotely(self):
+        """Whether the original lives behind a URL rather than in a local or in-memory storage."""
+        return is_remote_name(self.original.name) or isinstance(self.original.storage, CloudinaryImageStorage)
+
+    def open_original(self):
+        """
+        Open the stored original for reading.
+
+        Local storage returns a read-only memory map, so decoding reads straight
+        from the page cache without copying the file into Python memory.
+        """
+        storage = self.original.storage
+        if hasattr(storage, 'open_mapped'):
+            return storage.open_mapped(self.original.name)
+        return storage.open(self.original.name, 'rb')
+
+    def read_stored_proxy(self):
+        """
+        Decode a small copy of the stored original (see metadata.read_proxy), from
+        its storage or, for remote rows, its URL. Returns None if it cannot be decoded.
+
+        Raises:
+            requests.exceptions.RequestException: If a remote original cannot be fetched.
+        """
+        if self.is_stored_remotely:
+            response = get_client().get(self.image_url)
+            response.raise_for_status()
+            return read_proxy(io.BytesIO(response.content))
+        with self.open_original() as stored:
+            return read_proxy(stored)
+
     def save(self, *args, **kwargs):
-        # First save to ensure file is uploaded and .url is available
-        super().save(*args, **kwargs)
+        changed = []
+        histogram = None
+
+        if self.original and not self.original._committed:
+            upload = self.original.file
+
+            # A new upload replacing a stored original: read everything again from the new file
+            if not self._state.adding and Image.objects.filter(pk=self.pk).exclude(original='').exists():
+                for field in DERIVED_FIELDS:
+                    setattr(self, field, None)
+                histogram = {}
+                changed.extend(DERIVED_FIELDS)
+
+            # Read the details from the upload itself (header only) before it is stored
+            if not self.has_metadata():
+                try:
+                    self.set_metadata(read_upload_metadata(upload))
+                except Exception as e:
+                    raise ValidationError(f"Error processing image: {e}")
+                changed.extend((*METADATA_FIELDS, 'is_animated'))
+
+            if not self.content_hash:
+                self.content_hash = compute_content_hash(upload)
+                changed.append('content_hash')
+
+            # Perceptual hash and color statistics, from one small decode
+            if self.perceptual_hash is None or self.mean_luminance is None:
+                proxy = read_proxy(upload)
+                if proxy is not None and self.perceptual_hash is None:
+                    self.set_perceptual_hash(dhash(proxy))
+                    changed.extend(PERCEPTUAL_HASH_FIELDS)
+                stats = color_stats(proxy) if proxy is not None and self.mean_luminance is None else None
+                if stats is not None:
+                    self.set_color_stats(stats)
+                    histogram = stats['histogram']
+                    changed.extend(COLOR_FIELDS)
+
+            # Store now so the resulting url is known before the row is written
+            self._meta.get_field('original').pre_save(self, self._state.adding)
+            changed.append('original')
 
-        updated = False
         # Only update image_url if not set and file has .url
-        if not self.image_url and self.original and hasattr(self.original, 'url'):
+        if not self.image_url and self.original:
             self.image_url = self.original.url
-            updated = True
+            changed.append('image_url')
 
-        # Extract image details if not already set (to prevent overwriting on updates)
-        if self.original and hasattr(self.original, 'url') and not (self.original_format and self.width and self.height and self.size_bytes):
+        # Fallback for rows without an upload: read the details from the stored image
+        if self.original and not self.has_metadata():
             try:
-                response = requests.get(self.original.url)
-                response.raise_for_status()  # Raise an exception for any failed request
-                img = PilImage.open(BytesIO(response.content))
-                self.original_format = img.format.lower()  # Image format
-                self.width, self.height = img.size        # Image width and height
-                self.size_bytes = len(response.content)   # Image size in bytes
-                updated = True
+                if self.is_stored_remotely:
+                    self.set_metadata(fetch_remote_metadata(self.image_url))
+                else:
+                    with self.open_original() as stored:
+                        self.set_metadata(read_upload_metadata(stored))
             except requests.exceptions.RequestException as e:
                 raise ValidationError(f"Error fetching image: {e}")
             except Exception as e:
                 raise ValidationError(f"Error processing image: {e}")
+            changed.extend((*METADATA_FIELDS, 'is_animated'))
+
+        # Keep partial saves consistent with what was filled in above
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and changed:
+            kwargs['update_fields'] = set(update_fields) | set(changed)
+
+        super().save(*args, **kwargs)
+        if histogram is not None:
+            self.set_color_histogram(histogram)
+
+    def copy_for(self, owner):
+        """Create a new image for ``owner`` that reuses this image's stored asset."""
+        copy = Image.objects.create(
+            owner=owner,
+            original=self.original.name,
+            image_url=self.image_url,
+            original_format=self.original_format,
+            width=self.width,
+            height=self.height,
+            size_bytes=self.size_bytes,
+            is_animated=self.is_animated,
+            content_hash=self.content_hash,
+            **{field: getattr(self, field) for field in (*PERCEPTUAL_HASH_FIELDS, *COLOR_FIELDS)},
+        )
+        copy.set_color_histogram({color.family: color.share for color in self.colors.all()})
+        return copy
+
+
+# Model to store one bin of an image's coarse color histogram: the share of its pixels in a color family
+class ImageColor(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='colors')
+    family = models.CharField(max_length=10, choices=COLOR_FAMILY_CHOICES)
+    share = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'family'], name='unique_image_color_family'),
+        ]
+        indexes = [
+            # "Images with at least this share of a family" is one range scan
+            models.Index(fields=['family', 'share'], name='image_color_family_share'),
+        ]
+
+
+def upload_token_hash(token):
+    """Hash stored for an upload session's secret token."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# Model to track a resumable, chunked upload until it is turned into an Image
+class UploadSession(models.Model):
+    class Status(models.TextChoices):
+        ACTIVE = 'active', 'Active'
+        COMPLETE = 'complete', 'Complete'
+
+    session_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=50)
+    total_size = models.PositiveIntegerField()
+    received_bytes = models.PositiveIntegerField(default=0)
+    staged_path = models.CharField(max_length=255)
+    token_hash = models.CharField(max_length=64, blank=True, db_index=True)  # Sessions opened anonymously, see issue_token
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.ACTIVE)
+    image = models.ForeignKey(Image, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_sessions')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_complete(self):
+        """Whether every byte of the file has been received."""
+        return self.received_bytes == self.total_size
 
-        # Save again if we updated any fields
-        if updated:
-            super().save(update_fields=[
-                f for f in ['image_url', 'original_format', 'width', 'height', 'size_bytes']
-                if getattr(self, f, None) is not None
-            ])
+    def issue_token(self):
+        """
+        Generate the secret token an anonymous client proves it opened the session
+        with. Only its hash is stored; the token itself is returned once.
+        """
+        token = secrets.token_urlsafe(32)
+        self.token_hash = upload_token_hash(token)
+        return token
@@ -1,18 +1,54 @@
 from rest_framework import serializers
-from .models import Image
+from django.urls import reverse
+from .models import Image, UploadSession
 from users.serializers import UserSerializer
-from .validations import validate_image_size, validate_image_type
+from .validations import validate_image_size, validate_image_type, validate_image_header, VALID_IMAGE_TYPES, MAX_IMAGE_SIZE
 from rest_framework.exceptions import ValidationError
+from django.db import transaction
+from .staging import stage_upload, staging_path, discard_staged
+from .tasks import ingest_image
+from .metadata import compute_content_hash
+from .similarity import DEFAULT_DISTANCE, MAX_DISTANCE
+from transformations.models import Derivative
+from transformations.serializers import VariantSerializer
 
 # Image serializer
 class ImageSerializer(serializers.ModelSerializer):
     owner = UserSerializer(read_only=True)
     image_url = serializers.URLField(read_only=True)
+    delivery_url = serializers.SerializerMethodField()
+    variants = serializers.SerializerMethodField()
     
     class Meta:
         model = Image
-        fields = ('image_id', 'owner', 'original', 'image_url', 'original_format', 'width', 'height', 'size_bytes', 'created_at')
+        fields = (
+            'image_id', 'owner', 'original', 'image_url', 'delivery_url', 'original_format', 'width', 'height', 'size_bytes', 'is_animated', 'status',
+            'mean_luminance', 'dominant_family', 'dominant_color', 'palette', 'variants', 'created_at',
+        )
+        read_only_fields = ('is_animated', 'mean_luminance', 'dominant_family', 'dominant_color', 'palette')
 
+    def get_delivery_url(self, obj):
+        # Serves the image in the preferred format the client's Accept header allows
+        url = reverse('image-delivery', args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def get_variants(self, obj):
+        # Prefetched by ImageViewSet; other callers fall back to a query
+        variants = getattr(obj, 'variants', None)
+        if variants is None:
+            variants = obj.derivatives.filter(kind=Derivative.Kind.VARIANT).order_by('width')
+        return VariantSerializer(variants, many=True, context=self.context).data
+
+
+
+# Similar images query serializer
+class SimilarImagesQuerySerializer(serializers.Serializer):
+    distance = serializers.IntegerField(
+        default=DEFAULT_DISTANCE, min_value=0, max_value=MAX_DISTANCE,
+        help_text="Largest Hamming distance between perceptual hashes (bits out of 64).",
+    )
+    limit = serializers.IntegerField(default=20, min_value=1, max_value=100, help_text="Largest number of images returned.")
 
 
 # Image upload serializer
@@ -31,6 +67,7 @@ class ImageUploadSerializer(serializers.ModelSerializer):
         if not file:
             raise ValidationError("No file provided.")
         validate_image_size(file)
+        validate_image_header(file)
         validate_image_type(file)
         return attrs
 
@@ -38,7 +75,74 @@ class ImageUploadSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         user = getattr(request, 'user', None)
         if user and user.is_authenticated:
-            image_instance = Image.objects.create(owner=user, **validated_data)
-        else:
-            image_instance = Image.objects.create(**validated_data)
-        return image_instance
\ No newline at end of file
+            validated_data['owner'] = user
+        defer = validated_data.pop('defer', False)
+        staged_path = validated_data.pop('staged_path', None)
+
+        # Reuse the stored asset when the same bytes were uploaded before
+        validated_data['content_hash'] = compute_content_hash(validated_data['original'])
+        duplicate = Image.objects.find_duplicate(validated_data['content_hash'], validated_data.get('owner'))
+        if duplicate is not None:
+            if staged_path is not None:
+                discard_staged(staged_path)
+            if duplicate.owner_id == getattr(validated_data.get('owner'), 'pk', None):
+                return duplicate
+            return duplicate.copy_for(validated_data.get('owner'))
+
+        if defer:
+            return self.create_deferred(validated_data, staged_path)
+        return Image.objects.create(**validated_data)
+
+    def create_deferred(self, validated_data, staged_path=None):
+        """Stage the upload locally and leave storage and metadata to a Celery task."""
+        file = validated_data.pop('original')
+        if staged_path is None:
+            staged_path = stage_upload(file)
+        image_instance = Image.objects.create(status=Image.Status.PENDING, **validated_data)
+        name, content_type = file.name, getattr(file, 'content_type', None)
+        transaction.on_commit(
+            lambda: ingest_image.delay(str(image_instance.pk), staged_path, name, content_type)
+        )
+        return image_instance
+
+
+
+# Chunked upload session serializer
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ['session_id', 'filename', 'content_type', 'total_size', 'received_bytes', 'status', 'image', 'created_at']
+        read_only_fields = ['session_id', 'received_bytes', 'status', 'image', 'created_at']
+
+    def validate_content_type(self, value):
+        if value not in VALID_IMAGE_TYPES:
+            raise ValidationError("Unsupported file type. Only JPEG, PNG, and GIF are allowed.")
+        return value
+
+    def validate_total_size(self, value):
+        if value <= 0:
+            raise ValidationError("File size must be greater than zero.")
+        if value > MAX_IMAGE_SIZE:
+            raise ValidationError(f"File size exceeds the maximum allowed size of {MAX_IMAGE_SIZE / (1024 * 1024)}MB.")
+        return value
+
+    def create(self, validated_data):
+        request = self.context.get('request')
+        user = getattr(request, 'user', None)
+        if user and user.is_authenticated:
+            validated_data['owner'] = user
+        validated_data['staged_path'] = staging_path(validated_data['filename'])
+        session = UploadSession(**validated_data)
+        if session.owner is None:
+            # Anonymous sessions are only reachable with this token (X-Upload-Token header)
+            session.upload_token = session.issue_token()
+        session.save()
+        return session
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Only known right after creation: the token is not stored
+        token = getattr(instance, 'upload_token', None)
+        if token:
+            data['upload_token'] = token
+        return data
@@ -0,0 +1,85 @@
+"""
+Perceptual hashing for near-duplicate lookup.
+
+Each image gets a 64-bit difference hash (dHash): the image is reduced to 9x8
+gray pixels and each bit records whether a pixel is brighter than its right
+neighbour. Re-encoded, resized or lightly edited copies of a photo get hashes
+a few bits apart, so near duplicates are the images within a small Hamming
+distance.
+
+Lookups use multi-index hashing. The hash is also stored as four 16-bit bands,
+each with its own database index. Two hashes within distance k agree on at
+least one band up to k // 4 bits (pigeonhole), so only the rows having a band
+that close to the query's are fetched and compared in full. The indexes are
+maintained by the database as images arrive; nothing needs rebuilding.
+"""
+from functools import lru_cache
+from itertools import combinations
+from PIL import Image as PilImage
+
+# Side of the gray grid compared by the hash (one more column, for the differences)
+HASH_SIZE = 8
+
+# Bands the hash is split into for lookups, and their width
+BANDS = 4
+BAND_BITS = 16
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# Hamming distances accepted by lookups. Up to 11, each band is searched within
+# 2 bits (137 values per band); beyond that the candidate lists grow quickly.
+DEFAULT_DISTANCE = 6
+MAX_DISTANCE = 11
+
+
+def dhash(img):
+    """
+    Return the 64-bit difference hash of an image (the proxy from metadata.read_proxy,
+    so the EXIF orientation is applied and rotated copies hash alike).
+    """
+    gray = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), PilImage.Resampling.LANCZOS)
+    pixels = gray.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for column in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+def to_signed(value):
+    """Hash as stored in a signed 64-bit column."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def from_signed(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def bands(value):
+    """The hash's BANDS bands, most significant first."""
+    return tuple((value >> (BAND_BITS * (BANDS - 1 - index))) & BAND_MASK for index in range(BANDS))
+
+
+def hamming(first, second):
+    """Number of bits two hashes differ by."""
+    return ((first ^ second) & ((1 << 64) - 1)).bit_count()
+
+
+@lru_cache(maxsize=MAX_DISTANCE // BANDS + 1)
+def _flip_masks(radius):
+    """Every mask of at most ``radius`` bits set within a band."""
+    masks = [0]
+    for count in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), count):
+            masks.append(sum(1 << bit for bit in bits))
+    return tuple(masks)
+
+
+def band_neighbours(band, radius):
+    """Band values within ``radius`` bits of ``band``."""
+    return [band ^ mask for mask in _flip_masks(radius)]
+
+
+def search_radius(distance):
+    """Bits searched around each band so that no hash within ``distance`` is missed."""
+    return distance // BANDS
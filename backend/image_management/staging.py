@@ -0,0 +1,74 @@
+import os
+import uuid
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+# Size of the reads used when copying request bodies to staging
+STAGING_CHUNK_SIZE = 64 * 1024
+
+
+def staging_path(name):
+    """Return a fresh path in the staging area, keeping the extension of ``name``."""
+    os.makedirs(settings.IMAGE_STAGING_ROOT, exist_ok=True)
+    extension = os.path.splitext(name or '')[1].lower()
+    return os.path.join(settings.IMAGE_STAGING_ROOT, f'{uuid.uuid4().hex}{extension}')
+
+
+def stage_upload(file):
+    """
+    Copy an uploaded file to local staging, chunk by chunk.
+
+    Args:
+        file: The uploaded file received by the view.
+
+    Returns:
+        str: Path of the staged copy.
+    """
+    path = staging_path(file.name)
+    with open(path, 'wb') as staged:
+        for chunk in file.chunks():
+            staged.write(chunk)
+    return path
+
+
+def write_chunk(path, offset, stream, length):
+    """
+    Write ``length`` bytes read from ``stream`` into a staged file at ``offset``.
+
+    The body is copied in STAGING_CHUNK_SIZE pieces, so memory use does not grow
+    with the chunk size. Writes are positional, so replaying the same range after
+    a dropped connection is harmless.
+
+    Returns:
+        int: Number of bytes written.
+    """
+    written = 0
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        while written < length:
+            data = stream.read(min(STAGING_CHUNK_SIZE, length - written))
+            if not data:
+                break
+            os.pwrite(fd, data, offset + written)
+            written += len(data)
+    finally:
+        os.close(fd)
+    return written
+
+
+def open_staged(path, name, content_type=None):
+    """Open a staged file as an upload so it goes through the normal storage path."""
+    return UploadedFile(
+        file=open(path, 'rb'),
+        name=name,
+        content_type=content_type,
+        size=os.path.getsize(path),
+    )
+
+
+def discard_staged(path):
+    """Remove a staged file once it is no longer needed."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
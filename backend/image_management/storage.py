@@ -0,0 +1,117 @@
+import mmap
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, storages
+from django.utils.deconstruct import deconstructible
+from cloudinary_storage.storage import MediaCloudinaryStorage
+import cloudinary
+import cloudinary.exceptions
+import cloudinary.utils
+from cloudinary.api_client.execute_request import EXCEPTION_CODES
+import os
+from image_service.http_client import get_client
+
+
+def get_image_storage():
+    """
+    Return the storage holding image originals and derivatives.
+
+    The backend is configured by STORAGES['images'] (see IMAGE_STORAGE_BACKEND).
+    Resolved lazily so the model does not bind to a backend at import time.
+    """
+    return storages['images']
+
+
+def is_remote_name(name):
+    """Whether a stored name is a full URL (rows created from an already uploaded image)."""
+    return bool(name) and name.startswith(('http://', 'https://'))
+
+
+@deconstructible
+class CloudinaryImageStorage(MediaCloudinaryStorage):
+    """
+    Cloudinary backend.
+
+    Names are stored as full Cloudinary public ids, so no media prefix is added,
+    and rows that only hold a delivery URL resolve to that URL. Reads go through
+    the shared pooled HTTP client, and so do uploads: they are built and signed
+    with the Cloudinary SDK's helpers but sent through the client's session, so
+    they reuse its keep-alive connections, timeouts, retries and counters rather
+    than the SDK's own connection pool (a module-level urllib3 pool the SDK
+    uploader cannot be given a session for).
+    """
+    def _get_prefix(self):
+        return ''
+
+    def _open(self, name, mode='rb'):
+        response = get_client().get(self.url(name))
+        if response.status_code == 404:
+            raise FileNotFoundError(name)
+        response.raise_for_status()
+        file = ContentFile(response.content)
+        file.name = name
+        file.mode = mode
+        return file
+
+    def _upload(self, name, content):
+        options = {'use_filename': True, 'resource_type': self._get_resource_type(name), 'tags': self.TAG}
+        folder = os.path.dirname(name)
+        if folder:
+            options['folder'] = folder
+        params = cloudinary.utils.sign_request(cloudinary.utils.cleanup_params(cloudinary.utils.build_upload_params(**options)), options)
+        # Every signed parameter is sent whatever its value (0, or False sent as "0"), or the signature
+        # would not match; list parameters as repeated "key[]" fields, as the SDK does
+        fields = []
+        for key, value in params.items():
+            if isinstance(value, list):
+                fields.extend((f'{key}[]', item) for item in value)
+            elif value is not None:
+                fields.append((key, value))
+        content.seek(0)
+        response = get_client().post(
+            cloudinary.utils.cloudinary_api_url('upload', **options),
+            data=fields,
+            files={'file': (os.path.basename(name), content)},
+            headers={'User-Agent': cloudinary.get_user_agent()},
+        )
+        try:
+            result = response.json()
+        except ValueError:
+            result = None
+        if not isinstance(result, dict) or response.status_code >= 400 or 'error' in result:
+            error = result.get('error') if isinstance(result, dict) else None
+            message = error.get('message') if isinstance(error, dict) else None
+            exception_class = EXCEPTION_CODES.get(response.status_code, cloudinary.exceptions.Error)
+            raise exception_class(message or f"Unexpected upload response ({response.status_code}).")
+        return result
+
+    def exists(self, name):
+        response = get_client().head(self.url(name))
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    def size(self, name):
+        response = get_client().head(self.url(name))
+        if response.status_code == 200:
+            return int(response.headers['content-length'])
+        return None
+
+    def url(self, name):
+        if is_remote_name(name):
+            return name
+        return super().url(name)
+
+
+@deconstructible
+class LocalImageStorage(FileSystemStorage):
+    """
+    Local disk backend (MEDIA_ROOT by default).
+
+    Reads for decoding go through memory-mapped files, so originals are paged in
+    by the kernel instead of being copied into Python memory.
+    """
+    def open_mapped(self, name):
+        """Return a read-only memory map of a stored file (a seekable, file-like object)."""
+        with open(self.path(name), 'rb') as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
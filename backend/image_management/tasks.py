@@ -0,0 +1,55 @@
+from celery import shared_task
+from django.core.exceptions import ValidationError
+from .models import Image
+from .staging import open_staged, discard_staged
+import logging
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=10)
+def ingest_image(self, image_id, staged_path, name, content_type=None):
+    """
+    Store a staged upload and fill in the metadata of its pending Image row.
+
+    Args:
+        image_id: Primary key of the pending Image.
+        staged_path: Local path written by the upload view.
+        name: Original file name of the upload.
+        content_type: Content type declared by the client.
+    """
+    try:
+        image = Image.objects.get(pk=image_id)
+    except Image.DoesNotExist:
+        # The row was deleted while queued; nothing left to ingest
+        logger.warning(f"Image {image_id} no longer exists, discarding staged upload.")
+        discard_staged(staged_path)
+        return
+
+    Image.objects.filter(pk=image_id).update(status=Image.Status.PROCESSING)
+
+    try:
+        upload = open_staged(staged_path, name, content_type)
+        with upload:
+            image.original = upload
+            image.status = Image.Status.READY
+            image.save()
+    except ValidationError as e:
+        # The image itself is unusable, retrying will not help
+        logger.error(f"Failed to ingest image {image_id}: {e}")
+        Image.objects.filter(pk=image_id).update(status=Image.Status.FAILED)
+        discard_staged(staged_path)
+        return
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            logger.warning(f"Retrying ingestion of image {image_id}: {e}")
+            Image.objects.filter(pk=image_id).update(status=Image.Status.PENDING)
+            raise self.retry(exc=e)
+        logger.error(f"Failed to ingest image {image_id}: {e}")
+        Image.objects.filter(pk=image_id).update(status=Image.Status.FAILED)
+        discard_staged(staged_path)
+        return
+
+    discard_staged(staged_path)
+    logger.info(f"Ingested image {image_id}.")
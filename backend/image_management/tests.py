@@ -1,3 +1,447 @@
-from django.test import TestCase
+import io
+import os
+import random
+import shutil
+import struct
+import tempfile
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+import cloudinary
+import cloudinary.exceptions
+import cloudinary.utils
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image as PilImage
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from users.models import User
+from .models import Image, UploadSession
+from .storage import CloudinaryImageStorage
+from .similarity import BANDS, BAND_BITS, MAX_DISTANCE, from_signed, hamming, to_signed
+from .validations import read_image_dimensions, sniff_image_format, validate_image_header
 
-# Create your tests here.
+
+def flip(value, bits):
+    """``value`` with the given bit positions inverted."""
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def spread_bits(count):
+    """``count`` bit positions dealt evenly across the bands, the worst case for the band lookup."""
+    return [(index % BANDS) * BAND_BITS + index // BANDS for index in range(count)]
+
+
+def memory_storage(test):
+    """Keep the originals of ``test``'s images off the configured (possibly remote) storage while it runs."""
+    storage = mock.patch.object(Image._meta.get_field('original'), 'storage', InMemoryStorage())
+    storage.start()
+    test.addCleanup(storage.stop)
+
+
+def create_images(hashes, status=Image.Status.READY):
+    """Image rows with the given perceptual hashes (unsigned), without storing any file."""
+    images = []
+    for value in hashes:
+        image = Image(original='images/test.png', image_url='https://example.com/test.png', status=status,
+                      original_format='png', width=1, height=1, size_bytes=1)
+        image.set_perceptual_hash(value)
+        images.append(image)
+    return Image.objects.bulk_create(images)
+
+
+# Near-duplicate lookup tests
+class FindSimilarTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        generator = random.Random(23)
+        # With the top bit set, so the query and its copies are stored negative
+        cls.query = generator.getrandbits(64) | 1 << 63
+        hashes = [generator.getrandbits(64) for _ in range(300)] + [cls.query]
+        # Copies of the query at every distance, with the changed bits either spread over
+        # all bands (so no band matches exactly), packed into one or anywhere
+        for count in range(1, MAX_DISTANCE + 3):
+            hashes.append(flip(cls.query, spread_bits(count)))
+            hashes.append(flip(cls.query, range(count)))
+            hashes.append(flip(cls.query, generator.sample(range(64), count)))
+        create_images(hashes)
+        cls.failed = create_images([cls.query], status=Image.Status.FAILED)[0]
+
+    def brute_force(self, value, distance, exclude=None):
+        matches = []
+        for image in Image.objects.exclude(status='failed').exclude(pk=exclude):
+            bits = hamming(value, from_signed(image.perceptual_hash))
+            if bits <= distance:
+                matches.append((bits, image.pk))
+        return matches
+
+    def assertSameMatches(self, matches, expected):
+        self.assertEqual(sorted(matches), sorted(expected))
+        self.assertEqual([bits for bits, _ in matches], sorted(bits for bits, _ in matches))
+
+    def test_matches_a_full_scan_at_every_distance(self):
+        for distance in range(MAX_DISTANCE + 1):
+            with self.subTest(distance=distance):
+                self.assertSameMatches(Image.objects.find_similar(self.query, distance), self.brute_force(self.query, distance))
+
+    def test_matches_a_full_scan_around_stored_hashes(self):
+        for image in Image.objects.exclude(status='failed').order_by('?')[:20]:
+            value = from_signed(image.perceptual_hash)
+            with self.subTest(value=value):
+                self.assertSameMatches(
+                    Image.objects.find_similar(value, MAX_DISTANCE, exclude=image.pk),
+                    self.brute_force(value, MAX_DISTANCE, exclude=image.pk),
+                )
+
+    def test_failed_and_excluded_images_are_left_out(self):
+        exact = Image.objects.exclude(pk=self.failed.pk).get(perceptual_hash=to_signed(self.query))
+        self.assertEqual(Image.objects.find_similar(self.query, 0), [(0, exact.pk)])
+        self.assertEqual(Image.objects.find_similar(self.query, 0, exclude=exact.pk), [])
+
+
+# Similar images view tests
+class SimilarImagesViewTests(TestCase):
+    def setUp(self):
+        memory_storage(self)
+        self.client = APIClient()
+        base = 0x0123456789ABCDEF
+        self.image, self.near, self.nearer, self.far = create_images([base, flip(base, range(5)), flip(base, [7]), ~base & ((1 << 64) - 1)])
+
+    def test_lists_near_duplicates_closest_first(self):
+        response = self.client.get(f'/api/v1/images/{self.image.pk}/similar/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['distance'] for result in response.data['results']], [1, 5])
+        self.assertEqual([result['image']['image_id'] for result in response.data['results']], [str(self.nearer.pk), str(self.near.pk)])
+
+    def test_distance_and_limit(self):
+        response = self.client.get(f'/api/v1/images/{self.image.pk}/similar/', {'distance': 2})
+        self.assertEqual([result['distance'] for result in response.data['results']], [1])
+        response = self.client.get(f'/api/v1/images/{self.image.pk}/similar/', {'limit': 1})
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_distance_beyond_the_maximum_is_rejected(self):
+        response = self.client.get(f'/api/v1/images/{self.image.pk}/similar/', {'distance': MAX_DISTANCE + 1})
+        self.assertEqual(response.status_code, 400)
+
+
+# Image listing tests
+class ImageListingTests(TestCase):
+    def setUp(self):
+        memory_storage(self)
+        self.client = APIClient()
+        images = create_images([None] * 14)
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for index, image in enumerate(images):
+            # Repeated luminances and timestamps, and two images without statistics
+            luminance = None if index in (3, 9) else (index % 4) / 4
+            Image.objects.filter(pk=image.pk).update(mean_luminance=luminance, created_at=start + timedelta(minutes=index // 3))
+
+    def walk(self, params):
+        """Image ids of every page, following next links, then the ids going back through previous links."""
+        response = self.client.get('/api/v1/images/', params)
+        pages = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append([image['image_id'] for image in response.data['results']])
+            if not response.data['links']['next']:
+                break
+            response = self.client.get(response.data['links']['next'])
+        backward = []
+        while response.data['links']['previous']:
+            response = self.client.get(response.data['links']['previous'])
+            backward.append([image['image_id'] for image in response.data['results']])
+        return pages, backward
+
+    def assertListed(self, params, ordering):
+        expected = [str(pk) for pk in Image.objects.filter(mean_luminance__isnull=False).order_by(*ordering).values_list('pk', flat=True)]
+        pages, backward = self.walk({**params, 'page_size': 4})
+        self.assertEqual(pages, [expected[index:index + 4] for index in range(0, len(expected), 4)])
+        self.assertEqual(backward, pages[-2::-1])
+
+    def test_mixed_direction_orderings(self):
+        self.assertListed({'ordering': '-luminance,created_at'}, ('-mean_luminance', 'created_at', 'pk'))
+        self.assertListed({'ordering': 'luminance,-created_at'}, ('mean_luminance', '-created_at', '-pk'))
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/api/v1/images/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+        # A cursor issued for one ordering is not accepted for another
+        response = self.client.get('/api/v1/images/', {'ordering': 'luminance', 'page_size': 2})
+        cursor = response.data['links']['next'].split('cursor=')[1].split('&')[0]
+        response = self.client.get('/api/v1/images/', {'ordering': '-luminance', 'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
+
+def png(size=(64, 48)):
+    """A PNG of noise, so it is large enough to be sent in several chunks."""
+    img = PilImage.frombytes('RGB', size, random.Random(7).randbytes(size[0] * size[1] * 3))
+    buffer = io.BytesIO()
+    img.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+# Chunked upload tests
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        memory_storage(self)
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        staging = override_settings(IMAGE_STAGING_ROOT=self.root, IMAGE_INGEST_ASYNC=False)
+        staging.enable()
+        self.addCleanup(staging.disable)
+        self.client = APIClient()
+        self.data = png()
+
+    def open_session(self, size=None):
+        response = self.client.post('/api/v1/uploads/', {
+            'filename': 'photo.png', 'content_type': 'image/png', 'total_size': size or len(self.data),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.client.credentials(HTTP_X_UPLOAD_TOKEN=response.data['upload_token'])
+        return UploadSession.objects.get(pk=response.data['session_id'])
+
+    def send(self, session, start, end, data=None):
+        """PUT bytes ``start`` to ``end`` (inclusive) of the file."""
+        data = self.data if data is None else data
+        return self.client.generic('PUT', f'/api/v1/uploads/{session.pk}/', data[start:end + 1],
+                                   content_type='application/octet-stream',
+                                   HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{session.total_size}')
+
+    def finalize(self, session):
+        return self.client.post(f'/api/v1/uploads/{session.pk}/finalize/')
+
+    def test_upload_in_chunks_and_finalize(self):
+        session = self.open_session()
+        third = len(self.data) // 3
+        self.assertEqual(self.send(session, 0, third - 1).data['received_bytes'], third)
+        # A replayed chunk (e.g. after a dropped connection) is harmless
+        self.assertEqual(self.send(session, 0, third - 1).data['received_bytes'], third)
+        self.assertEqual(self.client.get(f'/api/v1/uploads/{session.pk}/').data['received_bytes'], third)
+        self.assertEqual(self.finalize(session).status_code, 409)
+        self.send(session, third, 2 * third - 1)
+        response = self.send(session, 2 * third, len(self.data) - 1)
+        self.assertTrue(response.data['complete'])
+
+        self.assertEqual(self.finalize(session).status_code, 201)
+        session.refresh_from_db()
+        image = session.image
+        self.assertEqual((image.width, image.height), (64, 48))
+        with image.open_original() as original:
+            self.assertEqual(original.read(), self.data)
+        self.assertFalse(os.path.exists(session.staged_path))
+        # Finalizing again returns the same image
+        response = self.finalize(session)
+        self.assertEqual((response.status_code, response.data['image_id']), (200, image.pk))
+        self.assertEqual(Image.objects.count(), 1)
+        self.assertEqual(self.send(session, 0, 9).status_code, 409)
+
+    def test_chunk_past_the_received_bytes_conflicts(self):
+        session = self.open_session()
+        response = self.send(session, 100, 199)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['received_bytes'], 0)
+
+    def test_content_range_must_match_the_session(self):
+        session = self.open_session()
+        response = self.client.generic('PUT', f'/api/v1/uploads/{session.pk}/', self.data[:10],
+                                       content_type='application/octet-stream',
+                                       HTTP_CONTENT_RANGE=f'bytes 0-9/{session.total_size + 1}')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.generic('PUT', f'/api/v1/uploads/{session.pk}/', self.data[:10],
+                                       content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bad_first_chunk_discards_the_session(self):
+        data = b'not an image at all' * 10
+        session = self.open_session(size=len(data))
+        self.assertEqual(self.send(session, 0, len(data) - 1, data).status_code, 400)
+        self.assertFalse(UploadSession.objects.filter(pk=session.pk).exists())
+        self.assertFalse(os.path.exists(session.staged_path))
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_oversized_image_is_rejected_on_the_first_chunk(self):
+        session = self.open_session()
+        self.assertEqual(self.send(session, 0, 99).status_code, 400)
+        self.assertFalse(UploadSession.objects.filter(pk=session.pk).exists())
+
+    def test_anonymous_session_requires_its_token(self):
+        session = self.open_session()
+        self.assertEqual(self.client.get(f'/api/v1/uploads/{session.pk}/').status_code, 200)
+        self.client.credentials(HTTP_X_UPLOAD_TOKEN='guessed')
+        self.assertEqual(self.client.get(f'/api/v1/uploads/{session.pk}/').status_code, 404)
+        self.client.credentials()
+        self.assertEqual(self.client.get(f'/api/v1/uploads/{session.pk}/').status_code, 404)
+        self.assertEqual(self.send(session, 0, 99).status_code, 404)
+
+    def test_session_is_only_visible_to_its_owner(self):
+        owner = User.objects.create_user(email='owner@example.com', first_name='owner')
+        self.client.force_authenticate(owner)
+        response = self.client.post('/api/v1/uploads/', {
+            'filename': 'photo.png', 'content_type': 'image/png', 'total_size': len(self.data),
+        }, format='json')
+        self.assertNotIn('upload_token', response.data)
+        url = f"/api/v1/uploads/{response.data['session_id']}/"
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.force_authenticate(User.objects.create_user(email='other@example.com', first_name='other'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_delete_discards_the_staged_file(self):
+        session = self.open_session()
+        self.send(session, 0, 99)
+        self.assertTrue(os.path.exists(session.staged_path))
+        self.assertEqual(self.client.delete(f'/api/v1/uploads/{session.pk}/').status_code, 204)
+        self.assertFalse(os.path.exists(session.staged_path))
+
+    @override_settings(IMAGE_INGEST_ASYNC=True)
+    def test_delete_after_finalize_keeps_the_staged_file_for_ingestion(self):
+        session = self.open_session()
+        self.send(session, 0, len(self.data) - 1)
+        with mock.patch('image_management.serializers.ingest_image') as ingest_image:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.finalize(session).status_code, 202)
+        self.assertEqual(self.client.delete(f'/api/v1/uploads/{session.pk}/').status_code, 204)
+        self.assertTrue(os.path.exists(session.staged_path))
+        self.assertEqual(ingest_image.delay.call_args.args[1], session.staged_path)
+
+
+def jpeg(size=(40, 30)):
+    buffer = io.BytesIO()
+    PilImage.new('RGB', size, (10, 120, 200)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def gif(size=(40, 30)):
+    buffer = io.BytesIO()
+    PilImage.new('P', size).save(buffer, 'GIF')
+    return buffer.getvalue()
+
+
+def upload(data, content_type=None):
+    file = io.BytesIO(data)
+    file.content_type = content_type
+    return file
+
+
+# Header validation tests
+class SniffImageFormatTests(SimpleTestCase):
+    def test_signatures(self):
+        self.assertEqual(sniff_image_format(jpeg()[:16]), 'jpeg')
+        self.assertEqual(sniff_image_format(png()[:16]), 'png')
+        self.assertEqual(sniff_image_format(b'GIF87a' + b'\0' * 10), 'gif')
+        self.assertEqual(sniff_image_format(gif()[:16]), 'gif')
+
+    def test_unknown_and_short_headers(self):
+        webp = io.BytesIO()
+        PilImage.new('RGB', (4, 4)).save(webp, 'WEBP')
+        self.assertIsNone(sniff_image_format(webp.getvalue()[:16]))
+        self.assertIsNone(sniff_image_format(b'\x89PNG'))
+        self.assertIsNone(sniff_image_format(b''))
+
+
+class ReadImageDimensionsTests(SimpleTestCase):
+    def test_formats(self):
+        for image_format, data in (('png', png((33, 21))), ('gif', gif((33, 21))), ('jpeg', jpeg((33, 21)))):
+            with self.subTest(image_format=image_format):
+                self.assertEqual(read_image_dimensions(io.BytesIO(data), image_format), (33, 21))
+
+    def test_jpeg_segments_fill_bytes_and_standalone_markers(self):
+        data = jpeg((33, 21))
+        # An APP segment, fill bytes and a standalone marker before the frame header
+        extra = b'\xff\xe1' + struct.pack('>H', 6) + b'Exif' + b'\xff\xff\xff\xd0'
+        self.assertEqual(read_image_dimensions(io.BytesIO(data[:2] + extra + data[2:]), 'jpeg'), (33, 21))
+
+    def test_progressive_jpeg(self):
+        buffer = io.BytesIO()
+        PilImage.new('RGB', (33, 21)).save(buffer, 'JPEG', progressive=True)
+        self.assertEqual(read_image_dimensions(io.BytesIO(buffer.getvalue()), 'jpeg'), (33, 21))
+
+    def test_truncated_headers(self):
+        data = jpeg()
+        frame = data.index(b'\xff\xc0')
+        for image_format, header in (('png', png()[:20]), ('gif', gif()[:8]), ('jpeg', data[:frame + 6])):
+            with self.subTest(image_format=image_format):
+                self.assertIsNone(read_image_dimensions(io.BytesIO(header), image_format))
+        self.assertIsNone(read_image_dimensions(io.BytesIO(b'\x89PNG\r\n\x1a\n' + b'\0' * 16), 'png'))
+
+
+class ValidateImageHeaderTests(SimpleTestCase):
+    def test_accepts_valid_images(self):
+        for content_type, data in (('image/png', png()), ('image/gif', gif()), ('image/jpeg', jpeg()), ('image/jpg', jpeg())):
+            with self.subTest(content_type=content_type):
+                file = upload(data, content_type)
+                file.seek(5)
+                self.assertIs(validate_image_header(file, max_pixels=10_000), file)
+                self.assertEqual(file.tell(), 5)
+
+    def test_pixel_budget(self):
+        validate_image_header(upload(png((100, 50))), max_pixels=5000)
+        with self.assertRaisesMessage(ValidationError, '100x51 exceed the maximum of 5000 pixels'):
+            validate_image_header(upload(png((100, 51))), max_pixels=5000)
+        with override_settings(IMAGE_MAX_PIXELS=100):
+            with self.assertRaises(ValidationError):
+                validate_image_header(upload(png((11, 10))))
+
+    def test_budget_is_checked_from_the_header_alone(self):
+        # A PNG declaring 60000x60000 pixels, with no pixel data at all
+        header = png()[:16] + struct.pack('>II', 60000, 60000)
+        with self.assertRaisesMessage(ValidationError, '60000x60000'):
+            validate_image_header(upload(header), max_pixels=10_000)
+
+    def test_rejects_unsupported_and_broken_files(self):
+        for data in (b'plain text, not an image', b'\x89PNG\r\n\x1a\n' + b'\0' * 16, png()[:16] + struct.pack('>II', 0, 10)):
+            with self.subTest(data=data[:12]):
+                with self.assertRaises(ValidationError):
+                    validate_image_header(upload(data), max_pixels=10_000)
+
+    def test_partial_header(self):
+        self.assertIsNotNone(validate_image_header(upload(png()[:20]), max_pixels=10_000, partial=True))
+        with self.assertRaises(ValidationError):
+            validate_image_header(upload(png()[:20]), max_pixels=10_000)
+        with self.assertRaises(ValidationError):
+            validate_image_header(upload(b'GIF' * 3), max_pixels=10_000, partial=True)
+
+    def test_declared_type_must_match_the_content(self):
+        with self.assertRaisesMessage(ValidationError, 'does not match its declared type'):
+            validate_image_header(upload(png(), 'image/jpeg'), max_pixels=10_000)
+        # Types outside the accepted list are left to validate_image_type
+        self.assertIsNotNone(validate_image_header(upload(png(), 'application/octet-stream'), max_pixels=10_000))
+
+
+# Cloudinary storage tests
+class CloudinaryUploadTests(SimpleTestCase):
+    def setUp(self):
+        config = cloudinary.config()
+        saved = (config.cloud_name, config.api_key, config.api_secret)
+        cloudinary.config(cloud_name='demo', api_key='key', api_secret='secret')
+        self.addCleanup(lambda: cloudinary.config(cloud_name=saved[0], api_key=saved[1], api_secret=saved[2]))
+        client = mock.patch('image_management.storage.get_client')
+        self.client = client.start().return_value
+        self.addCleanup(client.stop)
+
+    def upload(self, status_code, body):
+        response = mock.Mock(status_code=status_code)
+        if body is None:
+            response.json.side_effect = ValueError
+        else:
+            response.json.return_value = body
+        self.client.post.return_value = response
+        return CloudinaryImageStorage()._upload('images/photo.png', ContentFile(b'data'))
+
+    def test_sends_every_signed_parameter(self):
+        with mock.patch('cloudinary.utils.build_upload_params', return_value={'overwrite': 0, 'unique_filename': False, 'eager': None}):
+            self.assertEqual(self.upload(200, {'public_id': 'images/photo'}), {'public_id': 'images/photo'})
+        fields = dict(self.client.post.call_args.kwargs['data'])
+        self.assertEqual((fields['overwrite'], fields['unique_filename']), (0, '0'))
+        self.assertNotIn('eager', fields)
+        signed = {key: value for key, value in fields.items() if key not in ('signature', 'api_key')}
+        self.assertEqual(fields['signature'], cloudinary.utils.api_sign_request(signed, 'secret'))
+
+    def test_error_responses_raise(self):
+        with self.assertRaisesMessage(cloudinary.exceptions.AuthorizationRequired, 'Invalid Signature'):
+            self.upload(401, {'error': {'message': 'Invalid Signature'}})
+        with self.assertRaisesMessage(cloudinary.exceptions.Error, '(502)'):
+            self.upload(502, None)
+        with self.assertRaises(cloudinary.exceptions.GeneralError):
+            self.upload(500, {})
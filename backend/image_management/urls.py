@@ -1,11 +1,12 @@
 # images/urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ImageViewSet, ImageUploadViewSet
+from .views import ImageViewSet, ImageUploadViewSet, ChunkedUploadViewSet
 
 router = DefaultRouter()
 router.register(r'images', ImageViewSet, basename='image')
 router.register(r'upload-image', ImageUploadViewSet, basename='upload-image')
+router.register(r'uploads', ChunkedUploadViewSet, basename='upload-session')
 
 urlpatterns = [
     path('', include(router.urls)),
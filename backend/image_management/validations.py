@@ -1,17 +1,130 @@
 from rest_framework.exceptions import ValidationError
+from django.conf import settings
+import struct
+
+# Content types and formats accepted for uploads
+VALID_IMAGE_TYPES = ['image/jpeg', 'image/png', 'image/jpg', 'image/gif']
+VALID_IMAGE_FORMATS = ['jpeg', 'png', 'gif']
+
+# Maximum upload size (5MB)
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+
+# File signatures (magic bytes) of the supported formats
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+
+# JPEG start-of-frame markers (they carry the image dimensions)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
 
 # Image type validations
 def validate_image_type(value):
     # Check if the file type is valid (you can adjust this list as needed)
-    valid_image_formats = ['image/jpeg', 'image/png', 'image/jpg', 'image/gif']
-    if value.content_type not in valid_image_formats:
+    if value.content_type not in VALID_IMAGE_TYPES:
         raise ValidationError("Unsupported file type. Only JPEG, PNG, and GIF are allowed.")
     return value
 
 
 # Image size validations
-def validate_image_size(value, max_size=5 * 1024 * 1024):
+def validate_image_size(value, max_size=MAX_IMAGE_SIZE):
     # Check if image size exceeds the maximum allowed size (default is 5MB)
     if value.size > max_size:
         raise ValidationError(f"File size exceeds the maximum allowed size of {max_size / (1024 * 1024)}MB.")
-    return value
\ No newline at end of file
+    return value
+
+
+def sniff_image_format(header):
+    """Return the image format matching the leading bytes of a file, or None."""
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+def _read_jpeg_dimensions(file):
+    """Walk the JPEG segments up to the first start-of-frame marker, skipping the rest."""
+    file.seek(2)
+    while True:
+        byte = file.read(1)
+        while byte == b'\xff':
+            # Fill bytes may precede a marker
+            marker = file.read(1)
+            if marker != b'\xff':
+                break
+        else:
+            return None
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in (0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7):
+            continue  # Standalone markers have no length
+        length_bytes = file.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker in JPEG_SOF_MARKERS:
+            frame = file.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>HH', frame[1:5])
+            return width, height
+        file.seek(length - 2, 1)
+
+
+def read_image_dimensions(file, image_format):
+    """
+    Read the width and height declared in an image header.
+
+    Only the few bytes holding the dimensions are read; nothing is decoded.
+    Returns None when the header is truncated.
+    """
+    if image_format == 'png':
+        file.seek(12)
+        chunk = file.read(12)
+        if len(chunk) < 12 or chunk[:4] != b'IHDR':
+            return None
+        return struct.unpack('>II', chunk[4:12])
+    if image_format == 'gif':
+        file.seek(6)
+        screen = file.read(4)
+        if len(screen) < 4:
+            return None
+        return struct.unpack('<HH', screen)
+    if image_format == 'jpeg':
+        return _read_jpeg_dimensions(file)
+    return None
+
+
+# Image header validations
+def validate_image_header(file, max_pixels=None, partial=False):
+    # Detect the real format from the file signature and reject oversized images before any decode
+    if max_pixels is None:
+        max_pixels = settings.IMAGE_MAX_PIXELS
+    position = file.tell()
+    try:
+        file.seek(0)
+        image_format = sniff_image_format(file.read(16))
+        if image_format not in VALID_IMAGE_FORMATS:
+            raise ValidationError("Unsupported file type. Only JPEG, PNG, and GIF are allowed.")
+        dimensions = read_image_dimensions(file, image_format)
+    finally:
+        file.seek(position)
+
+    if dimensions is None:
+        # The first chunk of a resumable upload may end before the dimensions
+        if partial:
+            return file
+        raise ValidationError("The file is not a valid image.")
+    width, height = dimensions
+    if not width or not height:
+        raise ValidationError("The file is not a valid image.")
+    if width * height > max_pixels:
+        raise ValidationError(f"Image dimensions {width}x{height} exceed the maximum of {max_pixels} pixels.")
+
+    content_type = getattr(file, 'content_type', None)
+    if content_type in VALID_IMAGE_TYPES and content_type.split('/')[1].replace('jpg', 'jpeg') != image_format:
+        raise ValidationError("File content does not match its declared type.")
+    return file
\ No newline at end of file
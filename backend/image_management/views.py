@@ -1,9 +1,52 @@
-from rest_framework import viewsets, status
-from .serializers import ImageSerializer, ImageUploadSerializer
+from rest_framework import viewsets, status, mixins
+from .serializers import ImageSerializer, ImageUploadSerializer, UploadSessionSerializer, SimilarImagesQuerySerializer
 from rest_framework.response import Response
 from rest_framework import permissions
-from .models import Image
+from rest_framework.exceptions import ValidationError
+from .models import Image, UploadSession, upload_token_hash
+from transformations.models import Derivative
+from .staging import write_chunk, open_staged, discard_staged
+from .validations import validate_image_header
+from .similarity import from_signed
+from .filters import ImageFilter
+from django_filters.rest_framework import DjangoFilterBackend
+from users.pagination import KeysetPagination
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.decorators import action
+from rest_framework.reverse import reverse
+from django.conf import settings
+from django.db.models import Q, Prefetch
+from django.http import FileResponse, Http404, HttpResponseRedirect
+import re
+
+# Content-Range header sent with each chunk, e.g. "bytes 0-524287/2097152"
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+def _parse_content_range(header):
+    """Return (start, end, total) from a Content-Range header."""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        raise ValidationError("A Content-Range header of the form 'bytes start-end/total' is required.")
+    start, end, total = (int(group) for group in match.groups())
+    if end < start or end >= total:
+        raise ValidationError("Invalid Content-Range.")
+    return start, end, total
+
+
+def _save_upload(serializer, request, **kwargs):
+    """Save a validated upload, deferring storage to Celery when async ingestion is enabled."""
+    if settings.IMAGE_INGEST_ASYNC:
+        # Stage the upload and return at once; a Celery task stores it
+        image = serializer.save(defer=True, **kwargs)
+        return image, Response({
+            'image_id': image.image_id,
+            'status': image.status,
+            'status_url': reverse('image-status', args=[image.pk], request=request),
+        }, status=status.HTTP_202_ACCEPTED)
+    image = serializer.save(**kwargs)
+    return image, Response(serializer.data, status=status.HTTP_201_CREATED)
+
 
 # Image viewset
 class ImageViewSet(viewsets.ModelViewSet):
@@ -14,6 +57,70 @@ class ImageViewSet(viewsets.ModelViewSet):
     queryset = Image.objects.all()
     serializer_class = ImageSerializer
     permission_classes = [permissions.AllowAny]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ImageFilter
+    pagination_class = KeysetPagination  # Newest first; cursors keep deep pages as cheap as the first
+
+    def get_queryset(self):
+        # Responsive variants are listed on every image: fetch them in one query per page
+        variants = Derivative.objects.filter(kind=Derivative.Kind.VARIANT).order_by('width')
+        return Image.objects.prefetch_related(
+            Prefetch('derivatives', queryset=variants, to_attr='variants')
+        )
+
+    @action(detail=True, methods=['get'], url_path='status', url_name='status')
+    def ingest_status(self, request, pk=None):
+        """Report the ingestion status of an image."""
+        image = self.get_object()
+        return Response({
+            'image_id': image.image_id,
+            'status': image.status,
+            'image_url': image.image_url,
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def original(self, request, pk=None):
+        """
+        Serve the original image.
+
+        Local and in-memory storage stream the file (sendfile under gunicorn for
+        files on disk); remote storage redirects to the CDN URL.
+        """
+        image = self.get_object()
+        if not image.original:
+            raise Http404("Image has no stored original.")
+        if image.is_stored_remotely:
+            return HttpResponseRedirect(image.original.url)
+        stored = image.original.storage.open(image.original.name, 'rb')
+        content_type = f'image/{image.original_format}' if image.original_format else None
+        return FileResponse(stored, content_type=content_type)
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """
+        List near duplicates of an image (re-encoded, resized or lightly edited
+        copies): images whose perceptual hash is within ``distance`` bits of this
+        one's, closest first.
+        """
+        image = self.get_object()
+        query = SimilarImagesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        if image.perceptual_hash is None:
+            return Response({'status': 'error', 'message': 'Image has no perceptual hash yet.'}, status=status.HTTP_409_CONFLICT)
+
+        distance = query.validated_data['distance']
+        matches = Image.objects.find_similar(from_signed(image.perceptual_hash), distance, exclude=image.pk)
+        matches = matches[:query.validated_data['limit']]
+        images = self.get_queryset().in_bulk([pk for _, pk in matches])
+        context = self.get_serializer_context()
+        return Response({
+            'image_id': image.image_id,
+            'distance': distance,
+            'results': [
+                {'distance': bits, 'image': ImageSerializer(images[pk], context=context).data}
+                for bits, pk in matches if pk in images
+            ],
+        }, status=status.HTTP_200_OK)
     
 
 # Image upload viewset
@@ -31,5 +138,109 @@ class ImageUploadViewSet(viewsets.ModelViewSet):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        _, response = _save_upload(serializer, request)
+        return response
+
+
+# Chunked upload viewset
+class ChunkedUploadViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+       ViewSet for resumable, chunked image uploads.
+
+       POST creates a session, PUT sends a byte range (Content-Range header),
+       GET reports how many bytes were received so an interrupted upload can
+       resume, and POST finalize/ turns the staged file into an Image.
+
+       Sessions opened by a user are only reachable by that user. Sessions
+       opened anonymously return an upload_token at creation, and every later
+       request on them must send it in the X-Upload-Token header.
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.AllowAny]
+
+    def get_queryset(self):
+        # Sessions opened by a user are only visible to that user, anonymous ones to the holder of their token
+        user = self.request.user
+        token = self.request.headers.get('X-Upload-Token')
+        visible = Q(owner=user) if user and user.is_authenticated else Q(pk__in=[])
+        if token:
+            visible |= Q(owner__isnull=True, token_hash=upload_token_hash(token))
+        return UploadSession.objects.filter(visible)
+
+    def update(self, request, *args, **kwargs):
+        """Append a byte range to the staged file."""
+        session = self.get_object()
+        if session.status != UploadSession.Status.ACTIVE:
+            return Response({'detail': 'Upload session is already finalized.'}, status=status.HTTP_409_CONFLICT)
+
+        start, end, total = _parse_content_range(request.headers.get('Content-Range'))
+        if total != session.total_size:
+            raise ValidationError("Content-Range total does not match the declared file size.")
+        if start > session.received_bytes:
+            # A chunk went missing; tell the client where to resume from
+            return Response({
+                'detail': 'Chunk does not continue the upload.',
+                'received_bytes': session.received_bytes,
+            }, status=status.HTTP_409_CONFLICT)
+
+        length = end - start + 1
+        written = write_chunk(session.staged_path, start, request.stream, length) if request.stream else 0
+
+        # Reject bad files on the first chunk instead of after the whole upload
+        if start == 0 and written:
+            try:
+                with open(session.staged_path, 'rb') as staged:
+                    validate_image_header(staged, partial=True)
+            except ValidationError:
+                discard_staged(session.staged_path)
+                session.delete()
+                raise
+
+        session.received_bytes = max(session.received_bytes, start + written)
+        session.save(update_fields=['received_bytes', 'updated_at'])
+        return Response({
+            'session_id': session.session_id,
+            'received_bytes': session.received_bytes,
+            'total_size': session.total_size,
+            'complete': session.is_complete,
+        }, status=status.HTTP_200_OK)
+
+    def perform_destroy(self, instance):
+        # A finalized upload's staged file belongs to the image now: tasks.ingest_image removes it
+        if instance.status != UploadSession.Status.COMPLETE:
+            discard_staged(instance.staged_path)
+        instance.delete()
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """Hand the fully received file to the regular image upload path."""
+        session = self.get_object()
+        if session.status == UploadSession.Status.COMPLETE:
+            return Response({'image_id': session.image_id, 'status': session.status}, status=status.HTTP_200_OK)
+        if not session.is_complete:
+            return Response({
+                'detail': 'Upload is incomplete.',
+                'received_bytes': session.received_bytes,
+            }, status=status.HTTP_409_CONFLICT)
+
+        upload = open_staged(session.staged_path, session.filename, session.content_type)
+        try:
+            serializer = ImageUploadSerializer(data={'original': upload}, context=self.get_serializer_context())
+            if not serializer.is_valid():
+                discard_staged(session.staged_path)
+                session.delete()
+                raise ValidationError(serializer.errors)
+            image, response = _save_upload(serializer, request, staged_path=session.staged_path)
+        finally:
+            upload.close()
+
+        if not settings.IMAGE_INGEST_ASYNC:
+            discard_staged(session.staged_path)
+        session.status = UploadSession.Status.COMPLETE
+        session.image = image
+        session.save(update_fields=['status', 'image', 'updated_at'])
+        return response
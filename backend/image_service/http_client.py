@@ -0,0 +1,135 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+# Defaults used for any HTTP_CLIENT key missing from the settings
+DEFAULTS = {
+    'POOL_CONNECTIONS': 10,
+    'POOL_MAXSIZE': 20,
+    'POOL_BLOCK': True,
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 30,
+    'RETRIES': 3,
+    'BACKOFF_FACTOR': 0.5,
+    'RETRY_STATUSES': (429, 500, 502, 503, 504),
+}
+
+
+class HttpClient:
+    """
+    Shared client for all outbound HTTP traffic (storage reads and uploads, CDN fetches).
+
+    Wraps one requests.Session so connections to each host are kept alive and
+    reused, with a bounded pool per host, default timeouts, retries with
+    exponential backoff for idempotent requests (and, for any request, on
+    connection failures, which never reach the server), and counters for bytes
+    and latency.
+    """
+    def __init__(self, config=None):
+        config = {**DEFAULTS, **(config or {})}
+        self.timeout = (config['CONNECT_TIMEOUT'], config['READ_TIMEOUT'])
+
+        retry = Retry(
+            total=config['RETRIES'],
+            backoff_factor=config['BACKOFF_FACTOR'],
+            status_forcelist=config['RETRY_STATUSES'],
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=config['POOL_CONNECTIONS'],
+            pool_maxsize=config['POOL_MAXSIZE'],
+            pool_block=config['POOL_BLOCK'],
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'errors': 0,
+            'bytes_sent': 0,
+            'bytes_received': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+        }
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the pooled session.
+
+        Latency is measured up to the response headers. Received bytes are counted
+        from the body, or for streamed responses from what was actually read off
+        the wire when the response is closed.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self._record(time.perf_counter() - start, 0, error=True)
+            raise
+        latency = time.perf_counter() - start
+        body = response.request.body
+        sent = len(body) if isinstance(body, (bytes, str)) else 0
+        if kwargs.get('stream'):
+            self._record(latency, 0, sent, error=response.status_code >= 400)
+            self._count_on_close(response)
+        else:
+            self._record(latency, len(response.content), sent, error=response.status_code >= 400)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def _count_on_close(self, response):
+        close = response.close
+
+        def counted_close():
+            with self._lock:
+                self._stats['bytes_received'] += response.raw.tell()
+            close()
+
+        response.close = counted_close
+
+    def _record(self, latency, received, sent=0, error=False):
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['errors'] += int(error)
+            self._stats['bytes_sent'] += sent
+            self._stats['bytes_received'] += received
+            self._stats['latency_total'] += latency
+            self._stats['latency_max'] = max(self._stats['latency_max'], latency)
+
+    def stats(self):
+        """Return a snapshot of the counters, including the mean latency in seconds."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['latency_mean'] = stats['latency_total'] / stats['requests'] if stats['requests'] else 0.0
+        return stats
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide HttpClient, created on first use from settings.HTTP_CLIENT."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient(getattr(settings, 'HTTP_CLIENT', None))
+    return _client
@@ -162,8 +162,6 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 #     os.path.join(BASE_DIR, 'static'),  # Optional for custom static files during development
 # ]
 
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
-
 # --- Custom User Model ---
 AUTH_USER_MODEL = "users.User"
 
@@ -172,8 +170,21 @@ AUTH_USER_MODEL = "users.User"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-# Default storage for Django files (e.g., images)
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+# Storage backends
+# 'images' holds originals and derivatives: 'cloudinary', 'local' (MEDIA_ROOT on disk) or 'memory' (tests, benchmarks)
+IMAGE_STORAGE_BACKEND = os.getenv('IMAGE_STORAGE_BACKEND', 'cloudinary')
+IMAGE_STORAGE_BACKENDS = {
+    'cloudinary': {'BACKEND': 'image_management.storage.CloudinaryImageStorage'},
+    'local': {'BACKEND': 'image_management.storage.LocalImageStorage'},
+    'memory': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+}
+
+STORAGES = {
+    # Default storage for Django files (e.g., images)
+    'default': IMAGE_STORAGE_BACKENDS[IMAGE_STORAGE_BACKEND],
+    'images': IMAGE_STORAGE_BACKENDS[IMAGE_STORAGE_BACKEND],
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}
 
 # CORS config
 CORS_ALLOWED_ORIGINS = os.getenv("CORS_ALLOWED_ORIGINS", "").split(",")
@@ -193,6 +204,9 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,  # Default page size for pagination
 }
 
+# Seconds a total computed for ?count=true on keyset-paginated listings (users.pagination.KeysetPagination) is cached
+PAGINATION_COUNT_CACHE_TIMEOUT = int(os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', 60))
+
 # Simple JWT configuration
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=int(os.getenv('ACCESS_TOKEN_LIFETIME', 7))),
@@ -213,6 +227,50 @@ CELERY_TIMEZONE = 'Africa/Nairobi'  # Timezone for scheduling tasks
 CELERY_TASK_TRACK_STARTED = True  # Track task start times
 CELERY_TASK_TIME_LIMIT = 30 * 60  # Set global time limit for tasks
 
+# Image ingestion config
+# When enabled, uploads are staged locally and stored by a Celery task (202 + status polling)
+IMAGE_INGEST_ASYNC = os.getenv('IMAGE_INGEST_ASYNC', 'False') == 'True'
+IMAGE_STAGING_ROOT = os.getenv('IMAGE_STAGING_ROOT', os.path.join(MEDIA_ROOT, 'staging'))
+# Reuse the stored asset of identical uploads: 'owner' (same user only), 'global' or 'off'
+IMAGE_DEDUP_SCOPE = os.getenv('IMAGE_DEDUP_SCOPE', 'owner')
+# Largest accepted image in decoded pixels (width * height), checked from the file header
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 40_000_000))
+# Responsive widths built by a Celery task once an image is ready, listed as 'variants' in the image API
+IMAGE_VARIANTS_ENABLED = os.getenv('IMAGE_VARIANTS_ENABLED', 'False') == 'True'
+IMAGE_VARIANT_WIDTHS = [int(width) for width in os.getenv('IMAGE_VARIANT_WIDTHS', '160,320,640,1280').split(',') if width]
+
+# Transformation cache config, see transformations/cache.py
+TRANSFORM_CACHE = {
+    'ENABLED': os.getenv('TRANSFORM_CACHE_ENABLED', 'True') == 'True',
+    'MEMORY_MAX_BYTES': int(os.getenv('TRANSFORM_CACHE_MEMORY_MAX_BYTES', 64 * 1024 * 1024)),  # In-process LRU, per worker
+    'MEMORY_MAX_ITEM_BYTES': int(os.getenv('TRANSFORM_CACHE_MEMORY_MAX_ITEM_BYTES', 512 * 1024)),  # Larger renders only go to disk
+    'DISK_ROOT': os.getenv('TRANSFORM_CACHE_DISK_ROOT', os.path.join(MEDIA_ROOT, 'transform-cache')),
+    'DISK_MAX_BYTES': int(os.getenv('TRANSFORM_CACHE_DISK_MAX_BYTES', 1024 * 1024 * 1024)),
+}
+# Sources of at least this many pixels are transformed strip by strip (0 disables), see transformations/tiling.py
+TRANSFORM_TILE_THRESHOLD = int(os.getenv('TRANSFORM_TILE_THRESHOLD', 16_000_000))
+TRANSFORM_STRIP_ROWS = int(os.getenv('TRANSFORM_STRIP_ROWS', 256))
+# Cache-Control of negotiated image delivery (stored derivatives are served as immutable)
+IMAGE_DELIVERY_CACHE_CONTROL = os.getenv('IMAGE_DELIVERY_CACHE_CONTROL', 'public, max-age=86400')
+# Image blended by the "watermark" transformation (unset disables the operation)
+WATERMARK_PATH = os.getenv('WATERMARK_PATH') or None
+# Animated GIF output: quantize every frame to the first frame's palette (smaller, faster) or give each its own
+TRANSFORM_GIF_REUSE_PALETTE = os.getenv('TRANSFORM_GIF_REUSE_PALETTE', 'True') == 'True'
+# Coalescing of concurrent identical renders, see transformations/singleflight.py
+TRANSFORM_SINGLE_FLIGHT = {
+    'ENABLED': os.getenv('TRANSFORM_SINGLE_FLIGHT_ENABLED', 'True') == 'True',
+    'LOCK_TTL': int(os.getenv('TRANSFORM_SINGLE_FLIGHT_LOCK_TTL', 30)),  # Seconds; outlives a crashed worker's lock
+    'WAIT_TIMEOUT': int(os.getenv('TRANSFORM_SINGLE_FLIGHT_WAIT_TIMEOUT', 30)),
+    'POLL_INTERVAL': float(os.getenv('TRANSFORM_SINGLE_FLIGHT_POLL_INTERVAL', 0.05)),
+}
+# Process pool for renders made inside web requests, see transformations/pool.py
+TRANSFORM_POOL = {
+    'ENABLED': os.getenv('TRANSFORM_POOL_ENABLED', 'False') == 'True',
+    'WORKERS': int(os.getenv('TRANSFORM_POOL_WORKERS', 2)),  # Per web worker process
+    'QUEUE_DEPTH': int(os.getenv('TRANSFORM_POOL_QUEUE_DEPTH', 4)),  # Renders waiting beyond this get a 429
+    'RETRY_AFTER': int(os.getenv('TRANSFORM_POOL_RETRY_AFTER', 1)),
+}
+
 # Cloudinary configuration
 CLOUDINARY_STORAGE = {
     'CLOUD_NAME': os.getenv('CLOUD_NAME'),
@@ -220,6 +278,16 @@ CLOUDINARY_STORAGE = {
     'API_SECRET': os.getenv('API_SECRET'),
 }
 
+# Outbound HTTP client (storage and CDN traffic), see image_service/http_client.py
+HTTP_CLIENT = {
+    'POOL_CONNECTIONS': int(os.getenv('HTTP_POOL_CONNECTIONS', 10)),  # Number of hosts kept in the pool
+    'POOL_MAXSIZE': int(os.getenv('HTTP_POOL_MAXSIZE', 20)),  # Keep-alive connections per host
+    'CONNECT_TIMEOUT': float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05)),
+    'READ_TIMEOUT': float(os.getenv('HTTP_READ_TIMEOUT', 30)),
+    'RETRIES': int(os.getenv('HTTP_RETRIES', 3)),
+    'BACKOFF_FACTOR': float(os.getenv('HTTP_BACKOFF_FACTOR', 0.5)),
+}
+
 # print('Cloudinary config:', {
 #     'CLOUD_NAME': os.getenv('CLOUD_NAME'),
 #     'API_KEY': os.getenv('API_KEY'),
@@ -26,6 +26,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/auth/', include('users.urls')),
     path(api, include('image_management.urls')),
+    path(api, include('transformations.urls')),
     
     # Swagger Docs
     path('swagger.<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
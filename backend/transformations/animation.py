@@ -0,0 +1,222 @@
+"""
+Frame-by-frame execution of compiled pipelines, for animated sources.
+
+Frames are decoded one at a time (seeking through the source), run through the
+pipeline and handed to the encoder right away, so memory stays proportional to
+one frame whatever the frame count:
+    - GIF output is written by GifStreamWriter: frames are quantized to the
+      first frame's palette (or each to its own, as are frames with colors that
+      palette lacks), only the region that changed
+      since the previous frame is encoded, with unchanged pixels inside it left
+      transparent, and frames identical to the previous one only extend its delay
+    - WebP output goes through Pillow's animation encoder, which seeks through a
+      RenderedFrames sequence and so pulls one rendered frame at a time
+Other output formats get the first frame, like any still image.
+"""
+import io
+import struct
+import numpy as np
+from PIL import Image as PilImage, GifImagePlugin
+
+# Output formats that keep the animation
+ANIMATED_FORMATS = ('gif', 'webp')
+
+# Palette index GifStreamWriter keeps for transparent (and unchanged) pixels
+TRANSPARENT_INDEX = 255
+
+# Error on any channel (0-255) above which a frame is not drawn with the first
+# frame's palette but gets its own: colors that palette lacks, even on a few
+# pixels, would otherwise be replaced by the nearest ones it has
+PALETTE_TOLERANCE = 48
+
+
+def is_animated(img):
+    return getattr(img, 'is_animated', False)
+
+
+def frame_mode(img):
+    """Mode every frame is rendered in, decided from the first frame so all frames match."""
+    return 'RGBA' if img.has_transparency_data else 'RGB'
+
+
+class RenderedFrames(PilImage.Image):
+    """
+    Multi-frame image whose frames are rendered from ``source`` when seeked to,
+    for encoders that take a multi-frame image and seek through it.
+
+    The delay of each frame is appended to ``durations`` as the frame is reached,
+    so the list can be handed to the encoder before any frame is rendered.
+    """
+    def __init__(self, source, render, durations):
+        super().__init__()
+        self.source = source
+        self.render = render
+        self.durations = durations
+        self.n_frames = source.n_frames
+        self.is_animated = True
+        self._frame = None
+        self.seek(0)
+
+    def seek(self, frame):
+        if frame == self._frame:
+            return
+        self.source.seek(frame)
+        rendered = self.render(self.source)
+        self.im = rendered.im
+        self._mode = rendered.mode
+        self._size = rendered.size
+        self.info = {'loop': self.source.info.get('loop', 0)}
+        if frame == len(self.durations):
+            self.durations.append(self.source.info.get('duration', 0))
+        self._frame = frame
+
+    def tell(self):
+        return self._frame
+
+
+class GifStreamWriter:
+    """
+    Write an animated GIF one frame at a time.
+
+    Args:
+        transparent: Whether frames have alpha. Transparent animations are written
+            as full frames cleared between each other, since leaving the previous
+            frame in place would show through the transparent pixels.
+        reuse_palette: Quantize every frame to the first frame's palette (written
+            once, as the global color table) instead of giving each its own.
+            Frames that palette does not match within PALETTE_TOLERANCE still
+            get their own.
+    """
+    def __init__(self, file, size, loop=0, transparent=False, reuse_palette=True):
+        self.file = file
+        self.size = size
+        self.loop = loop
+        self.transparent = transparent
+        self.reuse_palette = reuse_palette
+        self.palette = None
+        self.previous = None
+        self.pending = None
+        self.started = False
+
+    def _quantize(self, rgb):
+        """Return (palette indices, palette colors or None when the global palette applies)."""
+        if self.reuse_palette and self.palette is not None:
+            quantized = rgb.quantize(palette=self.palette, dither=PilImage.Dither.NONE)
+            error = np.abs(np.asarray(quantized.convert('RGB'), dtype=np.int16) - np.asarray(rgb, dtype=np.int16)).max()
+            if error <= PALETTE_TOLERANCE:
+                indices = np.array(quantized)
+                # Padding entries repeat color 0, so they never need to be told apart from it
+                indices[indices == TRANSPARENT_INDEX] = 0
+                return indices, None
+        quantized = rgb.quantize(TRANSPARENT_INDEX)
+        indices = np.array(quantized)
+        count = int(indices.max()) + 1
+        colors = quantized.getpalette()[:3 * count]
+        colors += colors[:3] * (256 - count)
+        if self.reuse_palette and self.palette is None:
+            self.palette = PilImage.new('P', (1, 1))
+            self.palette.putpalette(colors)
+            return indices, None
+        return indices, colors
+
+    def write(self, frame, duration):
+        """Add a frame (RGB, or RGBA when transparent) shown for ``duration`` milliseconds."""
+        pixels = np.asarray(frame)
+        rgb = pixels[:, :, :3]
+        box = (0, 0, frame.width, frame.height)
+        unchanged = None
+        if not self.transparent and self.previous is not None:
+            changed = np.any(rgb != self.previous, axis=2)
+            rows, columns = np.flatnonzero(changed.any(axis=1)), np.flatnonzero(changed.any(axis=0))
+            if not len(rows):
+                self.pending['duration'] += duration
+                return
+            box = (int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1)
+            unchanged = ~changed[box[1]:box[3], box[0]:box[2]]
+        self.previous = rgb
+
+        region = frame.crop(box) if unchanged is not None else frame
+        indices, colors = self._quantize(region.convert('RGB') if region.mode != 'RGB' else region)
+        if self.transparent:
+            indices[pixels[:, :, 3] < 128] = TRANSPARENT_INDEX
+        elif unchanged is not None:
+            indices[unchanged] = TRANSPARENT_INDEX
+        self._flush()
+        self.pending = {'indices': indices, 'colors': colors, 'offset': box[:2], 'duration': duration}
+
+    def _header(self, colors):
+        flags = 0xF7 if colors else 0  # Global color table of 256 entries
+        header = b'GIF89a' + struct.pack('<HHBBB', self.size[0], self.size[1], flags, TRANSPARENT_INDEX if colors else 0, 0)
+        if colors:
+            header += bytes(colors)
+        if self.loop is not None:
+            header += b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\x00'
+        self.file.write(header)
+
+    def _flush(self):
+        if self.pending is None:
+            return
+        pending, self.pending = self.pending, None
+        indices = np.ascontiguousarray(pending['indices'])
+        colors = pending['colors'] or self.palette.getpalette()
+        if not self.started:
+            self._header(None if pending['colors'] else colors)
+            self.started = True
+        img = PilImage.new('P', (indices.shape[1], indices.shape[0]))
+        img.frombytes(indices.tobytes())
+        img.putpalette(colors)
+        params = {
+            'duration': pending['duration'],
+            'disposal': 2 if self.transparent else 1,
+            'include_color_table': pending['colors'] is not None,
+        }
+        if self.transparent or (indices == TRANSPARENT_INDEX).any():
+            params['transparency'] = TRANSPARENT_INDEX
+        for data in GifImagePlugin.getdata(img, pending['offset'], **params):
+            self.file.write(data)
+
+    def close(self):
+        self._flush()
+        self.file.write(b';')
+
+
+def render_frames(img, steps, image_format, apply_step, quality=None, reuse_palette=True):
+    """
+    Run compiled steps on every frame of an animated image and encode the animation.
+
+    Args:
+        apply_step: The engine's function applying one step to an image.
+        quality: Encoder quality for WebP.
+
+    Returns:
+        (bytes, output size)
+    """
+    mode = frame_mode(img)
+
+    def render(frame):
+        frame = frame.convert(mode)
+        for step in steps:
+            frame = apply_step(frame, step)
+        return frame if frame.mode == mode else frame.convert(mode)
+
+    buffer = io.BytesIO()
+    if image_format == 'webp':
+        durations = []
+        frames = RenderedFrames(img, render, durations)
+        frames.save(buffer, 'WEBP', save_all=True, duration=durations, loop=frames.info['loop'], quality=quality or 80)
+        return buffer.getvalue(), frames.size
+
+    writer = None
+    index = 0
+    while True:
+        try:
+            img.seek(index)
+        except EOFError:
+            break
+        frame = render(img)
+        if writer is None:
+            writer = GifStreamWriter(buffer, frame.size, img.info.get('loop'), mode == 'RGBA', reuse_palette)
+        writer.write(frame, img.info.get('duration', 0))
+        index += 1
+    writer.close()
+    return buffer.getvalue(), writer.size
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class TransformationsConfig(AppConfig):
     name = 'transformations'
+
+    def ready(self):
+        # Register signal handlers (cache invalidation)
+        from . import signals  # noqa: F401
@@ -0,0 +1,269 @@
+"""
+Two-tier cache for rendered transformations.
+
+Entries are keyed by (image id, version of the original, canonical pipeline,
+output format):
+    - memory: a byte-bounded LRU per process, for small outputs
+    - disk: files under TRANSFORM_CACHE['DISK_ROOT'], one directory per image,
+      evicted least recently used first once the tier grows past its size bound
+
+Deleting or replacing an Image drops its entries from both tiers (see
+signals.py). That only reaches the memory tier of the process saving the row, so
+the key also carries the original's version: other processes never hit their
+stale entries, which age out of their LRU. Concurrent
+misses on the same key are rendered once (see singleflight.py).
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from django.conf import settings
+from PIL import Image as PilImage
+from .engine import TransformResult, canonical_spec
+
+# Defaults used for any TRANSFORM_CACHE key missing from the settings
+DEFAULTS = {
+    'ENABLED': True,
+    'MEMORY_MAX_BYTES': 64 * 1024 * 1024,
+    'MEMORY_MAX_ITEM_BYTES': 512 * 1024,
+    'DISK_ROOT': None,
+    'DISK_MAX_BYTES': 1024 * 1024 * 1024,
+}
+
+# Share of DISK_MAX_BYTES kept after an eviction pass, so evictions do not run on every write
+DISK_LOW_WATER = 0.9
+
+
+def original_version(image):
+    """Version of an image's original: its content hash, else its stored name (both change on replace)."""
+    return image.content_hash or image.original.name
+
+
+def cache_key(image_id, version, operations, image_format):
+    """Key of a rendered pipeline: equivalent specs of the same original and format share it."""
+    raw = f'{image_id}|{version}|{canonical_spec(operations)}|{image_format}'
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class MemoryTier:
+    """In-process LRU bounded by the total size of the cached bytes."""
+    def __init__(self, max_bytes, max_item_bytes):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._keys_by_image = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[1]
+        return None
+
+    def put(self, image_id, key, result):
+        size = len(result.data)
+        if size > self.max_item_bytes or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (image_id, result)
+            self._keys_by_image.setdefault(image_id, set()).add(key)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, image_id):
+        with self._lock:
+            for key in self._keys_by_image.pop(image_id, ()):
+                self._remove(key, image_id)
+
+    def _remove(self, key, image_id=None):
+        owner, result = self._entries.pop(key)
+        self.bytes -= len(result.data)
+        if image_id is None:
+            keys = self._keys_by_image.get(owner)
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_image[owner]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskTier:
+    """
+    Files under ``root``/<image id>/<key>.<format>.
+
+    Hits refresh the file's mtime, and eviction removes the oldest files first.
+    The directory may be shared by several processes, so eviction always works
+    from a fresh scan rather than from this process's counters.
+    """
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    def _path(self, image_id, key, image_format):
+        return os.path.join(self.root, str(image_id), f'{key}.{image_format}')
+
+    def get(self, image_id, key, image_format):
+        path = self._path(image_id, key, image_format)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with PilImage.open(BytesIO(data)) as img:
+            size = img.size
+        return TransformResult(data, image_format, size)
+
+    def put(self, image_id, key, result):
+        path = self._path(image_id, key, result.format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(result.data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._bytes += len(result.data)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        """Yield (mtime, size, path) for every cached file."""
+        for directory in os.scandir(self.root):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, entry.path
+
+    def _evict(self):
+        files = sorted(self._scan())
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * DISK_LOW_WATER
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+        self._bytes = total
+
+    def invalidate(self, image_id):
+        shutil.rmtree(os.path.join(self.root, str(image_id)), ignore_errors=True)
+        with self._lock:
+            self._bytes = None
+
+    def usage(self):
+        return sum(size for _, size, _ in self._scan()) if os.path.isdir(self.root) else 0
+
+
+class DerivativeCache:
+    """Memory tier in front of a disk tier, with hit, miss and eviction counters."""
+    def __init__(self, config=None):
+        config = {**DEFAULTS, **(config or {})}
+        self.enabled = config['ENABLED']
+        self.memory = MemoryTier(config['MEMORY_MAX_BYTES'], config['MEMORY_MAX_ITEM_BYTES'])
+        root = config['DISK_ROOT'] or os.path.join(settings.MEDIA_ROOT, 'transform-cache')
+        self.disk = DiskTier(root, config['DISK_MAX_BYTES'])
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def get(self, image_id, key, image_format):
+        """Return the cached TransformResult, or None."""
+        if not self.enabled:
+            return None
+        result = self.memory.get(key)
+        if result is not None:
+            self._count('memory_hits')
+            return result
+        result = self.disk.get(image_id, key, image_format)
+        if result is not None:
+            self._count('disk_hits')
+            self.memory.put(image_id, key, result)
+            return result
+        self._count('misses')
+        return None
+
+    def peek(self, image_id, key, image_format):
+        """Like get, without touching the counters (used while waiting on another worker's render)."""
+        if not self.enabled:
+            return None
+        result = self.memory.get(key)
+        if result is None:
+            result = self.disk.get(image_id, key, image_format)
+        return result
+
+    def put(self, image_id, key, result):
+        if not self.enabled:
+            return
+        self.memory.put(image_id, key, result)
+        self.disk.put(image_id, key, result)
+
+    def invalidate(self, image_id):
+        """Drop every entry of an image from both tiers."""
+        self.memory.invalidate(image_id)
+        self.disk.invalidate(image_id)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Return a snapshot of the counters and of the size of each tier."""
+        with self._lock:
+            stats = dict(self._stats)
+        hits = stats['memory_hits'] + stats['disk_hits']
+        lookups = hits + stats['misses']
+        stats['hit_ratio'] = hits / lookups if lookups else 0.0
+        stats['memory'] = {
+            'entries': len(self.memory),
+            'bytes': self.memory.bytes,
+            'max_bytes': self.memory.max_bytes,
+            'evictions': self.memory.evictions,
+        }
+        stats['disk'] = {
+            'bytes': self.disk.usage(),
+            'max_bytes': self.disk.max_bytes,
+            'evictions': self.disk.evictions,
+        }
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide DerivativeCache, created on first use from settings.TRANSFORM_CACHE."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DerivativeCache(getattr(settings, 'TRANSFORM_CACHE', None))
+    return _cache
@@ -0,0 +1,130 @@
+"""
+HTTP caching and range support for delivered image bytes.
+
+Responses carry a strong ETag and Last-Modified, so conditional requests are
+answered with 304 (or 412) by Django's get_conditional_response, and a single
+byte range ("bytes=start-end", "bytes=start-" or "bytes=-length") is served as
+206, or 416 when it starts past the end. Requests with several ranges get the
+whole body, as RFC 9110 allows; If-Range falls back to the whole body when the
+representation changed. If-Range is only matched against the ETag: rendered
+bytes may change under the same Last-Modified (e.g. re-encoded after a cache
+eviction), so a date cannot tell whether a partial download can be resumed.
+
+Rendered bodies are tagged with the hash of their own bytes (content_etag), so
+a tag never stands for two different encodes. Where the tag is known before the
+body is produced (the stored original, whose content hash is recorded),
+not_modified answers conditional requests without reading or rendering it.
+"""
+import hashlib
+import re
+from calendar import timegm
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+# Cache-Control for URLs whose content never changes (stored derivatives)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def strong_etag(*parts):
+    """Quoted strong ETag derived from ``parts`` (e.g. a content hash and the spec rendered from it)."""
+    if len(parts) == 1 and parts[0]:
+        return quote_etag(str(parts[0]))
+    return quote_etag(hashlib.sha256('|'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def content_etag(data):
+    """Quoted strong ETag of a body: the SHA-256 of its bytes."""
+    return quote_etag(hashlib.sha256(data).hexdigest())
+
+
+def byte_range(request, length, etag):
+    """
+    The byte range a request asks for, as (start, end) with ``end`` exclusive.
+
+    Returns:
+        None to serve the whole body, or (start, end); start >= length means
+        the range cannot be satisfied.
+    """
+    header = request.headers.get('Range')
+    if not header or request.method not in ('GET', 'HEAD'):
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag:
+        return None
+    match = RANGE_PATTERN.match(header.replace(' ', ''))
+    if match is None:
+        return None  # Several ranges, or a unit other than bytes
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: the last N bytes
+        return max(0, length - int(last)), length
+    start = int(first)
+    if last and int(last) < start:
+        return None  # Invalid range, ignored
+    return start, min(length, int(last) + 1) if last else length
+
+
+def serve(request, open_body, length, content_type, etag, modified_at, cache_control, vary=None, filename=None):
+    """
+    Build a cacheable response for a body of ``length`` bytes.
+
+    Args:
+        open_body: Called as open_body(start, end) to read bytes [start, end) of
+            the body, only when a body is sent.
+        etag: Strong ETag, quoted.
+        modified_at: Datetime used for Last-Modified.
+        vary: Request headers the representation depends on.
+    """
+    last_modified = timegm(modified_at.utctimetuple())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        requested = byte_range(request, length, etag)
+        if requested is None:
+            response = HttpResponse(open_body(0, length), content_type=content_type)
+        elif requested[0] >= length:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{length}'
+        else:
+            start, end = requested
+            response = HttpResponse(open_body(start, end), content_type=content_type, status=206)
+            response['Content-Range'] = f'bytes {start}-{end - 1}/{length}'
+        if filename:
+            response['Content-Disposition'] = f'inline; filename="{filename}"'
+
+    return _set_headers(response, etag, last_modified, cache_control, vary)
+
+
+def not_modified(request, etag, modified_at, cache_control, vary=None):
+    """
+    Answer a conditional request from validators known before the body is
+    produced, so it need not be read or rendered.
+
+    Returns:
+        The 304 (or 412) response, or None when the body has to be served.
+    """
+    last_modified = timegm(modified_at.utctimetuple())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        return None
+    return _set_headers(response, etag, last_modified, cache_control, vary)
+
+
+def _set_headers(response, etag, last_modified, cache_control, vary):
+    if response.status_code in (200, 206, 304):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = cache_control
+    response['Accept-Ranges'] = 'bytes'
+    if vary:
+        patch_vary_headers(response, vary)
+    return response
+
+
+def serve_bytes(request, data, content_type, etag, modified_at, cache_control, vary=None, filename=None):
+    """serve() for a body already in memory."""
+    return serve(request, lambda start, end: data[start:end], len(data), content_type, etag, modified_at, cache_control, vary, filename)
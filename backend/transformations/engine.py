@@ -0,0 +1,622 @@
+"""
+Image transformation engine.
+
+A pipeline is an ordered list of operations, e.g.
+    [{"op": "crop", "x": 0, "y": 0, "width": 800, "height": 600},
+     {"op": "resize", "width": 400},
+     {"op": "filter", "name": "grayscale"},
+     {"op": "format", "format": "webp"}]
+
+The source is decoded once per pipeline. Adjacent crops and resizes are merged
+into a single resample pass, and color filters are fused into one pass run
+after the geometry, so they touch as few pixels as possible. When the pipeline
+starts with a downscale, JPEGs are decoded at a reduced scale (DCT scaling).
+Operations apply to the upright image: the EXIF orientation is applied right
+after decoding, as for the stored dimensions. Very large sources run strip by strip (see tiling.py), and animated sources
+frame by frame (see animation.py).
+
+This module only depends on PIL and NumPy, so it can also run outside Django
+(e.g. in worker processes).
+"""
+import io
+import json
+import math
+from PIL import ExifTags, Image as PilImage, ImageOps, features
+from .filters import COLOR_FILTERS, KERNEL_FILTERS, FILTER_PARAMS, fuse, apply_color
+from .quality import search_quality, MAX_QUALITY
+from .watermark import POSITIONS, apply_watermark, asset_version
+from . import animation, tiling
+
+
+# Raised for an invalid pipeline
+class TransformError(ValueError):
+    pass
+
+
+# Output formats and the PIL encoder used for each
+OUTPUT_FORMATS = {
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+    'webp': 'WEBP',
+    'gif': 'GIF',
+}
+if features.check('avif'):
+    OUTPUT_FORMATS['avif'] = 'AVIF'
+
+CONTENT_TYPES = {name: f'image/{name}' for name in OUTPUT_FORMATS}
+
+# Default encoder quality for lossy formats
+DEFAULT_QUALITY = {'jpeg': 85, 'webp': 80, 'avif': 60}
+
+# Lowest SSIM target a compress operation accepts (see quality.py)
+MIN_TARGET = 0.5
+
+# Downscales keep at least this many source pixels per output pixel before the final
+# resample (reduced JPEG decoding, then a box reduce), as Pillow's thumbnail() does
+REDUCING_GAP = 2.0
+
+# Largest accepted pipeline and output image
+MAX_OPERATIONS = 20
+MAX_OUTPUT_PIXELS = 40_000_000
+
+# Lossless transposes, by operation
+TRANSPOSES = {
+    'flip': PilImage.Transpose.FLIP_TOP_BOTTOM,
+    'mirror': PilImage.Transpose.FLIP_LEFT_RIGHT,
+    90: PilImage.Transpose.ROTATE_270,   # Degrees are clockwise, PIL rotates counter-clockwise
+    180: PilImage.Transpose.ROTATE_180,
+    270: PilImage.Transpose.ROTATE_90,
+}
+
+# Transposes turning stored pixels upright, by EXIF orientation (as ImageOps.exif_transpose)
+ORIENTATIONS = {
+    2: PilImage.Transpose.FLIP_LEFT_RIGHT,
+    3: PilImage.Transpose.ROTATE_180,
+    4: PilImage.Transpose.FLIP_TOP_BOTTOM,
+    5: PilImage.Transpose.TRANSPOSE,
+    6: PilImage.Transpose.ROTATE_270,
+    7: PilImage.Transpose.TRANSVERSE,
+    8: PilImage.Transpose.ROTATE_90,
+}
+
+
+def _int_param(params, key, minimum=None, maximum=None, required=True):
+    value = params.get(key)
+    if value is None:
+        if required:
+            raise TransformError(f"'{key}' is required.")
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise TransformError(f"'{key}' must be an integer.")
+    if minimum is not None and value < minimum:
+        raise TransformError(f"'{key}' must be at least {minimum}.")
+    if maximum is not None and value > maximum:
+        raise TransformError(f"'{key}' must be at most {maximum}.")
+    return value
+
+
+def _float_param(params, key, default, minimum, maximum):
+    try:
+        value = float(params.get(key, default))
+    except (TypeError, ValueError):
+        raise TransformError(f"'{key}' must be a number.")
+    if not minimum <= value <= maximum:
+        raise TransformError(f"'{key}' must be between {minimum} and {maximum}.")
+    return value
+
+
+def _normalize_resize(params):
+    width = _int_param(params, 'width', minimum=1, required=False)
+    height = _int_param(params, 'height', minimum=1, required=False)
+    if width is None and height is None:
+        raise TransformError("Resize needs a width, a height or both.")
+    fit = params.get('fit', 'scale')
+    if fit not in ('scale', 'contain', 'fill'):
+        raise TransformError("'fit' must be one of scale, contain or fill.")
+    if fit != 'scale' and (width is None or height is None):
+        fit = 'scale'  # Only one side given: both modes keep the aspect ratio anyway
+    return {'width': width, 'height': height, 'fit': fit}
+
+
+def _normalize_crop(params):
+    return {
+        'x': _int_param(params, 'x', minimum=0, required=False) or 0,
+        'y': _int_param(params, 'y', minimum=0, required=False) or 0,
+        'width': _int_param(params, 'width', minimum=1),
+        'height': _int_param(params, 'height', minimum=1),
+    }
+
+
+def _normalize_rotate(params):
+    try:
+        degrees = float(params.get('degrees'))
+    except (TypeError, ValueError):
+        raise TransformError("'degrees' must be a number.")
+    if not math.isfinite(degrees):
+        raise TransformError("'degrees' must be a finite number.")
+    degrees = degrees % 360
+    return {'degrees': int(degrees) if degrees.is_integer() else degrees}
+
+
+def _normalize_format(params):
+    image_format = str(params.get('format', '')).lower().replace('jpg', 'jpeg')
+    if image_format not in OUTPUT_FORMATS:
+        raise TransformError(f"'format' must be one of {', '.join(OUTPUT_FORMATS)}.")
+    return {'format': image_format}
+
+
+def _normalize_compress(params):
+    if params.get('target') is None:
+        return {'quality': _int_param(params, 'quality', minimum=1, maximum=100)}
+    if params.get('quality') is not None:
+        raise TransformError("Compress takes either a quality or a target, not both.")
+    try:
+        target = float(params['target'])
+    except (TypeError, ValueError):
+        raise TransformError("'target' must be a number.")
+    if not MIN_TARGET <= target < 1:
+        raise TransformError(f"'target' must be at least {MIN_TARGET} and below 1.")
+    return {'target': round(target, 4)}
+
+
+def _normalize_filter(params):
+    name = params.get('name')
+    if name not in COLOR_FILTERS and name not in KERNEL_FILTERS:
+        raise TransformError(f"'name' must be one of {', '.join([*COLOR_FILTERS, *KERNEL_FILTERS])}.")
+    normalized = {'name': name}
+    for key, (default, minimum, maximum) in FILTER_PARAMS.get(name, {}).items():
+        normalized[key] = _float_param(params, key, default, minimum, maximum)
+    return normalized
+
+
+def _normalize_watermark(params):
+    position = params.get('position', 'bottom-right')
+    if position not in POSITIONS:
+        raise TransformError(f"'position' must be one of {', '.join(POSITIONS)}.")
+    margin = _int_param(params, 'margin', minimum=0, maximum=1000, required=False)
+    return {
+        'position': position,
+        'scale': _float_param(params, 'scale', 0.25, 0.01, 1.0),
+        'opacity': round(_float_param(params, 'opacity', 0.5, 0.0, 1.0), 2),
+        'margin': 16 if margin is None else margin,
+    }
+
+
+# Supported operations and the function validating their parameters
+OPERATIONS = {
+    'resize': _normalize_resize,
+    'crop': _normalize_crop,
+    'rotate': _normalize_rotate,
+    'flip': lambda params: {},
+    'mirror': lambda params: {},
+    'format': _normalize_format,
+    'compress': _normalize_compress,
+    'filter': _normalize_filter,
+    'watermark': _normalize_watermark,
+}
+
+
+def normalize_pipeline(operations):
+    """
+    Validate a pipeline and return it in canonical form (one dict per operation).
+
+    Raises:
+        TransformError: If the pipeline or one of its operations is invalid.
+    """
+    if not isinstance(operations, (list, tuple)) or not operations:
+        raise TransformError("A transformation pipeline must be a non-empty list.")
+    if len(operations) > MAX_OPERATIONS:
+        raise TransformError(f"A pipeline can have at most {MAX_OPERATIONS} operations.")
+    normalized = []
+    for params in operations:
+        if not isinstance(params, dict):
+            raise TransformError("Each operation must be an object.")
+        name = params.get('op')
+        if name not in OPERATIONS:
+            raise TransformError(f"Unknown operation '{name}'.")
+        normalized.append({'op': name, **OPERATIONS[name](params)})
+    return normalized
+
+
+def canonical_spec(operations):
+    """Serialize a normalized pipeline the same way every time (used for hashing and cache keys)."""
+    return json.dumps(operations, sort_keys=True, separators=(',', ':'))
+
+
+class Geometry:
+    """
+    Pending crops and resizes, kept as a box in source coordinates plus an output
+    size, so that any run of them costs a single resample.
+    """
+    def __init__(self, size):
+        self.source_size = size
+        self.box = (0.0, 0.0, float(size[0]), float(size[1]))
+        self.size = size
+
+    def _crop_box(self, x, y, width, height):
+        # (x, y, width, height) are in the current output's coordinates
+        scale_x = (self.box[2] - self.box[0]) / self.size[0]
+        scale_y = (self.box[3] - self.box[1]) / self.size[1]
+        left, top = self.box[0], self.box[1]
+        self.box = (left + x * scale_x, top + y * scale_y, left + (x + width) * scale_x, top + (y + height) * scale_y)
+
+    def crop(self, x, y, width, height):
+        current_width, current_height = self.size
+        if x >= current_width or y >= current_height:
+            raise TransformError("Crop starts outside the image.")
+        width, height = min(width, current_width - x), min(height, current_height - y)
+        self._crop_box(x, y, width, height)
+        self.size = (width, height)
+
+    def resize(self, width, height, fit):
+        current_width, current_height = self.size
+        if width is None:
+            width = max(1, round(current_width * height / current_height))
+        elif height is None:
+            height = max(1, round(current_height * width / current_width))
+
+        if fit == 'contain':
+            ratio = min(width / current_width, height / current_height)
+            width, height = max(1, round(current_width * ratio)), max(1, round(current_height * ratio))
+        elif fit == 'fill':
+            # Scale to cover the target, then crop the centre
+            ratio = max(width / current_width, height / current_height)
+            crop_width, crop_height = width / ratio, height / ratio
+            self._crop_box((current_width - crop_width) / 2, (current_height - crop_height) / 2, crop_width, crop_height)
+        self.size = (width, height)
+
+    @property
+    def is_identity(self):
+        return self.size == self.source_size and self.box == (0.0, 0.0, float(self.size[0]), float(self.size[1]))
+
+    def step(self):
+        """Return the single step applying this geometry, or None when nothing changes."""
+        if self.is_identity:
+            return None
+        box_size = (self.box[2] - self.box[0], self.box[3] - self.box[1])
+        if box_size == self.size and all(float(v).is_integer() for v in self.box):
+            return ('crop', tuple(int(v) for v in self.box), self.size)
+        return ('resample', self.box, self.size)
+
+
+def _rotated_size(size, degrees):
+    radians = math.radians(degrees)
+    cos, sin = abs(math.cos(radians)), abs(math.sin(radians))
+    width, height = size
+    return (math.ceil(width * cos + height * sin), math.ceil(width * sin + height * cos))
+
+
+# Result of running a pipeline
+class TransformResult:
+    def __init__(self, data, image_format, size, quality=None):
+        self.data = data
+        self.format = image_format
+        self.width, self.height = size
+        self.quality = quality
+
+    @property
+    def content_type(self):
+        return CONTENT_TYPES[self.format]
+
+
+class Pipeline:
+    """
+    A validated pipeline, compiled against the source size into steps.
+
+    Each step is a tuple whose first item is its kind ('crop', 'resample',
+    'transpose', 'rotate', 'color', 'convolve' or 'watermark') and whose last
+    item is the size of the image it produces.
+
+    Sources of at least ``tile_threshold`` pixels run strip by strip (see
+    tiling.py) when the compiled steps allow it. Animated sources keep their
+    animation in GIF and WebP output (see animation.py; ``reuse_palette`` is
+    passed on to the GIF writer). Watermark operations use the asset at
+    ``watermark_path``, and record its version in an 'asset' key, so that
+    specs (and cache keys) change when the asset is replaced.
+
+    A compress operation sets either a fixed ``quality`` or an SSIM ``target``,
+    for which the encoder quality is searched on the output (see quality.py).
+    """
+    def __init__(self, operations, max_pixels=MAX_OUTPUT_PIXELS, tile_threshold=None, strip_rows=tiling.STRIP_ROWS,
+                 reuse_palette=True, watermark_path=None):
+        self.operations = normalize_pipeline(operations)
+        self.max_pixels = max_pixels
+        self.tile_threshold = tile_threshold
+        self.strip_rows = strip_rows
+        self.reuse_palette = reuse_palette
+        self.watermark_path = watermark_path
+        if watermark_path and any(op['op'] == 'watermark' for op in self.operations):
+            version = asset_version(watermark_path)
+            self.operations = [{**op, 'asset': version} if op['op'] == 'watermark' else op for op in self.operations]
+        self.format = None
+        self.quality = None
+        self.target = None
+        for op in self.operations:
+            if op['op'] == 'format':
+                self.format = op['format']
+            elif op['op'] == 'compress':
+                self.quality = op.get('quality')
+                self.target = op.get('target')
+
+    def steps(self, size):
+        """
+        Compile the pipeline for a source of ``size``.
+
+        Adjacent geometry is merged into one step. Color filters commute with
+        geometry, so they are deferred and fused into one step, run on the
+        smallest image possible; blur and sharpen keep their place.
+        """
+        steps, colors = [], []
+        geometry = Geometry(size)
+
+        def flush():
+            step = geometry.step()
+            if step is not None:
+                steps.append(step)
+            if colors:
+                steps.append(('color', fuse(colors), geometry.size))
+                colors.clear()
+
+        for op in self.operations:
+            name = op['op']
+            if name == 'crop':
+                geometry.crop(op['x'], op['y'], op['width'], op['height'])
+            elif name == 'resize':
+                geometry.resize(op['width'], op['height'], op['fit'])
+            elif name in ('flip', 'mirror') or (name == 'rotate' and op['degrees'] in TRANSPOSES):
+                flush()
+                size = geometry.size
+                method = TRANSPOSES[op['degrees'] if name == 'rotate' else name]
+                if method in (PilImage.Transpose.ROTATE_90, PilImage.Transpose.ROTATE_270):
+                    size = (size[1], size[0])
+                steps.append(('transpose', method, size))
+                geometry = Geometry(size)
+            elif name == 'rotate' and op['degrees']:
+                flush()
+                size = _rotated_size(geometry.size, op['degrees'])
+                steps.append(('rotate', op['degrees'], size))
+                geometry = Geometry(size)
+            elif name == 'filter' and op['name'] in COLOR_FILTERS:
+                colors.append((op['name'], op))
+            elif name == 'filter':
+                flush()
+                steps.append(('convolve', op['name'], op, geometry.size))
+                geometry = Geometry(geometry.size)
+            elif name == 'watermark':
+                if not self.watermark_path:
+                    raise TransformError("Watermarking is not configured.")
+                flush()
+                steps.append(('watermark', self.watermark_path, op, geometry.size))
+                geometry = Geometry(geometry.size)
+
+            if geometry.size[0] * geometry.size[1] > self.max_pixels:
+                raise TransformError(f"The output would exceed {self.max_pixels} pixels.")
+        flush()
+        return steps
+
+    @property
+    def options(self):
+        """Keyword arguments rebuilding this pipeline with the same settings (e.g. in another process)."""
+        return {
+            'max_pixels': self.max_pixels,
+            'tile_threshold': self.tile_threshold,
+            'strip_rows': self.strip_rows,
+            'reuse_palette': self.reuse_palette,
+            'watermark_path': self.watermark_path,
+        }
+
+    def output_format(self, source_format):
+        if self.format:
+            return self.format
+        source_format = (source_format or '').lower()
+        return source_format if source_format in OUTPUT_FORMATS else 'png'
+
+    def resolve_quality(self, img, image_format, quality=None):
+        """
+        Encoder quality for ``img``: ``quality`` when given (e.g. found earlier for
+        the same image), else the pipeline's own, else searched for its target.
+        """
+        quality = quality or self.quality
+        if quality is None and self.target is not None:
+            # Lossless formats have nothing to search: the target just asks for optimization
+            quality = search_quality(img, image_format, self.target, encode) if image_format in DEFAULT_QUALITY else MAX_QUALITY
+        return quality
+
+    def apply(self, img, steps):
+        """Apply compiled steps to a decoded image."""
+        for step in steps:
+            img = apply_step(img, step)
+        return img
+
+    def render(self, source):
+        """
+        Decode ``source`` (a path or file object) once and apply the pipeline.
+
+        Returns:
+            (PIL image, source format)
+        """
+        with PilImage.open(source) as img:
+            steps = draft(img, self.steps(upright_size(img)))
+            img.load()
+            return self.apply(working_image(upright(img)), steps), img.format
+
+    def use_strips(self, size, steps):
+        """Whether a source of ``size`` is large enough, and the steps simple enough, to run in strips."""
+        return bool(self.tile_threshold) and size[0] * size[1] >= self.tile_threshold and tiling.supports(steps)
+
+    def run(self, source, quality=None):
+        """
+        Decode ``source`` once, apply the pipeline and encode the result.
+
+        Args:
+            quality: Encoder quality to use instead of searching for the target.
+
+        Returns:
+            TransformResult, with the quality used
+        """
+        def encoder(output):
+            nonlocal quality
+            quality = self.resolve_quality(output, image_format, quality)
+            return encode(output, image_format, quality)
+
+        with PilImage.open(source) as img:
+            image_format = self.output_format(img.format)
+            size = upright_size(img)
+            steps = self.steps(size)
+            if image_format in animation.ANIMATED_FORMATS and animation.is_animated(img):
+                # No quality search here: a target falls back to the default quality
+                quality = quality or self.quality
+                orientation = ORIENTATIONS.get(exif_orientation(img))
+                if orientation is not None:
+                    # Frames are decoded one at a time: each is turned upright by a first step
+                    steps = [('transpose', orientation, size)] + steps
+                data, size = animation.render_frames(img, steps, image_format, apply_step, quality, self.reuse_palette)
+                return TransformResult(data, image_format, size, quality)
+            strips = self.use_strips(size, steps)
+            steps = draft(img, steps)
+            img.load()
+            img = working_image(upright(img))
+            if strips:
+                data, size = tiling.render_strips(img, steps, image_format, apply_step, encoder, self.strip_rows, REDUCING_GAP)
+                return TransformResult(data, image_format, size, quality)
+            output = self.apply(img, steps)
+        data = encoder(output)
+        return TransformResult(data, image_format, output.size, quality)
+
+
+def draft(img, steps):
+    """
+    Ask the decoder for a reduced image when the pipeline starts with a downscale.
+
+    JPEG decoders can scale by 1/2, 1/4 or 1/8 while decoding, which skips most
+    of the IDCT work and memory of a full decode. The reduced image keeps at
+    least REDUCING_GAP source pixels per output pixel, so the final resample
+    still has detail to work with. Must be called before the image is loaded.
+
+    Returns:
+        The steps, with the first resample box rescaled to the reduced image.
+    """
+    if img.format != 'JPEG' or not steps or steps[0][0] != 'resample':
+        return steps
+    _, box, size = steps[0]
+    # Source pixels per output pixel along the less reduced axis
+    scale = min((box[2] - box[0]) / size[0], (box[3] - box[1]) / size[1])
+    if scale < 2 * REDUCING_GAP:
+        return steps
+
+    requested = (max(1, math.ceil(img.width / scale * REDUCING_GAP)), max(1, math.ceil(img.height / scale * REDUCING_GAP)))
+    original_width = img.width
+    drafted = img.draft(img.mode, requested)
+    if drafted is None:
+        return steps
+    # The decoder's scale factor (1, 2, 4 or 8)
+    factor = original_width / drafted[1][2]
+    if factor == 1:
+        return steps
+    return [('resample', tuple(v / factor for v in box), size)] + steps[1:]
+
+
+def exif_orientation(img):
+    """EXIF orientation of an opened image, 1 (upright) when it has none."""
+    return img.getexif().get(ExifTags.Base.Orientation, 1)
+
+
+def upright_size(img):
+    """Size of an opened image once its EXIF orientation is applied."""
+    orientation = ORIENTATIONS.get(exif_orientation(img))
+    if orientation in (PilImage.Transpose.TRANSPOSE, PilImage.Transpose.TRANSVERSE,
+                       PilImage.Transpose.ROTATE_90, PilImage.Transpose.ROTATE_270):
+        return img.height, img.width
+    return img.size
+
+
+def upright(img):
+    """
+    Apply the EXIF orientation to a loaded image, as metadata.read_proxy does.
+
+    Steps are compiled for upright_size(), and draft() scales both axes alike,
+    so the steps apply to the result whether or not the decode was reduced.
+    """
+    if exif_orientation(img) not in ORIENTATIONS:
+        return img
+    return ImageOps.exif_transpose(img)
+
+
+def working_image(img):
+    """Convert palette and other special modes to RGB(A) so resampling and filters work on them."""
+    if img.mode in ('RGB', 'RGBA', 'L'):
+        return img
+    if img.mode == 'LA' or 'transparency' in img.info or img.mode in ('PA', 'RGBa'):
+        return img.convert('RGBA')
+    return img.convert('RGB')
+
+
+def apply_step(img, step):
+    kind = step[0]
+    if kind == 'crop':
+        return img.crop(step[1])
+    if kind == 'resample':
+        return img.resize(step[2], PilImage.Resampling.LANCZOS, box=step[1], reducing_gap=REDUCING_GAP)
+    if kind == 'transpose':
+        return img.transpose(step[1])
+    if kind == 'rotate':
+        return img.rotate(-step[1], PilImage.Resampling.BICUBIC, expand=True)
+    if kind == 'color':
+        return apply_color(img, step[1])
+    if kind == 'convolve':
+        return KERNEL_FILTERS[step[1]](img, step[2])
+    if kind == 'watermark':
+        return apply_watermark(img, step[1], step[2])
+    raise TransformError(f"Unknown step '{kind}'.")
+
+
+def encode(img, image_format, quality=None):
+    """Encode an image in one of OUTPUT_FORMATS and return the bytes."""
+    params = {}
+    if image_format in DEFAULT_QUALITY:
+        params['quality'] = quality or DEFAULT_QUALITY[image_format]
+    if image_format == 'jpeg':
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        params['optimize'] = True
+    elif image_format == 'png':
+        params['optimize'] = quality is not None
+    elif image_format == 'gif' and img.mode not in ('P', 'L'):
+        img = img.convert('RGB').quantize(256)
+    buffer = io.BytesIO()
+    img.save(buffer, OUTPUT_FORMATS[image_format], **params)
+    return buffer.getvalue()
+
+
+def variant_height(size, width):
+    """Height of a variant ``width`` pixels wide, keeping the aspect ratio of ``size``."""
+    return max(1, round(size[1] * width / size[0]))
+
+
+def build_variants(source, widths, quality=None):
+    """
+    Decode ``source`` once and yield (width, TransformResult) for each width
+    narrower than the source, largest first.
+
+    Each level is downsampled from the previous one rather than from the source,
+    so every level after the first resamples an already small image. The first
+    level benefits from reduced-scale JPEG decoding.
+    """
+    with PilImage.open(source) as img:
+        image_format = img.format.lower() if (img.format or '').lower() in OUTPUT_FORMATS else 'png'
+        source_size = upright_size(img)
+        widths = sorted({width for width in widths if width < source_size[0]}, reverse=True)
+        if not widths:
+            return
+        first = (widths[0], variant_height(source_size, widths[0]))
+        steps = draft(img, [('resample', (0.0, 0.0, float(source_size[0]), float(source_size[1])), first)])
+        img.load()
+        current = apply_step(working_image(upright(img)), steps[0])
+
+    for width in widths:
+        size = (width, variant_height(source_size, width))
+        if current.size != size:
+            current = current.resize(size, PilImage.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        yield width, TransformResult(encode(current, image_format, quality), image_format, size)
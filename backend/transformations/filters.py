@@ -0,0 +1,259 @@
+"""
+Vectorized filter kernels.
+
+Color filters are affine maps of RGB, written as 4x4 homogeneous matrices, so
+any chain of them is fused into a single matrix before touching pixels:
+    - diagonal chains (brightness, contrast, invert) run as a per-channel lookup table
+    - chains ending in grayscale compute a single band and return an L image
+    - everything else is one float32 matrix multiply, run over blocks of rows
+Fused chains clip to 0-255 once at the end instead of after every filter.
+
+Blur is a separable Gaussian (one pass per axis) and sharpen is an unsharp mask
+built on it. Color filters and sharpen leave alpha untouched; blur softens every
+band, as ImageFilter.GaussianBlur does.
+"""
+import math
+import numpy as np
+from PIL import Image as PilImage
+
+# Rows of pixels processed per block, so float intermediates stay in cache
+BLOCK_ROWS = 32
+
+# Blur radius from which box passes replace the exact Gaussian kernel
+BOX_BLUR_MIN_RADIUS = 6.0
+
+# ITU-R 601 luma weights, as used by PIL's grayscale conversion
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+SEPIA = np.array([
+    [0.393, 0.769, 0.189],
+    [0.349, 0.686, 0.168],
+    [0.272, 0.534, 0.131],
+], dtype=np.float32)
+
+
+def _affine(matrix=None, offset=0.0):
+    """Build a 4x4 homogeneous color matrix from a 3x3 matrix and an offset."""
+    result = np.eye(4, dtype=np.float32)
+    if matrix is not None:
+        result[:3, :3] = matrix
+    result[:3, 3] = offset
+    return result
+
+
+def grayscale_matrix(params=None):
+    return _affine(np.tile(LUMA, (3, 1)))
+
+
+def sepia_matrix(params=None):
+    return _affine(SEPIA)
+
+
+def invert_matrix(params=None):
+    return _affine(-np.eye(3, dtype=np.float32), 255.0)
+
+
+def brightness_matrix(params):
+    # Same as ImageEnhance.Brightness: blend with black
+    return _affine(np.eye(3, dtype=np.float32) * params['amount'])
+
+
+def contrast_matrix(params):
+    # Blend with mid-gray. ImageEnhance.Contrast blends with the image's mean gray,
+    # which would need a pass over the pixels first and breaks fusion.
+    amount = params['amount']
+    return _affine(np.eye(3, dtype=np.float32) * amount, 128.0 * (1 - amount))
+
+
+def saturation_matrix(params):
+    # Same as ImageEnhance.Color: blend with the grayscale image
+    amount = params['amount']
+    return _affine(np.eye(3, dtype=np.float32) * amount + np.tile(LUMA, (3, 1)) * (1 - amount))
+
+
+# Color filters and the matrix for each
+COLOR_FILTERS = {
+    'grayscale': grayscale_matrix,
+    'sepia': sepia_matrix,
+    'invert': invert_matrix,
+    'brightness': brightness_matrix,
+    'contrast': contrast_matrix,
+    'saturation': saturation_matrix,
+}
+
+
+def fuse(filters):
+    """
+    Fuse a chain of color filters into one matrix.
+
+    Args:
+        filters: (name, params) pairs, in the order they apply.
+    """
+    matrix = np.eye(4, dtype=np.float32)
+    for name, params in filters:
+        matrix = COLOR_FILTERS[name](params) @ matrix
+    return matrix
+
+
+def _split_alpha(img):
+    """Return (RGB image, alpha band or None)."""
+    if img.mode in ('RGBA', 'LA'):
+        return img.convert('RGB'), img.getchannel('A')
+    if img.mode != 'RGB':
+        return img.convert('RGB'), None
+    return img, None
+
+
+def _join_alpha(img, alpha):
+    if alpha is not None:
+        img.putalpha(alpha)
+    return img
+
+
+def apply_color(img, matrix):
+    """Apply a fused color matrix to an image."""
+    rgb, alpha = _split_alpha(img)
+    linear, offset = matrix[:3, :3], matrix[:3, 3]
+
+    if np.count_nonzero(linear - np.diag(np.diag(linear))) == 0:
+        # Each output channel depends only on its own input channel: one 256-entry table per channel
+        levels = np.arange(256, dtype=np.float32)
+        tables = np.clip(np.rint(np.outer(np.diag(linear), levels) + offset[:, None]), 0, 255)
+        return _join_alpha(rgb.point(tables.astype(np.uint8).ravel().tolist()), alpha)
+
+    pixels = np.asarray(rgb)
+    if np.all(linear == linear[0]):
+        # Every output channel is the same (grayscale chains): compute one band
+        gray = np.empty(pixels.shape[:2], dtype=np.uint8)
+        for top in range(0, pixels.shape[0], BLOCK_ROWS):
+            result = pixels[top:top + BLOCK_ROWS].astype(np.float32) @ linear[0]
+            result += offset[0] + 0.5
+            np.clip(result, 0, 255, out=result)
+            gray[top:top + BLOCK_ROWS] = result
+        gray = PilImage.fromarray(gray)
+        return _join_alpha(gray.convert('LA'), alpha) if alpha is not None else gray
+
+    out = np.empty_like(pixels)
+    transposed = np.ascontiguousarray(linear.T)
+    # Offset tiled over a whole row: broadcasting a 3-vector over the last axis is slow.
+    # The extra 0.5 makes the truncation to uint8 round.
+    row_offset = np.tile(offset + 0.5, pixels.shape[1])
+    for top in range(0, pixels.shape[0], BLOCK_ROWS):
+        result = pixels[top:top + BLOCK_ROWS].astype(np.float32) @ transposed
+        flat = result.reshape(result.shape[0], -1)
+        flat += row_offset
+        np.clip(flat, 0, 255, out=flat)
+        out[top:top + BLOCK_ROWS] = result
+    return _join_alpha(PilImage.fromarray(out), alpha)
+
+
+def gaussian_kernel(radius):
+    """1D Gaussian kernel with standard deviation ``radius``, truncated at 3 sigma."""
+    half = max(1, math.ceil(radius * 3))
+    x = np.arange(-half, half + 1, dtype=np.float32)
+    kernel = np.exp(-(x * x) / (2 * radius * radius))
+    return kernel / kernel.sum()
+
+
+def box_sizes(radius, passes=3):
+    """Widths of ``passes`` box filters whose succession approximates a Gaussian of std ``radius``."""
+    ideal = math.sqrt(12 * radius * radius / passes + 1)
+    lower = math.floor(ideal)
+    if lower % 2 == 0:
+        lower -= 1
+    count = round((12 * radius * radius - passes * lower * lower - 4 * passes * lower - 3 * passes) / (-4 * lower - 4))
+    return [lower if i < count else lower + 2 for i in range(passes)]
+
+
+def _taps(padded, kernel, length):
+    """Weighted sum of shifted row windows of ``padded``; the kernel is symmetric, so taps are paired."""
+    half = len(kernel) // 2
+    out = kernel[half] * padded[:, half:half + length]
+    for tap in range(half):
+        out += kernel[tap] * (padded[:, tap:tap + length] + padded[:, 2 * half - tap:2 * half - tap + length])
+    return out
+
+
+def _box(padded, size, length):
+    """Running mean of width ``size`` along the rows of ``padded`` (padded by size // 2 + 1 before, size // 2 after)."""
+    sums = np.cumsum(padded, axis=1, dtype=np.float32)
+    return (sums[:, size:size + length] - sums[:, :length]) / size
+
+
+def _blur_rows(pixels, radius):
+    """Blur each row of an (H, W, C) array, block by block so the work stays in cache."""
+    height, width = pixels.shape[:2]
+    out = np.empty(pixels.shape, dtype=np.float32)
+    sizes = box_sizes(radius) if radius >= BOX_BLUR_MIN_RADIUS else None
+    kernel = None if sizes else gaussian_kernel(radius)
+    for top in range(0, height, BLOCK_ROWS):
+        block = pixels[top:top + BLOCK_ROWS].astype(np.float32)
+        if sizes:
+            for size in sizes:
+                block = _box(np.pad(block, ((0, 0), (size // 2 + 1, size // 2), (0, 0)), mode='edge'), size, width)
+        else:
+            half = len(kernel) // 2
+            block = _taps(np.pad(block, ((0, 0), (half, half), (0, 0)), mode='edge'), kernel, width)
+        out[top:top + BLOCK_ROWS] = block
+    return out
+
+
+def _gaussian_blur(pixels, radius):
+    """
+    Separable Gaussian blur of an (H, W, C) array, returned as float32.
+
+    Small radii use the exact kernel. From BOX_BLUR_MIN_RADIUS up, three box
+    passes approximate it at a cost that no longer grows with the radius (as
+    ImageFilter.GaussianBlur does). Columns are blurred as the rows of the
+    transposed array, so both passes read contiguous memory.
+    """
+    rows = _blur_rows(pixels, radius)
+    columns = _blur_rows(np.ascontiguousarray(rows.transpose(1, 0, 2)), radius)
+    return columns.transpose(1, 0, 2)
+
+
+def _to_image(pixels, bands):
+    """Round a float32 (H, W, C) array back to an 8-bit image."""
+    pixels += 0.5
+    np.clip(pixels, 0, 255, out=pixels)
+    result = pixels.astype(np.uint8)
+    return PilImage.fromarray(result[:, :, 0] if bands == 1 else np.ascontiguousarray(result))
+
+
+def _as_array(img):
+    pixels = np.asarray(img)
+    return pixels[:, :, None] if pixels.ndim == 2 else pixels
+
+
+def blur(img, params):
+    """Separable Gaussian blur over every band, alpha included (like ImageFilter.GaussianBlur)."""
+    pixels = _as_array(img)
+    return _to_image(_gaussian_blur(pixels, params['radius']), pixels.shape[2])
+
+
+def sharpen(img, params):
+    """Unsharp mask: add back ``amount`` times the detail removed by a blur of ``radius``."""
+    rgb, alpha = (img, None) if img.mode == 'L' else _split_alpha(img)
+    pixels = _as_array(rgb)
+    blurred = _gaussian_blur(pixels, params['radius'])
+    # pixels + amount * (pixels - blurred), reusing the blurred buffer
+    blurred -= pixels
+    blurred *= -params['amount']
+    blurred += pixels
+    return _join_alpha(_to_image(blurred, pixels.shape[2]), alpha)
+
+
+# Neighbourhood filters (they depend on the scale, so they keep their place in the pipeline)
+KERNEL_FILTERS = {
+    'blur': blur,
+    'sharpen': sharpen,
+}
+
+# Parameters of each filter: name -> (default, minimum, maximum)
+FILTER_PARAMS = {
+    'brightness': {'amount': (1.0, 0.0, 10.0)},
+    'contrast': {'amount': (1.0, 0.0, 10.0)},
+    'saturation': {'amount': (1.0, 0.0, 10.0)},
+    'blur': {'radius': (2.0, 0.1, 50.0)},
+    'sharpen': {'amount': (1.0, 0.0, 10.0), 'radius': (1.0, 0.1, 10.0)},
+}
@@ -0,0 +1,47 @@
+# transformations/management/commands/batch_transform.py
+
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from transformations.engine import normalize_pipeline, TransformError
+from transformations.models import BatchJob
+from transformations.serializers import BatchJobSerializer
+
+
+class Command(BaseCommand):
+    help = 'Applies a transformation pipeline to many images as a Celery batch job.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pipeline', help='Pipeline as JSON, e.g. \'[{"op": "resize", "width": 400}]\'.')
+        parser.add_argument('--filter', action='append', default=[], metavar='LOOKUP=VALUE',
+                            help='Image filter, repeatable (e.g. original_format=jpeg, width__gte=1000).')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Number of images per Celery task.')
+        parser.add_argument('--wait', action='store_true', help='Report progress until the job finishes.')
+
+    def handle(self, *args, **options):
+        try:
+            spec = normalize_pipeline(json.loads(options['pipeline']))
+        except (json.JSONDecodeError, TransformError) as e:
+            raise CommandError(f'Invalid pipeline: {e}')
+
+        filters = {}
+        for item in options['filter']:
+            lookup, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f'Invalid filter "{item}", expected LOOKUP=VALUE.')
+            filters[lookup] = value.split(',') if lookup.endswith('__in') else value
+
+        # Same validation as the API; jobs started here are not scoped to an owner
+        serializer = BatchJobSerializer(data={'spec': spec, 'filters': filters, 'chunk_size': options['chunk_size']})
+        if not serializer.is_valid():
+            raise CommandError(serializer.errors)
+        job = serializer.save()
+        self.stdout.write(self.style.SUCCESS(f'Started batch job {job.job_id} over {job.total} images.'))
+
+        while options['wait'] and job.status in (BatchJob.Status.PENDING, BatchJob.Status.RUNNING):
+            time.sleep(2)
+            job.refresh_from_db()
+            self.stdout.write(f'{job.processed}/{job.total} processed, {job.failed} failed.')
+
+        if options['wait']:
+            self.stdout.write(self.style.SUCCESS(f'Batch job {job.job_id} {job.get_status_display().lower()}: {job.succeeded} succeeded, {job.failed} failed.'))
@@ -0,0 +1,72 @@
+# transformations/management/commands/benchmark_decode.py
+
+import io
+import time
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image as PilImage, ImageChops, ImageStat
+from transformations.engine import Pipeline
+
+
+def synthetic_jpeg(width, height):
+    """Build a noisy, gradient-filled JPEG so the decoder has real work to do."""
+    noise = PilImage.effect_noise((width, height), 48)
+    gradient = PilImage.linear_gradient('L').resize((width, height))
+    img = PilImage.merge('RGB', (noise, gradient, ImageChops.invert(gradient)))
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def full_decode(data, width):
+    """Baseline: decode every pixel, then resample once."""
+    with PilImage.open(io.BytesIO(data)) as img:
+        img.load()
+        height = max(1, round(img.height * width / img.width))
+        return img.resize((width, height), PilImage.Resampling.LANCZOS)
+
+
+def reduced_decode(data, width):
+    """The engine's path: reduced-scale decode and box reduce before the resample."""
+    output, _ = Pipeline([{'op': 'resize', 'width': width}]).render(io.BytesIO(data))
+    return output
+
+
+def timed(func, iterations, *args):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        output = func(*args)
+    return (time.perf_counter() - start) / iterations, output
+
+
+class Command(BaseCommand):
+    help = 'Compares a full JPEG decode with the reduced-scale decode used by the transformation engine.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', help='JPEG file to use (default: a synthetic 6000x4000 image).')
+        parser.add_argument('--width', type=int, action='append', help='Output width, repeatable (default: 300, 800, 1600).')
+        parser.add_argument('--iterations', type=int, default=5, help='Runs per measurement.')
+
+    def handle(self, *args, **options):
+        if options['source']:
+            try:
+                with open(options['source'], 'rb') as file:
+                    data = file.read()
+            except OSError as e:
+                raise CommandError(f'Cannot read source: {e}')
+        else:
+            data = synthetic_jpeg(6000, 4000)
+
+        with PilImage.open(io.BytesIO(data)) as img:
+            if img.format != 'JPEG':
+                raise CommandError('Reduced-scale decoding only applies to JPEG sources.')
+            self.stdout.write(f'Source: {img.width}x{img.height} JPEG, {len(data) / 1024:.0f} KB')
+
+        for width in options['width'] or [300, 800, 1600]:
+            full_time, full_output = timed(full_decode, options['iterations'], data, width)
+            reduced_time, reduced_output = timed(reduced_decode, options['iterations'], data, width)
+            # Mean absolute difference per channel (0-255) between the two outputs
+            difference = ImageStat.Stat(ImageChops.difference(full_output.convert('RGB'), reduced_output.convert('RGB'))).mean
+            self.stdout.write(
+                f'{width}px: full {full_time * 1000:.1f} ms, reduced {reduced_time * 1000:.1f} ms '
+                f'({full_time / reduced_time:.1f}x), mean difference {sum(difference) / len(difference):.2f}'
+            )
@@ -0,0 +1,84 @@
+# transformations/management/commands/benchmark_filters.py
+
+import time
+from django.core.management.base import BaseCommand
+from PIL import Image as PilImage, ImageChops, ImageEnhance, ImageFilter, ImageOps, ImageStat
+from transformations.filters import apply_color, fuse, blur, sharpen
+
+# Filter name -> (NumPy path, equivalent PIL path)
+CASES = {
+    'grayscale': (
+        lambda img: apply_color(img, fuse([('grayscale', {})])),
+        ImageOps.grayscale,
+    ),
+    'sepia': (
+        lambda img: apply_color(img, fuse([('sepia', {})])),
+        lambda img: img.convert('RGB', (0.393, 0.769, 0.189, 0, 0.349, 0.686, 0.168, 0, 0.272, 0.534, 0.131, 0)),
+    ),
+    'invert': (
+        lambda img: apply_color(img, fuse([('invert', {})])),
+        ImageOps.invert,
+    ),
+    'brightness': (
+        lambda img: apply_color(img, fuse([('brightness', {'amount': 1.3})])),
+        lambda img: ImageEnhance.Brightness(img).enhance(1.3),
+    ),
+    'contrast': (
+        lambda img: apply_color(img, fuse([('contrast', {'amount': 1.3})])),
+        lambda img: ImageEnhance.Contrast(img).enhance(1.3),
+    ),
+    'saturation': (
+        lambda img: apply_color(img, fuse([('saturation', {'amount': 0.5})])),
+        lambda img: ImageEnhance.Color(img).enhance(0.5),
+    ),
+    'brightness+contrast+saturation': (
+        lambda img: apply_color(img, fuse([('brightness', {'amount': 1.1}), ('contrast', {'amount': 1.2}), ('saturation', {'amount': 0.8})])),
+        lambda img: ImageEnhance.Color(ImageEnhance.Contrast(ImageEnhance.Brightness(img).enhance(1.1)).enhance(1.2)).enhance(0.8),
+    ),
+    'blur': (
+        lambda img: blur(img, {'radius': 3.0}),
+        lambda img: img.filter(ImageFilter.GaussianBlur(3)),
+    ),
+    'sharpen': (
+        lambda img: sharpen(img, {'amount': 1.5, 'radius': 2.0}),
+        lambda img: img.filter(ImageFilter.UnsharpMask(2, 150, 0)),
+    ),
+}
+
+
+def synthetic_image(width, height):
+    noise = PilImage.effect_noise((width, height), 48)
+    gradient = PilImage.linear_gradient('L').resize((width, height))
+    return PilImage.merge('RGB', (noise, gradient, ImageChops.invert(gradient)))
+
+
+def timed(func, img, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        output = func(img)
+    return (time.perf_counter() - start) / iterations, output
+
+
+class Command(BaseCommand):
+    help = 'Compares the NumPy filter kernels with the equivalent PIL ImageFilter/ImageEnhance calls.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', help='Image file to use (default: a synthetic 2000x1500 image).')
+        parser.add_argument('--filter', action='append', choices=list(CASES), help='Filter to run, repeatable (default: all).')
+        parser.add_argument('--iterations', type=int, default=5, help='Runs per measurement.')
+
+    def handle(self, *args, **options):
+        img = PilImage.open(options['source']).convert('RGB') if options['source'] else synthetic_image(2000, 1500)
+        img.load()
+        self.stdout.write(f'Source: {img.width}x{img.height}')
+
+        for name in options['filter'] or CASES:
+            numpy_path, pil_path = CASES[name]
+            numpy_time, numpy_output = timed(numpy_path, img, options['iterations'])
+            pil_time, pil_output = timed(pil_path, img, options['iterations'])
+            # Mean absolute difference per channel (0-255) between the two outputs
+            difference = ImageStat.Stat(ImageChops.difference(numpy_output.convert('RGB'), pil_output.convert('RGB'))).mean
+            self.stdout.write(
+                f'{name}: numpy {numpy_time * 1000:.1f} ms, PIL {pil_time * 1000:.1f} ms '
+                f'({pil_time / numpy_time:.2f}x), mean difference {sum(difference) / len(difference):.2f}'
+            )
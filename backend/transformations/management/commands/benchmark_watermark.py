@@ -0,0 +1,75 @@
+# transformations/management/commands/benchmark_watermark.py
+
+import os
+import tempfile
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image as PilImage, ImageDraw
+from transformations.management.commands.benchmark_filters import synthetic_image
+from transformations.watermark import apply_watermark, overlay_cache_info
+
+# Output sizes measured by default
+SIZES = ((640, 480), (1920, 1080), (4000, 3000))
+
+PARAMS = {'position': 'bottom-right', 'scale': 0.25, 'opacity': 0.5, 'margin': 16}
+
+
+def synthetic_watermark(path):
+    img = PilImage.new('RGBA', (600, 180), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.rounded_rectangle((0, 0, 599, 179), radius=30, fill=(255, 255, 255, 160))
+    draw.ellipse((30, 30, 150, 150), fill=(220, 40, 40, 255))
+    img.save(path)
+
+
+def naive_watermark(img, path, params):
+    """Per-image preparation and a full-frame composite, for comparison."""
+    with PilImage.open(path) as asset:
+        asset = asset.convert('RGBA')
+    width = max(1, round(img.width * params['scale']))
+    layer = asset.resize((width, max(1, round(asset.height * width / asset.width))), PilImage.Resampling.LANCZOS)
+    layer.putalpha(layer.getchannel('A').point(lambda value: round(value * params['opacity'])))
+    frame = PilImage.new('RGBA', img.size)
+    margin = params['margin']
+    frame.paste(layer, (img.width - layer.width - margin, img.height - layer.height - margin))
+    return PilImage.alpha_composite(img.convert('RGBA'), frame).convert('RGB')
+
+
+def timed(func, img, path, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(img.copy(), path, PARAMS)
+    return (time.perf_counter() - start) / iterations
+
+
+class Command(BaseCommand):
+    help = 'Measures watermarking with the cached overlay against per-image preparation and a full-frame composite.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--asset', help='Watermark image (default: WATERMARK_PATH, or a synthetic one).')
+        parser.add_argument('--iterations', type=int, default=10, help='Runs per measurement.')
+
+    def handle(self, *args, **options):
+        path = options['asset'] or settings.WATERMARK_PATH
+        temporary = None
+        if not path:
+            temporary = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
+            temporary.close()
+            path = temporary.name
+            synthetic_watermark(path)
+
+        try:
+            for size in SIZES:
+                img = synthetic_image(*size)
+                apply_watermark(img.copy(), path, PARAMS)  # Prepare the overlay once, as a warm worker would have
+                cached = timed(apply_watermark, img, path, options['iterations'])
+                naive = timed(naive_watermark, img, path, options['iterations'])
+                self.stdout.write(
+                    f'{size[0]}x{size[1]}: cached overlay {cached * 1000:.2f} ms ({1 / cached:.0f} images/s), '
+                    f'naive {naive * 1000:.2f} ms ({1 / naive:.0f} images/s), {naive / cached:.1f}x'
+                )
+            self.stdout.write(f'Overlay cache: {overlay_cache_info()}')
+        finally:
+            if temporary is not None:
+                os.remove(path)
@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-18 05:33
+
+import django.db.models.deletion
+import image_management.storage
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('image_management', '0006_image_original_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Derivative',
+            fields=[
+                ('derivative_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('spec', models.JSONField()),
+                ('spec_hash', models.CharField(db_index=True, max_length=64)),
+                ('file', models.FileField(max_length=255, storage=image_management.storage.get_image_storage, upload_to='derivatives/')),
+                ('format', models.CharField(max_length=10)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('size_bytes', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='derivatives', to='image_management.image')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('image', 'spec_hash'), name='unique_derivative_per_spec')],
+            },
+        ),
+    ]
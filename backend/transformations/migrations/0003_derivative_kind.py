@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 05:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformations', '0002_batchjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='derivative',
+            name='kind',
+            field=models.CharField(choices=[('transform', 'Transform'), ('variant', 'Responsive variant')], default='transform', max_length=10),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-18 05:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformations', '0003_derivative_kind'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransformLock',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=32)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-18 05:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_management', '0006_image_original_storage'),
+        ('transformations', '0004_transformlock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressionProfile',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('format', models.CharField(max_length=10)),
+                ('target', models.FloatField()),
+                ('quality', models.PositiveSmallIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compression_profiles', to='image_management.image')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('image', 'format', 'target'), name='unique_compression_profile')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-18 06:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformations', '0005_compressionprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchJobChunk',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('index', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='transformations.batchjob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job', 'index'), name='unique_batch_job_chunk')],
+            },
+        ),
+    ]
@@ -1,3 +1,100 @@
 from django.db import models
+from django.conf import settings
+from image_management.models import Image
+from image_management.storage import get_image_storage
+import uuid
 
-# Create your models here.
+# Model to represent a stored result of a transformation pipeline applied to an image
+class Derivative(models.Model):
+    class Kind(models.TextChoices):
+        TRANSFORM = 'transform', 'Transform'
+        VARIANT = 'variant', 'Responsive variant'
+
+    derivative_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='derivatives')
+    spec = models.JSONField()
+    spec_hash = models.CharField(max_length=64, db_index=True)
+    kind = models.CharField(max_length=10, choices=Kind.choices, default=Kind.TRANSFORM)
+    file = models.FileField(upload_to='derivatives/', storage=get_image_storage, max_length=255)
+    format = models.CharField(max_length=10)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    size_bytes = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'spec_hash'], name='unique_derivative_per_spec'),
+        ]
+
+
+# Model to track a pipeline applied to many images by Celery workers
+class BatchJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        COMPLETE = 'complete', 'Complete'
+        PARTIAL = 'partial', 'Completed with failures'
+        FAILED = 'failed', 'Failed'
+
+    job_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    spec = models.JSONField()
+    filters = models.JSONField(default=dict, blank=True)
+    chunk_size = models.PositiveIntegerField(default=100)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    succeeded = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    @property
+    def progress(self):
+        """Share of the images processed so far, between 0 and 1."""
+        return self.processed / self.total if self.total else 1.0
+
+
+# Model to record that a chunk of a batch job was counted, so a redelivered chunk is not counted twice
+class BatchJobChunk(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    job = models.ForeignKey(BatchJob, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'index'], name='unique_batch_job_chunk'),
+        ]
+
+
+# Model to record an image a batch job could not transform
+class BatchJobFailure(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    job = models.ForeignKey(BatchJob, on_delete=models.CASCADE, related_name='failures')
+    image_id = models.UUIDField()  # Not a foreign key: the image may be gone by the time the failure is read
+    error = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+# Model used as a cross-process lock while one worker renders a derivative (see singleflight.py)
+class TransformLock(models.Model):
+    key = models.CharField(max_length=64, primary_key=True)
+    token = models.CharField(max_length=32)
+    expires_at = models.DateTimeField()
+
+
+# Model to remember the encoder quality found for an image's SSIM target in a format (see quality.py)
+class CompressionProfile(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='compression_profiles')
+    format = models.CharField(max_length=10)
+    target = models.FloatField()
+    quality = models.PositiveSmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'format', 'target'], name='unique_compression_profile'),
+        ]
@@ -0,0 +1,64 @@
+"""
+Output format negotiation from the Accept header.
+
+Modern formats are only picked when the client names them explicitly (as
+browsers that decode them do, e.g. "image/avif,image/webp,*/*"): a bare */* or
+image/* says nothing about what the client can decode. The source format is
+always a candidate, since it is what the client gets without negotiation.
+The response uses the first candidate (AVIF, then WebP, then the source
+format): modern formats are smaller for almost every image, so only that one
+format is rendered, rather than every candidate to keep the smallest.
+Animated sources are only offered in formats that keep the animation (other
+formats would get the first frame only, which is smaller and would always win).
+"""
+from .animation import ANIMATED_FORMATS
+from .engine import OUTPUT_FORMATS, CONTENT_TYPES
+
+# Formats worth offering in place of the source format, by preference
+MODERN_FORMATS = tuple(name for name in ('avif', 'webp') if name in OUTPUT_FORMATS)
+
+# Source formats that can hold an animation: sources in these formats not known
+# to be still (e.g. stored before it was recorded) are treated as animated
+ANIMATABLE_FORMATS = ('gif', 'webp', 'png')
+
+
+def parse_accept(header):
+    """Return {media type: q} for an Accept header."""
+    accepted = {}
+    for item in (header or '').split(','):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[media_type.lower()] = q
+    return accepted
+
+
+def candidate_formats(header, source_format, animated=None):
+    """
+    Formats the response may use, the source format last.
+
+    Args:
+        header: The request's Accept header (may be empty).
+        source_format: The format served without negotiation.
+        animated: Whether the source is animated, None if not known.
+    """
+    accepted = parse_accept(header)
+    candidates = [name for name in MODERN_FORMATS if accepted.get(CONTENT_TYPES[name], 0) > 0 and name != source_format]
+    if animated is None:
+        animated = source_format in ANIMATABLE_FORMATS
+    if animated:
+        candidates = [name for name in candidates if name in ANIMATED_FORMATS]
+    return candidates + [source_format]
+
+
+def preferred_format(header, source_format, animated=None):
+    """The format the response uses: the first of candidate_formats."""
+    return candidate_formats(header, source_format, animated)[0]
@@ -0,0 +1,225 @@
+"""
+Bounded process pool for transforms rendered inside a web request.
+
+A sync worker rendering inline holds the GIL and is blocked for the whole
+render. With TRANSFORM_POOL['ENABLED'], request-path renders run in a pool of
+worker processes instead:
+    - the source bytes go to the worker through a shared memory block, so only
+      its name crosses the process boundary (the encoded output, much smaller,
+      comes back pickled); the source is copied into the block piece by piece
+      and the worker decodes straight from it, so neither side holds another
+      full copy of the file
+    - at most WORKERS renders run and QUEUE_DEPTH more wait; past that submit
+      raises PoolSaturated right away, which the API turns into a 429 with
+      Retry-After instead of letting latency pile up
+"""
+import io
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from django.conf import settings
+from .engine import Pipeline
+
+# Size of the reads used to copy a source into shared memory
+COPY_CHUNK_SIZE = 256 * 1024
+
+# Defaults used for any TRANSFORM_POOL key missing from the settings
+DEFAULTS = {
+    'ENABLED': False,
+    'WORKERS': 2,
+    'QUEUE_DEPTH': 4,
+    'RETRY_AFTER': 1,  # Seconds suggested to rejected clients
+}
+
+
+class PoolSaturated(Exception):
+    """Every worker is busy and the queue is full."""
+    def __init__(self, retry_after):
+        super().__init__("The transform pool is saturated.")
+        self.retry_after = retry_after
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only, seekable file over a memoryview, reading from it without copying it first (unlike io.BytesIO)."""
+    def __init__(self, view):
+        self._view = view
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        with self._view[self._position:self._position + len(buffer)] as data:
+            size = len(data)
+            buffer[:size] = data
+        self._position += size
+        return size
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else self._position + size
+        with self._view[self._position:end] as data:
+            self._position += len(data)
+            return data.tobytes()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        start = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        if start + offset < 0:
+            raise ValueError("Negative seek position.")
+        self._position = start + offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+def _copy_into(source, buffer):
+    """Fill ``buffer`` from ``source`` in COPY_CHUNK_SIZE reads, into the buffer itself when the source supports readinto."""
+    readinto = getattr(source, 'readinto', None)
+    offset = 0
+    while offset < len(buffer):
+        with buffer[offset:offset + COPY_CHUNK_SIZE] as view:
+            if readinto is not None:
+                count = readinto(view)
+            else:
+                data = source.read(len(view))
+                count = len(data)
+                view[:count] = data
+        if not count:
+            raise OSError("The source ended before its reported size.")
+        offset += count
+
+
+def _remaining_size(source):
+    """Number of bytes left to read from a seekable ``source``."""
+    position = source.tell()
+    source.seek(0, io.SEEK_END)
+    size = source.tell() - position
+    source.seek(position)
+    return size
+
+
+def _run(name, size, operations, options, quality):
+    """Worker side: run a pipeline on ``size`` source bytes in the shared memory block ``name``."""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        # Decoded in place: the views are released before the block is closed
+        with block.buf[:size] as view, BufferReader(view) as source:
+            return Pipeline(operations, **options).run(source, quality)
+    finally:
+        block.close()
+
+
+class TransformPool:
+    """Process pool with bounded admission and saturation counters."""
+    def __init__(self, config=None):
+        config = {**DEFAULTS, **(config or {})}
+        self.enabled = config['ENABLED']
+        self.workers = config['WORKERS']
+        self.queue_depth = config['QUEUE_DEPTH']
+        self.retry_after = config['RETRY_AFTER']
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_depth)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'pending': 0, 'pending_max': 0, 'latency_total': 0.0}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _reset_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def run(self, source, pipeline, quality=None):
+        """
+        Render ``pipeline`` on the bytes read from ``source`` in a worker process
+        (``quality`` as for Pipeline.run).
+
+        Raises:
+            PoolSaturated: If the pool has no free slot.
+            TransformError: If the pipeline does not apply to the image.
+        """
+        if not self._slots.acquire(blocking=False):
+            self._count(rejected=1)
+            raise PoolSaturated(self.retry_after)
+
+        block = None
+        try:
+            size = _remaining_size(source)
+            block = shared_memory.SharedMemory(create=True, size=max(1, size))
+            with block.buf[:size] as view:
+                _copy_into(source, view)
+            executor = self._get_executor()
+            start = time.perf_counter()
+            future = executor.submit(
+                _run, block.name, size, pipeline.operations, pipeline.options, quality,
+            )
+        except BaseException:
+            self._free(block)
+            raise
+        self._count(submitted=1, pending=1)
+        # The slot and the block are freed when the worker is done, even if the caller gave up
+        future.add_done_callback(lambda _: self._done(block))
+
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory): start a fresh pool for the next render
+            self._reset_executor(executor)
+            self._count(failed=1)
+            raise
+        except Exception:
+            self._count(failed=1)
+            raise
+        self._count(completed=1, latency_total=time.perf_counter() - start)
+        return result
+
+    def _free(self, block):
+        if block is not None:
+            block.close()
+            block.unlink()
+        self._slots.release()
+
+    def _done(self, block):
+        self._count(pending=-1)
+        self._free(block)
+
+    def _count(self, **changes):
+        with self._lock:
+            for name, change in changes.items():
+                self._stats[name] += change
+            self._stats['pending_max'] = max(self._stats['pending_max'], self._stats['pending'])
+
+    def stats(self):
+        """Return a snapshot of the counters, with the pool's capacity and current saturation."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['latency_mean'] = stats.pop('latency_total') / stats['completed'] if stats['completed'] else 0.0
+        stats['workers'] = self.workers
+        stats['capacity'] = self.workers + self.queue_depth
+        stats['saturation'] = stats['pending'] / stats['capacity']
+        stats['enabled'] = self.enabled
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide TransformPool, created on first use from settings.TRANSFORM_POOL."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = TransformPool(getattr(settings, 'TRANSFORM_POOL', None))
+    return _pool
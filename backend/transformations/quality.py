@@ -0,0 +1,102 @@
+"""
+Target-quality compression.
+
+A "compress" operation with a ``target`` instead of a ``quality`` asks for the
+lowest encoder quality whose output still scores at least ``target`` in SSIM
+(structural similarity, 1.0 meaning identical) against the unencoded image:
+    - the score is measured on a proxy, tiles of the image sampled at full
+      resolution into a PROXY_SIZE square, so each probe encodes a small image
+    - the quality is found by binary search between MIN_QUALITY and MAX_QUALITY
+      (at most 7 probes)
+SSIM is computed on luma over WINDOW x WINDOW windows (integral images, so the
+cost does not depend on the window).
+
+Targets around 0.95-0.99 are the useful range.
+"""
+import io
+import numpy as np
+from PIL import Image as PilImage
+
+# Side of the proxy image the search encodes, made of PROXY_TILES x PROXY_TILES tiles
+PROXY_SIZE = 512
+PROXY_TILES = 4
+
+# Tiles start on multiples of the largest block size of the lossy encoders (JPEG 4:2:0 MCU, WebP macroblock)
+BLOCK_SIZE = 16
+
+# Encoder qualities the search chooses from
+MIN_QUALITY = 20
+MAX_QUALITY = 95
+
+# SSIM window side and stabilizing constants (for 8-bit samples)
+WINDOW = 7
+C1 = (0.01 * 255) ** 2
+C2 = (0.03 * 255) ** 2
+
+
+def _window_mean(values, size):
+    """Mean of every ``size`` x ``size`` window of a 2D array (valid windows only)."""
+    sums = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(values, axis=0), axis=1, out=sums[1:, 1:])
+    return (sums[size:, size:] - sums[:-size, size:] - sums[size:, :-size] + sums[:-size, :-size]) / (size * size)
+
+
+def ssim(reference, distorted):
+    """Mean SSIM of two same-sized 2D luma arrays."""
+    size = min(WINDOW, *reference.shape)
+    a = reference.astype(np.float64)
+    b = distorted.astype(np.float64)
+    mean_a, mean_b = _window_mean(a, size), _window_mean(b, size)
+    var_a = _window_mean(a * a, size) - mean_a * mean_a
+    var_b = _window_mean(b * b, size) - mean_b * mean_b
+    covariance = _window_mean(a * b, size) - mean_a * mean_b
+    scores = ((2 * mean_a * mean_b + C1) * (2 * covariance + C2)) / (
+        (mean_a * mean_a + mean_b * mean_b + C1) * (var_a + var_b + C2)
+    )
+    return float(scores.mean())
+
+
+def proxy(img):
+    """
+    A sample of the image at full resolution, in RGB or L: the image itself when
+    it fits in PROXY_SIZE x PROXY_SIZE, else a mosaic of PROXY_TILES x PROXY_TILES
+    tiles taken evenly across it.
+
+    Tiles keep their pixels as is (a downscaled proxy would smooth away the
+    detail that compression artifacts show up in) and start on multiples of
+    BLOCK_SIZE, so the encoder's blocks fall on the same content as in the output.
+    """
+    img = img.convert('L' if img.mode in ('L', 'LA') else 'RGB')
+    if img.width <= PROXY_SIZE and img.height <= PROXY_SIZE:
+        return img
+    tile = PROXY_SIZE // PROXY_TILES
+    tile_width, tile_height = min(tile, img.width), min(tile, img.height)
+    mosaic = PilImage.new(img.mode, (tile_width * PROXY_TILES, tile_height * PROXY_TILES))
+    for row in range(PROXY_TILES):
+        top = (img.height - tile_height) * row // (PROXY_TILES - 1) // BLOCK_SIZE * BLOCK_SIZE
+        for column in range(PROXY_TILES):
+            left = (img.width - tile_width) * column // (PROXY_TILES - 1) // BLOCK_SIZE * BLOCK_SIZE
+            mosaic.paste(img.crop((left, top, left + tile_width, top + tile_height)), (column * tile_width, row * tile_height))
+    return mosaic
+
+
+def search_quality(img, image_format, target, encode):
+    """
+    Return the lowest quality in [MIN_QUALITY, MAX_QUALITY] whose encoding of
+    ``img`` scores at least ``target``, or MAX_QUALITY if none does.
+
+    Args:
+        encode: The engine's encoder, called as encode(image, format, quality).
+    """
+    small = proxy(img)
+    reference = np.asarray(small.convert('L'))
+    low, high = MIN_QUALITY, MAX_QUALITY
+    while low < high:
+        quality = (low + high) // 2
+        with PilImage.open(io.BytesIO(encode(small, image_format, quality))) as decoded:
+            score = ssim(reference, np.asarray(decoded.convert('L')))
+        if score >= target:
+            high = quality
+        else:
+            low = quality + 1
+    return low
@@ -0,0 +1,115 @@
+from rest_framework import serializers
+from django.urls import reverse
+from django.core.exceptions import ValidationError as DjangoValidationError
+from .engine import normalize_pipeline, TransformError
+from .models import Derivative, BatchJob, BatchJobFailure
+from .services import BATCH_FILTER_FIELDS, batch_queryset, start_batch_job
+
+# Largest number of images handled by one Celery task of a batch job
+MAX_CHUNK_SIZE = 1000
+
+def delivery_url(derivative, request=None):
+    """URL of the cacheable delivery endpoint of a derivative (absolute when ``request`` is given)."""
+    url = reverse('derivative-delivery', args=[derivative.pk])
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+# Transformation request serializer
+class TransformRequestSerializer(serializers.Serializer):
+    transformations = serializers.ListField(
+        child=serializers.DictField(),
+        help_text='Ordered list of operations, e.g. [{"op": "resize", "width": 320}, {"op": "format", "format": "webp"}].'
+    )
+    store = serializers.BooleanField(default=False, help_text="Store the result as a derivative instead of returning it.")
+
+    def validate_transformations(self, value):
+        try:
+            return normalize_pipeline(value)
+        except TransformError as e:
+            raise serializers.ValidationError(str(e))
+
+
+# Derivative serializer
+class DerivativeSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+    delivery_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Derivative
+        fields = ('derivative_id', 'image', 'spec', 'url', 'delivery_url', 'format', 'width', 'height', 'size_bytes', 'created_at')
+
+    def get_url(self, obj):
+        return obj.file.url if obj.file else None
+
+    def get_delivery_url(self, obj):
+        return delivery_url(obj, self.context.get('request'))
+
+
+# Responsive variant serializer (listed on images)
+class VariantSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+    delivery_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Derivative
+        fields = ('width', 'height', 'format', 'size_bytes', 'url', 'delivery_url')
+
+    def get_url(self, obj):
+        return obj.file.url if obj.file else None
+
+    def get_delivery_url(self, obj):
+        return delivery_url(obj, self.context.get('request'))
+
+
+# Batch job serializer
+class BatchJobSerializer(serializers.ModelSerializer):
+    spec = serializers.ListField(
+        child=serializers.DictField(),
+        help_text='Ordered list of operations applied to every matching image.'
+    )
+    filters = serializers.DictField(
+        required=False,
+        help_text=f"Image filters, any of: {', '.join(BATCH_FILTER_FIELDS)}."
+    )
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = BatchJob
+        fields = ['job_id', 'spec', 'filters', 'chunk_size', 'status', 'total', 'processed', 'succeeded', 'failed', 'progress', 'created_at', 'finished_at']
+        read_only_fields = ['job_id', 'status', 'total', 'processed', 'succeeded', 'failed', 'created_at', 'finished_at']
+
+    def validate_spec(self, value):
+        try:
+            return normalize_pipeline(value)
+        except TransformError as e:
+            raise serializers.ValidationError(str(e))
+
+    def validate_filters(self, value):
+        unknown = set(value) - set(BATCH_FILTER_FIELDS)
+        if unknown:
+            raise serializers.ValidationError(f"Unsupported filters: {', '.join(sorted(unknown))}.")
+        try:
+            batch_queryset(value).query  # Builds the lookups, which checks the values
+        except (DjangoValidationError, ValueError, TypeError) as e:
+            raise serializers.ValidationError(f"Invalid filter value: {e}")
+        return value
+
+    def validate_chunk_size(self, value):
+        if not 1 <= value <= MAX_CHUNK_SIZE:
+            raise serializers.ValidationError(f"Chunk size must be between 1 and {MAX_CHUNK_SIZE}.")
+        return value
+
+    def create(self, validated_data):
+        request = self.context.get('request')
+        user = getattr(request, 'user', None)
+        if user and user.is_authenticated:
+            validated_data['owner'] = user
+        job = BatchJob.objects.create(**validated_data)
+        return start_batch_job(job)
+
+
+# Batch job failure serializer
+class BatchJobFailureSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BatchJobFailure
+        fields = ['image_id', 'error', 'created_at']
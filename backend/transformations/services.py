@@ -0,0 +1,327 @@
+import hashlib
+from functools import lru_cache, partial
+from celery import chord
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from image_management.models import Image
+from .cache import get_cache, cache_key, original_version
+from .engine import Pipeline, TransformResult, DEFAULT_QUALITY, OUTPUT_FORMATS, canonical_spec, normalize_pipeline, build_variants
+from .models import Derivative, BatchJob, CompressionProfile
+from .negotiation import preferred_format
+from .animation import ANIMATED_FORMATS
+from .pool import get_pool
+from .singleflight import get_single_flight
+from .urlspec import parse_spec
+from .watermark import asset_version
+
+# Image lookups a batch job may filter on
+BATCH_FILTER_FIELDS = (
+    'image_id__in', 'owner', 'original_format', 'original_format__in',
+    'width__gte', 'width__lte', 'height__gte', 'height__lte',
+    'created_at__gte', 'created_at__lte',
+)
+
+# Compiled URL specs kept per process (see url_pipeline)
+URL_SPEC_CACHE_SIZE = 1024
+
+
+def spec_hash(operations):
+    """SHA-256 of a normalized pipeline, serialized canonically."""
+    return hashlib.sha256(canonical_spec(operations).encode()).hexdigest()
+
+
+def build_pipeline(operations):
+    """Validate ``operations`` into a Pipeline configured from the settings."""
+    return Pipeline(
+        operations,
+        max_pixels=settings.IMAGE_MAX_PIXELS,
+        tile_threshold=settings.TRANSFORM_TILE_THRESHOLD,
+        strip_rows=settings.TRANSFORM_STRIP_ROWS,
+        reuse_palette=settings.TRANSFORM_GIF_REUSE_PALETTE,
+        watermark_path=settings.WATERMARK_PATH,
+    )
+
+
+def url_pipeline(spec, image_format=None):
+    """
+    Pipeline for a compact URL spec (see urlspec.py), converting to ``image_format`` when given.
+
+    Cached, so hot URLs skip parsing and validation. Cached pipelines are shared
+    between requests and must not be modified. The watermark asset's version is
+    part of the cache key, so a replaced asset is picked up by cached specs too.
+
+    Raises:
+        TransformError: If the spec is invalid.
+    """
+    watermark_version = asset_version(settings.WATERMARK_PATH) if settings.WATERMARK_PATH else None
+    return _url_pipeline(spec, image_format, watermark_version)
+
+
+def url_spec_cache_info():
+    """Hits and misses of the compiled URL spec cache."""
+    return _url_pipeline.cache_info()
+
+
+@lru_cache(maxsize=URL_SPEC_CACHE_SIZE)
+def _url_pipeline(spec, image_format, watermark_version):
+    # watermark_version only keys the cache: build_pipeline records it in the operations
+    operations = parse_spec(spec)
+    if image_format:
+        operations.append({'op': 'format', 'format': image_format})
+    return build_pipeline(operations)
+
+
+def render(image, pipeline, offload=False):
+    """
+    Run a pipeline on an image's stored original.
+
+    The original is opened once (memory-mapped on local storage) and decoded once.
+    With ``offload`` and the transform pool enabled, the work runs in the pool.
+    For an SSIM target, the quality found for the image and format is reused, and
+    recorded the first time it is searched.
+
+    Raises:
+        TransformError: If the pipeline does not apply to this image.
+        PoolSaturated: If offloading and the pool has no free slot.
+    """
+    image_format = pipeline.output_format(image.original_format)
+    quality = None
+    if pipeline.target is not None and image_format in DEFAULT_QUALITY:
+        quality = CompressionProfile.objects.filter(
+            image=image, format=image_format, target=pipeline.target,
+        ).values_list('quality', flat=True).first()
+
+    pool = get_pool() if offload else None
+    with image.open_original() as source:
+        if pool is not None and pool.enabled:
+            result = pool.run(source, pipeline, quality)
+        else:
+            result = pipeline.run(source, quality)
+
+    if quality is None and pipeline.target is not None and result.format in DEFAULT_QUALITY:
+        CompressionProfile.objects.get_or_create(
+            image=image, format=result.format, target=pipeline.target, defaults={'quality': result.quality},
+        )
+    return result
+
+
+def variant_spec(width):
+    """Normalized pipeline a variant of ``width`` is equivalent to."""
+    return normalize_pipeline([{'op': 'resize', 'width': width}])
+
+
+def store_variants(image, widths):
+    """
+    Build and store the variants of ``image`` it does not have yet, from one decode.
+
+    Widths at or above the image's own width are skipped (no upscaling).
+
+    Returns:
+        The Derivative rows created.
+    """
+    existing = set(image.derivatives.filter(kind=Derivative.Kind.VARIANT).values_list('width', flat=True))
+    missing = [width for width in widths if width not in existing and (not image.width or width < image.width)]
+    if not missing:
+        return []
+    with image.open_original() as source:
+        return [
+            store_derivative(image, variant_spec(width), result, kind=Derivative.Kind.VARIANT)
+            for width, result in build_variants(source, missing)
+        ]
+
+
+def render_cached(image, pipeline, offload=False):
+    """Return the rendered pipeline from the derivative cache, rendering and caching it on a miss."""
+    cache = get_cache()
+    image_format = pipeline.output_format(image.original_format)
+    key = cache_key(image.pk, original_version(image), pipeline.operations, image_format)
+    result = cache.get(image.pk, key, image_format)
+    if result is not None:
+        return result
+
+    def compute():
+        result = render(image, pipeline, offload)
+        cache.put(image.pk, key, result)
+        return result
+
+    # Concurrent misses on the same key wait for a single render
+    return get_single_flight().do(key, compute, lambda: cache.peek(image.pk, key, image_format))
+
+
+def store_derivative(image, operations, result, kind=Derivative.Kind.TRANSFORM):
+    """
+    Store a rendered result as a Derivative, or return the one already stored for
+    the same spec (normalized ``operations``).
+    """
+    key = spec_hash(operations)
+    derivative = Derivative(
+        image=image,
+        spec=operations,
+        spec_hash=key,
+        kind=kind,
+        format=result.format,
+        width=result.width,
+        height=result.height,
+        size_bytes=len(result.data),
+    )
+    derivative.file.save(f'{image.pk}.{result.format}', ContentFile(result.data), save=False)
+    try:
+        with transaction.atomic():
+            derivative.save()
+    except IntegrityError:
+        # Already stored, e.g. concurrently by another request
+        derivative.file.delete(save=False)
+        existing = Derivative.objects.get(image=image, spec_hash=key)
+        if kind == Derivative.Kind.VARIANT and existing.kind != kind:
+            # A transform with the same spec can serve as the variant
+            existing.kind = kind
+            existing.save(update_fields=['kind'])
+        return existing
+    return derivative
+
+
+def transform(image, operations, store=False, offload=False, cache=True):
+    """
+    Apply ``operations`` to ``image``.
+
+    ``offload`` renders in the transform pool when it is enabled (for request
+    handlers; Celery workers render inline). ``cache=False`` renders without
+    going through the derivative cache, for one-off outputs (e.g. batch jobs)
+    that would only evict hot entries.
+
+    Returns:
+        (TransformResult, Derivative or None). When storing, an already stored
+        derivative for the same spec is returned without rendering again, and the
+        result is None.
+    """
+    pipeline = build_pipeline(operations)
+    if store:
+        existing = Derivative.objects.filter(image=image, spec_hash=spec_hash(pipeline.operations)).first()
+        if existing is not None:
+            return None, existing
+    result = render_cached(image, pipeline, offload) if cache else render(image, pipeline, offload)
+    if store:
+        return result, store_derivative(image, pipeline.operations, result)
+    return result, None
+
+
+def deliver(image, accept, operations=None, offload=False):
+    """
+    Render ``image``, or ``operations`` applied to it, in the preferred format the
+    client accepts.
+
+    Unless the pipeline sets a format, the format is negotiated from the Accept
+    header (see delivery_format) and only that one is rendered, through the
+    derivative cache. For the untransformed image in its source format, the
+    stored original is served as is.
+
+    Returns:
+        (TransformResult, whether the format was negotiated)
+    """
+    operations = list(operations or [])
+    if operations:
+        pipeline = build_pipeline(operations)
+        if pipeline.format:
+            return render_cached(image, pipeline, offload), False
+
+    def pipeline_for(image_format):
+        return build_pipeline(operations + [{'op': 'format', 'format': image_format}])
+
+    return _deliver_preferred(image, accept, pipeline_for, not operations, offload), True
+
+
+def deliver_spec(image, accept, spec, offload=False):
+    """
+    Like deliver, for a compact URL spec: pipelines come from url_pipeline.
+
+    Raises:
+        TransformError: If the spec is invalid.
+    """
+    pipeline = url_pipeline(spec)
+    if pipeline.format:
+        return render_cached(image, pipeline, offload), False
+    return _deliver_preferred(image, accept, partial(url_pipeline, spec), False, offload), True
+
+
+def delivery_format(image, accept, original=False):
+    """
+    Format ``image`` is delivered in for an Accept header: AVIF, else WebP, else
+    its source format (see negotiation.py). Needs no rendering.
+
+    Args:
+        original: Whether the stored original can stand for the source format.
+
+    Returns:
+        (format, whether the stored original is served as is)
+    """
+    source_format = (image.original_format or '').lower()
+    serve_original = original and source_format in OUTPUT_FORMATS
+    if source_format not in OUTPUT_FORMATS:
+        source_format = 'png'
+    if image.is_animated and not serve_original and source_format not in ANIMATED_FORMATS:
+        # e.g. APNG: rendered as PNG it would keep its first frame only
+        source_format = 'gif'
+    image_format = preferred_format(accept, source_format, image.is_animated)
+    return image_format, serve_original and image_format == source_format
+
+
+def read_original(image):
+    """The stored original, as a TransformResult."""
+    with image.open_original() as source:
+        return TransformResult(source.read(), image.original_format.lower(), (image.width, image.height))
+
+
+def _deliver_preferred(image, accept, pipeline_for, original, offload):
+    """
+    Render ``image`` in the format delivery_format picks.
+
+    Args:
+        pipeline_for: Returns the pipeline rendering a given format.
+        original: Whether the stored original can stand for the source format.
+    """
+    image_format, as_original = delivery_format(image, accept, original)
+    if as_original:
+        return read_original(image)
+    return render_cached(image, pipeline_for(image_format), offload)
+
+
+def batch_queryset(filters, owner=None):
+    """
+    Images a batch job applies to: ready images matching ``filters`` (keys from
+    BATCH_FILTER_FIELDS), restricted to ``owner``'s images when given.
+    """
+    queryset = Image.objects.filter(status=Image.Status.READY, **filters)
+    if owner is not None:
+        queryset = queryset.filter(owner=owner)
+    return queryset.order_by('pk')
+
+
+def start_batch_job(job):
+    """
+    Split the job's images into chunks and fan them out as a Celery chord.
+
+    Each chunk is transformed by whichever worker picks it up, so throughput grows
+    with the number of workers; the chord callback closes the job, and its error
+    callback closes it too if a chunk task fails. Jobs started by non-staff users
+    only cover their own images.
+    """
+    from .tasks import transform_chunk, finish_batch_job, abort_batch_job
+
+    owner = job.owner if job.owner is not None and not job.owner.is_staff else None
+    image_ids = [str(pk) for pk in batch_queryset(job.filters, owner).values_list('pk', flat=True)]
+    job.total = len(image_ids)
+    if not image_ids:
+        job.status = BatchJob.Status.COMPLETE
+        job.finished_at = timezone.now()
+        job.save(update_fields=['total', 'status', 'finished_at'])
+        return job
+
+    job.status = BatchJob.Status.RUNNING
+    job.save(update_fields=['total', 'status'])
+    chunks = [image_ids[i:i + job.chunk_size] for i in range(0, len(image_ids), job.chunk_size)]
+    header = [transform_chunk.s(str(job.pk), chunk, index) for index, chunk in enumerate(chunks)]
+    callback = finish_batch_job.si(str(job.pk)).on_error(abort_batch_job.si(str(job.pk)))
+    transaction.on_commit(lambda: chord(header)(callback))
+    return job
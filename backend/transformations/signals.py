@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from image_management.models import Image
+from .cache import get_cache
+from .models import Derivative
+from .tasks import build_image_variants
+
+
+@receiver(post_delete, sender=Image)
+def invalidate_cached_derivatives(sender, instance, **kwargs):
+    """Drop the cached renders of a deleted image."""
+    get_cache().invalidate(instance.pk)
+
+
+@receiver(pre_save, sender=Image)
+def detect_replaced_original(sender, instance, update_fields=None, **kwargs):
+    """Note on the instance whether this save replaces its stored original (read by drop_stale_derivatives)."""
+    instance._replaces_original = False
+    if instance._state.adding or (update_fields is not None and not {'original', 'content_hash'} & set(update_fields)):
+        return
+    previous = Image.objects.filter(pk=instance.pk).values('original', 'content_hash').first()
+    if previous is not None and previous['original']:
+        instance._replaces_original = (
+            previous['original'] != instance.original.name or previous['content_hash'] != instance.content_hash
+        )
+
+
+@receiver(post_save, sender=Image)
+def drop_stale_derivatives(sender, instance, created, **kwargs):
+    """
+    Once an image's original is replaced, delete its stored derivatives (and their
+    files) and drop its cached renders, which were made from the old original.
+    """
+    if not getattr(instance, '_replaces_original', False):
+        return
+    instance._replaces_original = False
+    Derivative.objects.filter(image=instance).delete()
+    image_id = instance.pk
+    get_cache().invalidate(image_id)
+    # Again after commit, for renders of the old original cached by requests in the meantime
+    transaction.on_commit(lambda: get_cache().invalidate(image_id))
+
+
+@receiver(post_save, sender=Image)
+def schedule_variants(sender, instance, created, update_fields=None, **kwargs):
+    """Build the responsive variants once an image is ready (when IMAGE_VARIANTS_ENABLED)."""
+    if not settings.IMAGE_VARIANTS_ENABLED or instance.status != Image.Status.READY:
+        return
+    if not created and update_fields is not None and 'status' not in update_fields and 'original' not in update_fields:
+        return
+    image_id = str(instance.pk)
+    transaction.on_commit(lambda: build_image_variants.delay(image_id))
+
+
+@receiver(post_delete, sender=Derivative)
+def delete_derivative_file(sender, instance, **kwargs):
+    """Remove a stored derivative's file along with its row."""
+    if instance.file:
+        instance.file.delete(save=False)
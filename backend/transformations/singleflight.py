@@ -0,0 +1,169 @@
+"""
+Single-flight coalescing of identical renders.
+
+The first request for a cache key renders it; concurrent requests for the same
+key wait for that result instead of rendering it again:
+    - within a process, followers wait on the leader's Event and share its result
+    - across processes, leaders first take a TransformLock row (an INSERT on the
+      key, which only one worker can win). Losers poll the derivative cache
+      until the winner's result lands there, the lock is released or expires,
+      or WAIT_TIMEOUT passes, and only then render it themselves.
+    - a leader that takes the lock looks in the cache once more before rendering:
+      the previous holder may have stored its result and released the lock
+      between the caller's cache miss and the INSERT
+"""
+import threading
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import TransformLock
+
+# Defaults used for any TRANSFORM_SINGLE_FLIGHT key missing from the settings
+DEFAULTS = {
+    'ENABLED': True,
+    'LOCK_TTL': 30,  # Seconds before a lock left by a crashed worker is ignored
+    'WAIT_TIMEOUT': 30,  # Seconds a follower waits before rendering itself
+    'POLL_INTERVAL': 0.05,
+}
+
+
+def acquire_lock(key, ttl):
+    """Take the cross-process lock on ``key``; return its token, or None when another worker holds it."""
+    now = timezone.now()
+    TransformLock.objects.filter(key=key, expires_at__lt=now).delete()
+    token = uuid.uuid4().hex
+    try:
+        with transaction.atomic():
+            TransformLock.objects.create(key=key, token=token, expires_at=now + timedelta(seconds=ttl))
+    except IntegrityError:
+        return None
+    return token
+
+
+def release_lock(key, token):
+    TransformLock.objects.filter(key=key, token=token).delete()
+
+
+def is_locked(key):
+    return TransformLock.objects.filter(key=key, expires_at__gte=timezone.now()).exists()
+
+
+# A render in progress in this process
+class Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent renders of the same key, with counters of the renders saved."""
+    def __init__(self, config=None):
+        config = {**DEFAULTS, **(config or {})}
+        self.enabled = config['ENABLED']
+        self.lock_ttl = config['LOCK_TTL']
+        self.wait_timeout = config['WAIT_TIMEOUT']
+        self.poll_interval = config['POLL_INTERVAL']
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {'computed': 0, 'coalesced_local': 0, 'coalesced_remote': 0, 'wait_timeouts': 0}
+
+    def do(self, key, compute, lookup):
+        """
+        Return the result for ``key``, computing it at most once across concurrent callers.
+
+        Args:
+            compute: Renders the result and stores it where ``lookup`` finds it.
+            lookup: Returns the stored result, or None (must not render).
+        """
+        if not self.enabled:
+            return compute()
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        if not leader:
+            if flight.event.wait(self.wait_timeout):
+                if flight.error is not None:
+                    raise flight.error
+                self._count('coalesced_local')
+                return flight.result
+            self._count('wait_timeouts')
+            self._count('computed')
+            return compute()
+
+        try:
+            flight.result = self._lead(key, compute, lookup)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            flight.event.set()
+            with self._lock:
+                del self._flights[key]
+
+    def _lead(self, key, compute, lookup):
+        token = acquire_lock(key, self.lock_ttl)
+        if token is None:
+            # Another worker is rendering it: wait for its result in the shared cache
+            result = self._wait_remote(key, lookup)
+            if result is not None:
+                self._count('coalesced_remote')
+                return result
+            token = acquire_lock(key, self.lock_ttl)
+        try:
+            result = lookup()
+            if result is not None:
+                self._count('coalesced_remote')
+                return result
+            self._count('computed')
+            return compute()
+        finally:
+            if token is not None:
+                release_lock(key, token)
+
+    def _wait_remote(self, key, lookup):
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            result = lookup()
+            if result is not None:
+                return result
+            if not is_locked(key):
+                # Released (or expired) without a result we can see: one last look
+                return lookup()
+        self._count('wait_timeouts')
+        return None
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Return a snapshot of the counters; 'saved' is the number of renders avoided."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._flights)
+        stats['saved'] = stats['coalesced_local'] + stats['coalesced_remote']
+        return stats
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """Return the process-wide SingleFlight, created on first use from settings.TRANSFORM_SINGLE_FLIGHT."""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight(getattr(settings, 'TRANSFORM_SINGLE_FLIGHT', None))
+    return _single_flight
@@ -0,0 +1,115 @@
+from celery import shared_task
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from image_management.models import Image
+from .models import BatchJob, BatchJobChunk, BatchJobFailure
+from .services import transform, store_variants
+import logging
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def transform_chunk(job_id, image_ids, index):
+    """
+    Apply a batch job's pipeline to one chunk of images, storing each result as a Derivative.
+
+    Results are stored without going through the derivative cache: batch outputs
+    are rarely requested again soon, and would evict the hot entries.
+
+    Failures are recorded per image and do not stop the rest of the chunk. The
+    job's counters are bumped once per chunk with F() expressions, so chunks
+    running in parallel on several workers never overwrite each other. A
+    BatchJobChunk row is written in the same transaction, so a redelivered chunk
+    (e.g. after a worker was lost) records its failures and counts only once;
+    its images already stored are not rendered again.
+
+    Args:
+        job_id: Primary key of the BatchJob.
+        image_ids: Primary keys of the images in this chunk.
+        index: Position of the chunk in the job.
+    """
+    job = BatchJob.objects.only('spec').get(pk=job_id)
+    images = {str(pk): image for pk, image in Image.objects.in_bulk(image_ids).items()}
+
+    succeeded, failures = 0, []
+    for image_id in image_ids:
+        image = images.get(image_id)
+        if image is None:
+            failures.append(BatchJobFailure(job_id=job_id, image_id=image_id, error='Image no longer exists.'))
+            continue
+        try:
+            transform(image, job.spec, store=True, cache=False)
+            succeeded += 1
+        except Exception as e:
+            logger.warning(f"Batch job {job_id} failed on image {image_id}: {e}")
+            failures.append(BatchJobFailure(job_id=job_id, image_id=image_id, error=str(e) or e.__class__.__name__))
+
+    try:
+        with transaction.atomic():
+            BatchJobChunk.objects.create(job_id=job_id, index=index)
+            BatchJobFailure.objects.bulk_create(failures)
+            BatchJob.objects.filter(pk=job_id).update(
+                processed=F('processed') + len(image_ids),
+                succeeded=F('succeeded') + succeeded,
+                failed=F('failed') + len(failures),
+            )
+    except IntegrityError:
+        logger.info(f"Chunk {index} of batch job {job_id} was already counted.")
+    return {'succeeded': succeeded, 'failed': len(failures)}
+
+
+def _close_batch_job(job_id):
+    job = BatchJob.objects.get(pk=job_id)
+    if job.status != BatchJob.Status.RUNNING:
+        return job
+    if job.failed == 0 and job.processed >= job.total:
+        job.status = BatchJob.Status.COMPLETE
+    elif job.succeeded:
+        job.status = BatchJob.Status.PARTIAL
+    else:
+        job.status = BatchJob.Status.FAILED
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
+    return job
+
+
+@shared_task
+def finish_batch_job(job_id):
+    """Close a batch job once every chunk has run."""
+    job = _close_batch_job(job_id)
+    logger.info(f"Batch job {job_id} finished: {job.succeeded} succeeded, {job.failed} failed.")
+
+
+@shared_task
+def abort_batch_job(job_id):
+    """
+    Close a batch job whose chord failed: a chunk task died (lost worker, time
+    limit, database error), so finish_batch_job will never run. Images of the
+    chunks that did not complete are left out of the counters (processed < total).
+    """
+    job = _close_batch_job(job_id)
+    logger.error(f"Batch job {job_id} aborted: {job.processed}/{job.total} processed, {job.succeeded} succeeded, {job.failed} failed.")
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def build_image_variants(self, image_id):
+    """
+    Store the responsive variants (settings.IMAGE_VARIANT_WIDTHS) of a ready image.
+
+    Args:
+        image_id: Primary key of the Image.
+    """
+    image = Image.objects.filter(pk=image_id, status=Image.Status.READY).first()
+    if image is None:
+        return
+    try:
+        created = store_variants(image, settings.IMAGE_VARIANT_WIDTHS)
+    except OSError as e:
+        # Storage hiccup, or an original that cannot be decoded (retries then give up)
+        logger.warning(f"Retrying variants of image {image_id}: {e}")
+        raise self.retry(exc=e)
+    logger.info(f"Stored {len(created)} variants of image {image_id}.")
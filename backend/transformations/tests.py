@@ -1,3 +1,891 @@
-from django.test import TestCase
+import io
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase
+from django.utils.http import http_date
+import numpy as np
+from PIL import ExifTags, Image as PilImage
+from rest_framework.test import APIClient
+from image_management.models import Image
+from users.models import User
+from . import cache, tiling
+from .animation import GifStreamWriter, TRANSPARENT_INDEX
+from .cache import DISK_LOW_WATER, DerivativeCache, DiskTier, MemoryTier, cache_key
+from .delivery import IMMUTABLE_CACHE_CONTROL, content_etag
+from .engine import (
+    MAX_OPERATIONS, Pipeline, TransformError, TransformResult, build_variants, canonical_spec, draft, normalize_pipeline,
+)
+from .models import BatchJob, Derivative, TransformLock
+from .negotiation import candidate_formats, parse_accept, preferred_format
+from .pool import BufferReader, TransformPool
+from .services import render_cached, start_batch_job, transform
+from .singleflight import SingleFlight, acquire_lock
+from .tasks import abort_batch_job, finish_batch_job, transform_chunk
+from .urlspec import MAX_SPEC_LENGTH, parse_spec
 
-# Create your tests here.
+RED, BLUE, GREEN = (200, 10, 10), (10, 10, 200), (10, 160, 10)
+
+
+def solid(color, size=(40, 30), box=None, box_color=None):
+    """An RGB frame of one color, optionally with a rectangle of another."""
+    frame = PilImage.new('RGB', size, color)
+    if box is not None:
+        frame.paste(box_color, box)
+    return frame
+
+
+def _nearest(color, colors):
+    """The one of ``colors`` closest to ``color`` (lossy encodes shift colors slightly)."""
+    return min(colors, key=lambda candidate: sum((a - b) ** 2 for a, b in zip(color, candidate)))
+
+
+def write_gif(frames, **kwargs):
+    """Encode (frame, duration) pairs with GifStreamWriter and return the file's bytes."""
+    buffer = io.BytesIO()
+    writer = GifStreamWriter(buffer, frames[0][0].size, **kwargs)
+    for frame, duration in frames:
+        writer.write(frame, duration)
+    writer.close()
+    return buffer.getvalue()
+
+
+def read_blocks(data):
+    """
+    Walk the blocks of a GIF file.
+
+    Returns:
+        (whether there is a global color table, [{'box', 'local_palette',
+        'delay', 'disposal', 'transparency'}] per image)
+    """
+    flags = data[10]
+    position = 13 + (3 << ((flags & 7) + 1) if flags & 0x80 else 0)
+    images, control = [], {}
+    while data[position] != 0x3B:
+        if data[position] == 0x21:
+            label = data[position + 1]
+            position += 2
+            if label == 0xF9:
+                packed, delay, index = struct.unpack('<BHB', data[position + 1:position + 5])
+                control = {'delay': delay * 10, 'disposal': (packed >> 2) & 7, 'transparency': index if packed & 1 else None}
+        elif data[position] == 0x2C:
+            x, y, width, height, packed = struct.unpack('<HHHHB', data[position + 1:position + 10])
+            position += 10
+            if packed & 0x80:
+                position += 3 << ((packed & 7) + 1)
+            images.append({'box': (x, y, x + width, y + height), 'local_palette': bool(packed & 0x80), **control})
+            control = {}
+            position += 1  # LZW minimum code size
+        else:
+            raise AssertionError(f'Unexpected block {data[position]:#x} at {position}')
+        while data[position]:
+            position += data[position] + 1
+        position += 1
+    return bool(flags & 0x80), images
+
+
+def decoded_frames(data):
+    """Every frame of a GIF as shown, composited over the previous ones."""
+    with PilImage.open(io.BytesIO(data)) as img:
+        frames = []
+        for index in range(img.n_frames):
+            img.seek(index)
+            frames.append((img.convert('RGB'), img.info.get('duration')))
+        return frames
+
+
+class GifStreamWriterTests(SimpleTestCase):
+    def assertSameFrame(self, first, second):
+        self.assertEqual(first.tobytes(), second.tobytes())
+
+    def test_changed_region_only_is_encoded(self):
+        first = solid(RED)
+        second = solid(RED, box=(10, 8, 15, 12), box_color=BLUE)
+        third = solid(RED, box=(10, 8, 15, 12), box_color=BLUE)
+        third.paste(GREEN, (30, 20, 32, 29))
+        data = write_gif([(first, 100), (second, 100), (third, 100)])
+
+        _, images = read_blocks(data)
+        self.assertEqual([image['box'] for image in images], [(0, 0, 40, 30), (10, 8, 15, 12), (30, 20, 32, 29)])
+        # Frames are drawn over the previous one, which stays in place
+        self.assertEqual([image['disposal'] for image in images], [1, 1, 1])
+        for (decoded, _), frame in zip(decoded_frames(data), (first, second, third)):
+            self.assertSameFrame(decoded, frame)
+
+    def test_unchanged_pixels_in_the_region_are_transparent(self):
+        first = solid(RED)
+        # Two changed corners: the box spans them, the pixels between them are unchanged
+        second = solid(RED, box=(2, 2, 4, 4), box_color=BLUE)
+        second.paste(BLUE, (20, 10, 22, 12))
+        data = write_gif([(first, 100), (second, 100)])
+
+        _, images = read_blocks(data)
+        self.assertEqual(images[1]['box'], (2, 2, 22, 12))
+        self.assertEqual(images[1]['transparency'], TRANSPARENT_INDEX)
+        self.assertIsNone(images[0]['transparency'])
+        self.assertSameFrame(decoded_frames(data)[1][0], second)
+
+    def test_identical_frames_extend_the_previous_delay(self):
+        data = write_gif([(solid(RED), 100), (solid(RED), 50), (solid(BLUE), 80), (solid(BLUE), 20)])
+
+        _, images = read_blocks(data)
+        self.assertEqual([image['delay'] for image in images], [150, 100])
+        frames = decoded_frames(data)
+        self.assertEqual(len(frames), 2)
+        self.assertSameFrame(frames[1][0], solid(BLUE))
+
+    def test_palette_is_reused(self):
+        frames = [
+            (solid(RED, box=(0, 0, 10, 30), box_color=BLUE), 100),
+            (solid(RED, box=(0, 0, 20, 30), box_color=BLUE), 100),
+            (solid(BLUE, box=(5, 5, 9, 9), box_color=RED), 100),
+        ]
+        data = write_gif(frames)
+
+        has_global_palette, images = read_blocks(data)
+        self.assertTrue(has_global_palette)
+        self.assertEqual([image['local_palette'] for image in images], [False, False, False])
+        for (decoded, _), (frame, _) in zip(decoded_frames(data), frames):
+            self.assertSameFrame(decoded, frame)
+
+    def test_new_colors_get_a_local_palette(self):
+        # Green is not in the first frame's palette: reusing it would turn the square red or blue
+        frames = [(solid(RED, box=(0, 0, 10, 30), box_color=BLUE), 100), (solid(RED, box=(20, 10, 24, 14), box_color=GREEN), 100)]
+        data = write_gif(frames)
+
+        has_global_palette, images = read_blocks(data)
+        self.assertTrue(has_global_palette)
+        self.assertEqual([image['local_palette'] for image in images], [False, True])
+        for (decoded, _), (frame, _) in zip(decoded_frames(data), frames):
+            self.assertSameFrame(decoded, frame)
+
+    def test_palette_per_frame(self):
+        frames = [(solid(RED), 100), (solid(GREEN, box=(0, 0, 20, 30), box_color=BLUE), 100)]
+        data = write_gif(frames, reuse_palette=False)
+
+        has_global_palette, images = read_blocks(data)
+        self.assertFalse(has_global_palette)
+        self.assertEqual([image['local_palette'] for image in images], [True, True])
+        for (decoded, _), (frame, _) in zip(decoded_frames(data), frames):
+            self.assertSameFrame(decoded, frame)
+
+    def test_transparent_frames_are_written_whole(self):
+        first = PilImage.new('RGBA', (40, 30), RED + (255,))
+        second = first.copy()
+        second.paste((0, 0, 0, 0), (0, 0, 10, 30))
+        data = write_gif([(first, 100), (second, 100)], transparent=True)
+
+        _, images = read_blocks(data)
+        self.assertEqual([image['box'] for image in images], [(0, 0, 40, 30), (0, 0, 40, 30)])
+        # Cleared between frames, so transparent pixels do not show the previous frame
+        self.assertEqual([image['disposal'] for image in images], [2, 2])
+        self.assertEqual([image['transparency'] for image in images], [TRANSPARENT_INDEX, TRANSPARENT_INDEX])
+        with PilImage.open(io.BytesIO(data)) as img:
+            img.seek(1)
+            alpha = img.convert('RGBA').getchannel('A')
+            self.assertEqual(alpha.getpixel((5, 5)), 0)
+            self.assertEqual(alpha.getpixel((20, 5)), 255)
+
+    def test_loop_count(self):
+        data = write_gif([(solid(RED), 100), (solid(BLUE), 100)], loop=3)
+        with PilImage.open(io.BytesIO(data)) as img:
+            self.assertEqual(img.info['loop'], 3)
+
+
+def encoded(img, image_format='PNG'):
+    buffer = io.BytesIO()
+    img.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class ImageTestCase(TestCase):
+    """Test case with images stored in memory and a derivative cache of its own."""
+    def setUp(self):
+        storage = mock.patch.object(Image._meta.get_field('original'), 'storage', InMemoryStorage())
+        storage.start()
+        self.addCleanup(storage.stop)
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        derivative_cache = mock.patch.object(cache, '_cache', cache.DerivativeCache({'DISK_ROOT': root}))
+        derivative_cache.start()
+        self.addCleanup(derivative_cache.stop)
+        self.client = APIClient()
+
+    def create_image(self, data, name='test.png'):
+        image = Image(original=SimpleUploadedFile(name, data))
+        image.save()
+        return image
+
+
+# Delivery view tests
+class DeliveryViewTests(ImageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = encoded(solid(RED, box=(5, 5, 20, 20), box_color=BLUE))
+        self.image = self.create_image(self.data)
+        self.url = f'/api/v1/images/{self.image.pk}/delivery/'
+        self.etag = f'"{self.image.content_hash}"'
+
+    def get(self, accept='image/png', **headers):
+        return self.client.get(self.url, HTTP_ACCEPT=accept, **{f'HTTP_{name.upper().replace("-", "_")}': value for name, value in headers.items()})
+
+    def test_original_with_validators(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.data)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['ETag'], content_etag(self.data))
+        self.assertEqual(response['Last-Modified'], http_date(self.image.created_at.timestamp()))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('Accept', response['Vary'])
+        self.assertTrue(response['Cache-Control'])
+
+    def test_negotiated_format_is_tagged_with_its_own_bytes(self):
+        response = self.get('image/webp,image/*')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response['ETag'], content_etag(response.content))
+        self.assertNotEqual(response['ETag'], self.etag)
+        self.assertEqual(self.get('image/webp,image/*', if_none_match=response['ETag']).status_code, 304)
+
+    def test_if_none_match(self):
+        response = self.get(if_none_match=self.etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertIn('Accept', response['Vary'])
+        # If-None-Match uses the weak comparison
+        self.assertEqual(self.get(if_none_match=f'W/{self.etag}').status_code, 304)
+        self.assertEqual(self.get(if_none_match=f'"other", {self.etag}').status_code, 304)
+        self.assertEqual(self.get(if_none_match='*').status_code, 304)
+        self.assertEqual(self.get(if_none_match='"other"').status_code, 200)
+
+    def test_original_is_not_read_for_a_304(self):
+        with mock.patch('transformations.views.deliver') as deliver:
+            self.assertEqual(self.get(if_none_match=self.etag).status_code, 304)
+        deliver.assert_not_called()
+
+    def test_if_modified_since(self):
+        later = http_date((self.image.created_at + timedelta(hours=1)).timestamp())
+        earlier = http_date((self.image.created_at - timedelta(hours=1)).timestamp())
+        self.assertEqual(self.get(if_modified_since=later).status_code, 304)
+        self.assertEqual(self.get(if_modified_since=earlier).status_code, 200)
+        # If-None-Match takes precedence over If-Modified-Since
+        self.assertEqual(self.get(if_modified_since=later, if_none_match='"other"').status_code, 200)
+
+    def assertPartial(self, response, start, end):
+        length = len(self.data)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, self.data[start:end])
+        self.assertEqual(response['Content-Range'], f'bytes {start}-{end - 1}/{length}')
+        self.assertEqual(response['ETag'], self.etag)
+
+    def test_ranges(self):
+        length = len(self.data)
+        self.assertPartial(self.get(range='bytes=0-9'), 0, 10)
+        self.assertPartial(self.get(range='bytes=10-'), 10, length)
+        # Suffix range: the last bytes
+        self.assertPartial(self.get(range='bytes=-5'), length - 5, length)
+        self.assertPartial(self.get(range=f'bytes=-{length + 10}'), 0, length)
+        # An end past the body is clipped
+        self.assertPartial(self.get(range=f'bytes=4-{length + 100}'), 4, length)
+
+    def test_unsatisfiable_range(self):
+        length = len(self.data)
+        for header in (f'bytes={length}-', f'bytes={length + 5}-{length + 10}', 'bytes=-0'):
+            with self.subTest(header):
+                response = self.get(range=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response['Content-Range'], f'bytes */{length}')
+
+    def test_ranges_served_whole(self):
+        # Several ranges, reversed bounds, other units and garbage get the whole body
+        for header in ('bytes=0-1,4-5', 'bytes=9-2', 'items=0-1', 'bytes=a-b', 'bytes=-'):
+            with self.subTest(header):
+                response = self.get(range=header)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, self.data)
+
+    def test_if_range(self):
+        self.assertPartial(self.get(range='bytes=0-9', if_range=self.etag), 0, 10)
+        # Strong comparison: a weak tag, another tag or a date do not match
+        last_modified = http_date(self.image.created_at.timestamp())
+        for if_range in (f'W/{self.etag}', '"other"', last_modified):
+            with self.subTest(if_range):
+                response = self.get(range='bytes=0-9', if_range=if_range)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, self.data)
+
+    def test_image_not_ready(self):
+        Image.objects.filter(pk=self.image.pk).update(status=Image.Status.PENDING)
+        self.assertEqual(self.get().status_code, 409)
+
+
+# URL transform view tests
+class UrlTransformViewTests(ImageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.image = self.create_image(encoded(solid(RED, size=(80, 60))))
+
+    def test_conditional_and_range_requests(self):
+        url = f'/api/v1/images/{self.image.pk}/t/w_40,f_png/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with PilImage.open(io.BytesIO(response.content)) as img:
+            self.assertEqual(img.size, (40, 30))
+        etag = response['ETag']
+        self.assertEqual(etag, content_etag(response.content))
+        self.assertNotIn('Accept', response.get('Vary', ''))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        partial = self.client.get(url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE=etag)
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial.content, response.content[:4])
+
+    def test_invalid_spec(self):
+        response = self.client.get(f'/api/v1/images/{self.image.pk}/t/w_0/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('transformations', response.data)
+
+
+# Derivative delivery view tests
+class DerivativeDeliveryViewTests(ImageTestCase):
+    def test_immutable_and_conditional(self):
+        image = self.create_image(encoded(solid(RED, size=(80, 60))))
+        with mock.patch.object(Derivative._meta.get_field('file'), 'storage', InMemoryStorage()):
+            _, derivative = transform(image, [{'op': 'resize', 'width': 20}], store=True)
+            url = f'/api/v1/derivatives/{derivative.pk}/'
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+            self.assertNotIn('Accept', response.get('Vary', ''))
+            self.assertEqual(len(response.content), derivative.size_bytes)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            partial = self.client.get(url, HTTP_RANGE='bytes=-4')
+            self.assertEqual(partial.status_code, 206)
+            self.assertEqual(partial.content, response.content[-4:])
+
+
+# Transformation engine tests
+class NormalizePipelineTests(SimpleTestCase):
+    def test_defaults_and_coercion(self):
+        self.assertEqual(normalize_pipeline([
+            {'op': 'resize', 'width': '320'},
+            {'op': 'crop', 'width': 10, 'height': 20},
+            {'op': 'rotate', 'degrees': -90},
+            {'op': 'format', 'format': 'JPG'},
+        ]), [
+            {'op': 'resize', 'width': 320, 'height': None, 'fit': 'scale'},
+            {'op': 'crop', 'x': 0, 'y': 0, 'width': 10, 'height': 20},
+            {'op': 'rotate', 'degrees': 270},
+            {'op': 'format', 'format': 'jpeg'},
+        ])
+
+    def test_fit_needs_both_sides(self):
+        self.assertEqual(normalize_pipeline([{'op': 'resize', 'width': 10, 'fit': 'fill'}])[0]['fit'], 'scale')
+        self.assertEqual(normalize_pipeline([{'op': 'resize', 'width': 10, 'height': 5, 'fit': 'fill'}])[0]['fit'], 'fill')
+
+    def test_invalid_pipelines(self):
+        invalid = [
+            [],
+            'resize',
+            [{'op': 'explode'}],
+            [{'op': 'resize'}],
+            [{'op': 'resize', 'width': 0}],
+            [{'op': 'resize', 'width': 'wide'}],
+            [{'op': 'crop', 'width': 10}],
+            [{'op': 'rotate', 'degrees': 'nan'}],
+            [{'op': 'rotate', 'degrees': float('inf')}],
+            [{'op': 'format', 'format': 'bmp'}],
+            [{'op': 'compress', 'quality': 101}],
+            [{'op': 'compress', 'quality': 80, 'target': 0.9}],
+            [{'op': 'compress', 'target': 1}],
+            [{'op': 'filter', 'name': 'blur', 'radius': 0}],
+            [{'op': 'filter', 'name': 'brightness', 'amount': 'bright'}],
+            [{'op': 'filter', 'name': 'emboss'}],
+            [{'op': 'flip'}] * (MAX_OPERATIONS + 1),
+        ]
+        for operations in invalid:
+            with self.subTest(operations=operations):
+                with self.assertRaises(TransformError):
+                    normalize_pipeline(operations)
+
+    def test_canonical_spec_ignores_key_order(self):
+        first = normalize_pipeline([{'op': 'resize', 'width': 10, 'height': 20}])
+        second = normalize_pipeline([{'height': '20', 'width': 10.0, 'op': 'resize'}])
+        self.assertEqual(canonical_spec(first), canonical_spec(second))
+        self.assertNotEqual(canonical_spec(first), canonical_spec(normalize_pipeline([{'op': 'resize', 'width': 20, 'height': 10}])))
+
+
+class PipelineTests(SimpleTestCase):
+    def run_pipeline(self, operations, data, **kwargs):
+        result = Pipeline(operations, **kwargs).run(io.BytesIO(data))
+        with PilImage.open(io.BytesIO(result.data)) as img:
+            img.load()
+            return result, img
+
+    def test_adjacent_geometry_is_one_step(self):
+        pipeline = Pipeline([
+            {'op': 'crop', 'x': 10, 'y': 10, 'width': 100, 'height': 80},
+            {'op': 'resize', 'width': 50},
+            {'op': 'crop', 'x': 5, 'y': 5, 'width': 20, 'height': 20},
+            {'op': 'filter', 'name': 'grayscale'},
+            {'op': 'resize', 'width': 10},
+        ])
+        steps = pipeline.steps((400, 300))
+        self.assertEqual([step[0] for step in steps], ['resample', 'color'])
+        # Crop, then half size, then a 20 px crop 5 px in (10 source px), then half again
+        self.assertEqual(steps[0][1], (20.0, 20.0, 60.0, 60.0))
+        self.assertEqual(steps[0][2], (10, 10))
+
+    def test_whole_pixel_crop_is_not_resampled(self):
+        steps = Pipeline([{'op': 'crop', 'x': 1, 'y': 2, 'width': 3, 'height': 4}]).steps((10, 10))
+        self.assertEqual(steps, [('crop', (1, 2, 4, 6), (3, 4))])
+
+    def test_resize_fits(self):
+        data = encoded(solid(RED, size=(400, 200)))
+        for fit, size in (('scale', (100, 100)), ('contain', (100, 50)), ('fill', (100, 100))):
+            with self.subTest(fit=fit):
+                _, img = self.run_pipeline([{'op': 'resize', 'width': 100, 'height': 100, 'fit': fit}], data)
+                self.assertEqual(img.size, size)
+
+    def test_rotate_and_flips(self):
+        source = solid(RED, size=(40, 20), box=(0, 0, 20, 20), box_color=BLUE)  # Blue on the left
+        data = encoded(source)
+        _, img = self.run_pipeline([{'op': 'rotate', 'degrees': 90}], data)
+        self.assertEqual(img.size, (20, 40))
+        self.assertEqual(img.convert('RGB').getpixel((10, 5)), BLUE)  # Left side turned to the top
+        _, img = self.run_pipeline([{'op': 'mirror'}], data)
+        self.assertEqual(img.convert('RGB').getpixel((35, 10)), BLUE)
+        _, img = self.run_pipeline([{'op': 'rotate', 'degrees': 45}], data)
+        self.assertEqual(img.size, source.rotate(-45, expand=True).size)
+
+    def test_output_format(self):
+        data = encoded(solid(RED))
+        result, img = self.run_pipeline([{'op': 'format', 'format': 'jpeg'}, {'op': 'compress', 'quality': 50}], data)
+        self.assertEqual((result.format, img.format, result.quality), ('jpeg', 'JPEG', 50))
+        result, img = self.run_pipeline([{'op': 'flip'}], data)
+        self.assertEqual((result.format, img.format), ('png', 'PNG'))
+
+    def test_output_pixel_budget(self):
+        with self.assertRaises(TransformError):
+            Pipeline([{'op': 'resize', 'width': 1000, 'height': 1000}], max_pixels=999_999).steps((10, 10))
+
+    def test_reduced_jpeg_decode(self):
+        data = encoded(solid(RED, size=(1600, 1200), box=(0, 0, 800, 1200), box_color=BLUE), 'JPEG')
+        with PilImage.open(io.BytesIO(data)) as img:
+            steps = draft(img, Pipeline([{'op': 'resize', 'width': 100}]).steps(img.size))
+            # Scaled by 1/8: REDUCING_GAP source pixels per output pixel are kept
+            self.assertEqual(img.size, (200, 150))
+        self.assertEqual(steps[0][1], (0.0, 0.0, 200.0, 150.0))
+        _, img = self.run_pipeline([{'op': 'resize', 'width': 100}], data)
+        self.assertEqual(img.size, (100, 75))
+        self.assertEqual(_nearest(img.getpixel((10, 40)), (BLUE, RED)), BLUE)
+
+    def test_exif_orientation(self):
+        # Stored 60x40 with blue on the left; orientation 6 shows it turned clockwise, blue on top
+        source = solid(RED, size=(60, 40), box=(0, 0, 30, 40), box_color=BLUE)
+        exif = PilImage.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        for image_format in ('PNG', 'JPEG'):
+            buffer = io.BytesIO()
+            source.save(buffer, image_format, exif=exif.tobytes())
+            data = buffer.getvalue()
+            with self.subTest(image_format):
+                _, img = self.run_pipeline([{'op': 'resize', 'width': 20}], data)
+                self.assertEqual(img.size, (20, 30))
+                self.assertEqual(_nearest(img.convert('RGB').getpixel((10, 3)), (BLUE, RED)), BLUE)
+                # Crop boxes are in upright coordinates
+                _, img = self.run_pipeline([{'op': 'crop', 'x': 0, 'y': 30, 'width': 40, 'height': 30}], data)
+                self.assertEqual(img.size, (40, 30))
+                self.assertEqual(_nearest(img.convert('RGB').getpixel((20, 15)), (BLUE, RED)), RED)
+                # Strip renders and variants too
+                _, img = self.run_pipeline([{'op': 'resize', 'width': 20}], data, tile_threshold=1, strip_rows=8)
+                self.assertEqual(img.size, (20, 30))
+                (width, result), = build_variants(io.BytesIO(data), [20])
+                self.assertEqual((result.width, result.height), (20, 30))
+
+    def test_watermark_in_strips_matches_whole_render(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        path = os.path.join(root, 'mark.png')
+        solid((0, 0, 0, 0), size=(40, 20), box=(5, 5, 35, 15), box_color=(255, 255, 255, 255)).save(path)
+        source = solid(RED, size=(300, 200), box=(0, 0, 150, 200), box_color=BLUE)
+        operations = [
+            {'op': 'resize', 'width': 160},
+            {'op': 'watermark', 'position': 'center', 'scale': 0.5, 'opacity': 0.9},
+            {'op': 'filter', 'name': 'blur', 'radius': 1},
+        ]
+        for name, img in (('RGB', source), ('L', source.convert('L'))):
+            with self.subTest(name):
+                data = encoded(img)
+                self.assertTrue(tiling.supports(Pipeline(operations, watermark_path=path).steps(img.size)))
+                _, whole = self.run_pipeline(operations, data, watermark_path=path)
+                _, strips = self.run_pipeline(operations, data, watermark_path=path, tile_threshold=1, strip_rows=7)
+                self.assertEqual((strips.mode, strips.size), (whole.mode, whole.size))
+                difference = np.abs(np.asarray(strips, dtype=np.int16) - np.asarray(whole, dtype=np.int16))
+                self.assertLessEqual(difference.max(), 1)
+                # The watermark is there, across several strips
+                self.assertGreater(np.asarray(whole)[53, 80].min(), 200)
+
+
+# URL spec tests
+class ParseSpecTests(SimpleTestCase):
+    def test_parameters(self):
+        self.assertEqual(parse_spec('cr_1:2:30:40,w_320,h_240,c_fill,r_90,fl_vh,e_sharpen:1.5:2,e_grayscale,q_70,f_webp'), [
+            {'op': 'crop', 'x': 1, 'y': 2, 'width': 30, 'height': 40},
+            {'op': 'resize', 'width': 320, 'height': 240, 'fit': 'fill'},
+            {'op': 'rotate', 'degrees': 90},
+            {'op': 'flip'},
+            {'op': 'mirror'},
+            {'op': 'filter', 'name': 'sharpen', 'amount': 1.5, 'radius': 2.0},
+            {'op': 'filter', 'name': 'grayscale'},
+            {'op': 'compress', 'quality': 70},
+            {'op': 'format', 'format': 'webp'},
+        ])
+        self.assertEqual(parse_spec('q_ssim:0.95'), [{'op': 'compress', 'target': 0.95}])
+        self.assertEqual(parse_spec('w_10,c_fit,h_10')[0]['fit'], 'contain')
+
+    def test_parameter_order_does_not_matter(self):
+        self.assertEqual(parse_spec('f_png,h_240,w_320,r_90'), parse_spec('w_320,h_240,r_90,f_png'))
+        # Filters keep their order: they do not commute
+        self.assertNotEqual(parse_spec('e_blur,e_sharpen'), parse_spec('e_sharpen,e_blur'))
+
+    def test_auto_format_adds_no_operation(self):
+        self.assertEqual(parse_spec('w_10,f_auto'), parse_spec('w_10'))
+
+    def test_invalid_specs(self):
+        invalid = [
+            '', 'x' * (MAX_SPEC_LENGTH + 1), 'w', 'w_', 'w_10,w_20', 'c_fill', 'w_10,c_stretch', 'z_1',
+            'cr_1:2:3', 'wm_', 'fl_x', 'fl_vv', 'e_grayscale:2', 'e_blur:1:2', 'f_auto', 'w_0', 'r_abc',
+        ]
+        for spec in invalid:
+            with self.subTest(spec=spec):
+                with self.assertRaises(TransformError):
+                    parse_spec(spec)
+
+
+# Format negotiation tests
+class NegotiationTests(SimpleTestCase):
+    def test_parse_accept(self):
+        self.assertEqual(parse_accept('image/avif, image/webp;q=0.8, */*;q=0.5, image/png;q=oops'), {
+            'image/avif': 1.0, 'image/webp': 0.8, '*/*': 0.5, 'image/png': 0.0,
+        })
+        self.assertEqual(parse_accept(None), {})
+
+    @mock.patch('transformations.negotiation.MODERN_FORMATS', ('avif', 'webp'))
+    def test_preferred_format(self):
+        cases = [
+            ('image/avif,image/webp,*/*', 'jpeg', 'avif'),
+            ('image/webp,*/*', 'jpeg', 'webp'),
+            ('image/avif;q=0,image/webp', 'jpeg', 'webp'),
+            # Wildcards do not say a client decodes modern formats
+            ('*/*', 'jpeg', 'jpeg'),
+            ('image/*', 'png', 'png'),
+            ('', 'png', 'png'),
+            ('image/webp', 'webp', 'webp'),
+        ]
+        for header, source_format, expected in cases:
+            with self.subTest(header=header, source_format=source_format):
+                self.assertEqual(preferred_format(header, source_format, animated=False), expected)
+
+    @mock.patch('transformations.negotiation.MODERN_FORMATS', ('avif', 'webp'))
+    def test_animated_sources_keep_their_animation(self):
+        self.assertEqual(candidate_formats('image/avif,image/webp', 'gif', animated=True), ['webp', 'gif'])
+        self.assertEqual(candidate_formats('image/avif,image/webp', 'gif', animated=False), ['avif', 'webp', 'gif'])
+        # Not known: formats that can animate are treated as animated, others as still
+        self.assertEqual(candidate_formats('image/avif,image/webp', 'png'), ['webp', 'png'])
+        self.assertEqual(candidate_formats('image/avif,image/webp', 'jpeg'), ['avif', 'webp', 'jpeg'])
+
+
+# Derivative cache tests
+def cached_result(width, color=RED):
+    """A TransformResult holding a PNG ``width`` pixels wide and one high."""
+    return TransformResult(encoded(solid(color, size=(width, 1))), 'png', (width, 1))
+
+
+class CacheKeyTests(SimpleTestCase):
+    def test_equivalent_specs_share_a_key(self):
+        first = normalize_pipeline([{'op': 'resize', 'width': 10, 'height': 20}])
+        second = normalize_pipeline([{'height': 20, 'op': 'resize', 'width': '10'}])
+        self.assertEqual(cache_key('image', 'v1', first, 'png'), cache_key('image', 'v1', second, 'png'))
+
+    def test_key_parts(self):
+        operations = normalize_pipeline([{'op': 'flip'}])
+        key = cache_key('image', 'v1', operations, 'png')
+        self.assertNotEqual(key, cache_key('other', 'v1', operations, 'png'))
+        self.assertNotEqual(key, cache_key('image', 'v2', operations, 'png'))  # Replaced original
+        self.assertNotEqual(key, cache_key('image', 'v1', operations, 'webp'))
+        self.assertNotEqual(key, cache_key('image', 'v1', normalize_pipeline([{'op': 'mirror'}]), 'png'))
+
+
+class MemoryTierTests(SimpleTestCase):
+    def test_least_recently_used_is_evicted_first(self):
+        results = [cached_result(10, color) for color in (RED, GREEN, BLUE)]
+        size = len(results[0].data)
+        tier = MemoryTier(max_bytes=2 * size, max_item_bytes=size)
+        tier.put('a', 'k1', results[0])
+        tier.put('a', 'k2', results[1])
+        self.assertIs(tier.get('k1'), results[0])  # k2 is now the least recently used
+        tier.put('b', 'k3', results[2])
+        self.assertIsNone(tier.get('k2'))
+        self.assertIs(tier.get('k1'), results[0])
+        self.assertIs(tier.get('k3'), results[2])
+        self.assertEqual((len(tier), tier.bytes, tier.evictions), (2, 2 * size, 1))
+
+    def test_large_items_are_not_kept(self):
+        result = cached_result(10)
+        tier = MemoryTier(max_bytes=10 * len(result.data), max_item_bytes=len(result.data) - 1)
+        tier.put('a', 'k', result)
+        self.assertIsNone(tier.get('k'))
+        self.assertEqual(tier.bytes, 0)
+
+    def test_invalidate(self):
+        tier = MemoryTier(max_bytes=10_000, max_item_bytes=10_000)
+        tier.put('a', 'k1', cached_result(10))
+        tier.put('a', 'k2', cached_result(12))
+        tier.put('b', 'k3', cached_result(14))
+        tier.invalidate('a')
+        self.assertEqual([tier.get(key) is None for key in ('k1', 'k2', 'k3')], [True, True, False])
+        self.assertEqual(tier.bytes, len(tier.get('k3').data))
+
+
+class DiskTierTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def test_round_trip_and_invalidate(self):
+        tier = DiskTier(self.root, max_bytes=1_000_000)
+        result = cached_result(10)
+        tier.put('a', 'k1', result)
+        tier.put('b', 'k2', result)
+        cached = tier.get('a', 'k1', 'png')
+        self.assertEqual((cached.data, cached.format, cached.width, cached.height), (result.data, 'png', 10, 1))
+        self.assertIsNone(tier.get('a', 'k1', 'webp'))
+        tier.invalidate('a')
+        self.assertIsNone(tier.get('a', 'k1', 'png'))
+        self.assertIsNotNone(tier.get('b', 'k2', 'png'))
+
+    def test_eviction_keeps_the_most_recently_used(self):
+        result = cached_result(10)
+        size = len(result.data)
+        tier = DiskTier(self.root, max_bytes=3 * size)
+        for index, key in enumerate(('k1', 'k2', 'k3')):
+            tier.put('a', key, result)
+            path = os.path.join(self.root, 'a', f'{key}.png')
+            os.utime(path, (1000 + index, 1000 + index))
+        tier.get('a', 'k1', 'png')  # Refreshes k1's mtime
+        tier.put('a', 'k4', result)
+        # Over the bound: the oldest files go until DISK_LOW_WATER of it is left
+        self.assertIsNone(tier.get('a', 'k2', 'png'))
+        self.assertIsNone(tier.get('a', 'k3', 'png'))
+        self.assertIsNotNone(tier.get('a', 'k1', 'png'))
+        self.assertIsNotNone(tier.get('a', 'k4', 'png'))
+        self.assertLessEqual(tier.usage(), 3 * size * DISK_LOW_WATER)
+        self.assertEqual(tier.evictions, 2)
+
+
+class DerivativeCacheTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.cache = DerivativeCache({'DISK_ROOT': root})
+
+    def test_tiers_and_counters(self):
+        result = cached_result(10)
+        self.assertIsNone(self.cache.get('a', 'k', 'png'))
+        self.cache.put('a', 'k', result)
+        self.assertIs(self.cache.get('a', 'k', 'png'), result)
+        # Dropped from memory (another process): found on disk, and put back in memory
+        self.cache.memory.invalidate('a')
+        self.assertEqual(self.cache.get('a', 'k', 'png').data, result.data)
+        self.assertIsNotNone(self.cache.memory.get('k'))
+        self.assertEqual(self.cache.peek('a', 'k', 'png').data, result.data)
+        stats = self.cache.stats()
+        self.assertEqual((stats['memory_hits'], stats['disk_hits'], stats['misses']), (1, 1, 1))
+        self.assertAlmostEqual(stats['hit_ratio'], 2 / 3)
+        self.cache.invalidate('a')
+        self.assertIsNone(self.cache.peek('a', 'k', 'png'))
+
+    def test_disabled(self):
+        cache = DerivativeCache({'ENABLED': False, 'DISK_ROOT': self.cache.disk.root})
+        cache.put('a', 'k', cached_result(10))
+        self.assertIsNone(cache.get('a', 'k', 'png'))
+        self.assertFalse(os.path.exists(os.path.join(self.cache.disk.root, 'a')))
+
+
+class RenderCachedTests(ImageTestCase):
+    def test_replaced_original_misses_older_entries(self):
+        image = self.create_image(encoded(solid(RED, size=(40, 30))))
+        pipeline = Pipeline([{'op': 'resize', 'width': 10}, {'op': 'format', 'format': 'png'}])
+        first = render_cached(image, pipeline)
+        self.assertIs(render_cached(image, pipeline), first)
+        # Another process replaced the original: this process's memory tier was not invalidated
+        image.content_hash = 'f' * 64
+        image.original.save('other.png', ContentFile(encoded(solid(BLUE, size=(40, 30)))), save=False)
+        with PilImage.open(io.BytesIO(render_cached(image, pipeline).data)) as img:
+            self.assertEqual(img.convert('RGB').getpixel((5, 3)), BLUE)
+
+
+# Batch job tests
+class BatchJobTests(ImageTestCase):
+    def setUp(self):
+        super().setUp()
+        storage = mock.patch.object(Derivative._meta.get_field('file'), 'storage', InMemoryStorage())
+        storage.start()
+        self.addCleanup(storage.stop)
+        self.user = User.objects.create_user(email='owner@example.com', first_name='owner')
+
+    def create_job(self, **kwargs):
+        kwargs.setdefault('status', BatchJob.Status.RUNNING)
+        return BatchJob.objects.create(spec=[{'op': 'resize', 'width': 10}], **kwargs)
+
+    def test_chunk_counts_and_records_failures(self):
+        image = self.create_image(encoded(solid(RED)))
+        broken = self.create_image(encoded(solid(BLUE)))
+        # The stored original was damaged after upload
+        broken.original.storage.delete(broken.original.name)
+        broken.original.storage.save(broken.original.name, ContentFile(b'not an image'))
+        missing = '00000000-0000-0000-0000-000000000000'
+        job = self.create_job(total=3)
+        result = transform_chunk(str(job.pk), [str(image.pk), str(broken.pk), missing], 0)
+        self.assertEqual(result, {'succeeded': 1, 'failed': 2})
+        job.refresh_from_db()
+        self.assertEqual((job.processed, job.succeeded, job.failed), (3, 1, 2))
+        self.assertEqual(image.derivatives.count(), 1)
+        self.assertEqual(
+            {str(pk) for pk in job.failures.values_list('image_id', flat=True)}, {str(broken.pk), missing})
+        self.assertEqual(job.failures.get(image_id=missing).error, 'Image no longer exists.')
+
+    def test_redelivered_chunk_counts_once(self):
+        image = self.create_image(encoded(solid(RED)))
+        job = self.create_job(total=1)
+        transform_chunk(str(job.pk), [str(image.pk)], 0)
+        transform_chunk(str(job.pk), [str(image.pk)], 0)
+        job.refresh_from_db()
+        self.assertEqual((job.processed, job.succeeded, job.failed), (1, 1, 0))
+        self.assertEqual(image.derivatives.count(), 1)
+
+    def test_chunks_skip_derivative_cache(self):
+        image = self.create_image(encoded(solid(RED)))
+        job = self.create_job(total=1)
+        transform_chunk(str(job.pk), [str(image.pk)], 0)
+        self.assertEqual(cache.get_cache().memory.bytes, 0)
+
+    def test_close_statuses(self):
+        for counters, status in (
+            ({'processed': 4, 'succeeded': 4}, BatchJob.Status.COMPLETE),
+            ({'processed': 4, 'succeeded': 3, 'failed': 1}, BatchJob.Status.PARTIAL),
+            ({'processed': 4, 'failed': 4}, BatchJob.Status.FAILED),
+        ):
+            with self.subTest(status=status):
+                job = self.create_job(total=4, **counters)
+                finish_batch_job(str(job.pk))
+                job.refresh_from_db()
+                self.assertEqual(job.status, status)
+                self.assertIsNotNone(job.finished_at)
+
+    def test_abort_leaves_unprocessed_chunks_out(self):
+        job = self.create_job(total=4, processed=2, succeeded=2)
+        abort_batch_job(str(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, BatchJob.Status.PARTIAL)
+
+    def test_closed_job_is_left_alone(self):
+        job = self.create_job(status=BatchJob.Status.FAILED, total=2, processed=2, succeeded=2)
+        finish_batch_job(str(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, BatchJob.Status.FAILED)
+        self.assertIsNone(job.finished_at)
+
+    def test_start_without_images_completes(self):
+        job = self.create_job(status=BatchJob.Status.PENDING, owner=self.user)
+        self.create_image(encoded(solid(RED)))  # Someone else's image
+        with mock.patch('transformations.services.chord') as fan_out:
+            start_batch_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total), (BatchJob.Status.COMPLETE, 0))
+        fan_out.assert_not_called()
+
+    def test_start_fans_out_chunks_after_commit(self):
+        images = [self.create_image(encoded(solid(RED))) for _ in range(5)]
+        Image.objects.update(owner=self.user)
+        job = self.create_job(status=BatchJob.Status.PENDING, owner=self.user, chunk_size=2)
+        with mock.patch('transformations.services.chord') as fan_out:
+            with self.captureOnCommitCallbacks() as callbacks:
+                start_batch_job(job)
+            fan_out.assert_not_called()
+            for callback in callbacks:
+                callback()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total), (BatchJob.Status.RUNNING, 5))
+        header = fan_out.call_args.args[0]
+        self.assertEqual([signature.args[2] for signature in header], [0, 1, 2])
+        self.assertEqual(
+            [image_id for signature in header for image_id in signature.args[1]],
+            sorted(str(image.pk) for image in images))
+
+
+# Transform pool tests
+class TransformPoolTests(SimpleTestCase):
+    def test_buffer_reader(self):
+        reader = BufferReader(memoryview(b'0123456789'))
+        self.assertEqual(reader.read(3), b'012')
+        self.assertEqual(reader.seek(-2, io.SEEK_END), 8)
+        self.assertEqual(reader.read(), b'89')
+        self.assertEqual(reader.read(5), b'')
+        reader.seek(4)
+        buffer = bytearray(3)
+        self.assertEqual((reader.readinto(buffer), bytes(buffer), reader.tell()), (3, b'456', 7))
+
+    def test_renders_from_shared_memory(self):
+        data = encoded(solid(RED, size=(120, 80), box=(0, 0, 60, 80), box_color=BLUE))
+        pipeline = Pipeline([{'op': 'resize', 'width': 30}])
+        expected = pipeline.run(io.BytesIO(data)).data
+        pool = TransformPool({'ENABLED': True, 'WORKERS': 1})
+        self.addCleanup(lambda: pool._executor and pool._executor.shutdown())
+        with tempfile.NamedTemporaryFile() as file:
+            file.write(data)
+            file.flush()
+            file.seek(0)
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                self.assertEqual(pool.run(mapped, pipeline).data, expected)
+            self.assertEqual(pool.run(file, pipeline).data, expected)
+        self.assertEqual(pool.stats()['completed'], 2)
+
+
+# Single-flight tests
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        self.flight = SingleFlight({'POLL_INTERVAL': 0.01, 'WAIT_TIMEOUT': 1})
+
+    def test_leader_checks_the_cache_after_taking_the_lock(self):
+        # Another worker stored the result and released the lock after this caller's cache miss
+        stored = cached_result(10)
+        compute = mock.Mock()
+        self.assertIs(self.flight.do('key', compute, lambda: stored), stored)
+        compute.assert_not_called()
+        self.assertEqual(self.flight.stats()['coalesced_remote'], 1)
+        self.assertFalse(TransformLock.objects.exists())
+
+    def test_leader_renders_on_a_miss_and_releases_the_lock(self):
+        result = cached_result(10)
+        self.assertIs(self.flight.do('key', lambda: result, lambda: None), result)
+        self.assertEqual(self.flight.stats()['computed'], 1)
+        self.assertFalse(TransformLock.objects.exists())
+
+    def test_waits_for_the_worker_holding_the_lock(self):
+        token = acquire_lock('key', 30)
+        stored = cached_result(10)
+        lookups = iter([None, None, stored])
+        compute = mock.Mock()
+        self.assertIs(self.flight.do('key', compute, lambda: next(lookups)), stored)
+        compute.assert_not_called()
+        self.assertEqual(TransformLock.objects.get().token, token)
@@ -0,0 +1,234 @@
+"""
+Strip-based execution of compiled pipelines, for very large images.
+
+The output is produced in strips of rows. Each strip pulls only the source rows
+it needs through the geometry step (a crop, or a resample whose box covers the
+strip plus the filter's support), runs the filter steps on it with enough
+overlap for blur and sharpen, blends the rows of the watermark that fall inside
+it, and is handed to the encoder right away:
+    - PNG output is written scanline by scanline through zlib, so no full-size
+      output bitmap exists
+    - other encoders need the whole image, so strips are pasted into a single
+      preallocated output (no per-step full-size copies)
+
+PIL still decodes the source in one piece (reduced-scale for JPEG downscales),
+so peak memory is the decoded source plus strip-sized intermediates, instead of
+the source plus one full-size copy per step (four per float32 convolution).
+Downscales by at least twice the reducing gap are first reduced by an integer
+factor over the whole source, as Image.resize does (see reduce_source), so
+strips resample the same reduced image as a whole-image render; the reduced
+copy is at most a quarter of the source. Strip and whole-image outputs then
+differ by at most one level per channel, from rounding the strip boxes.
+"""
+import io
+import math
+import struct
+import zlib
+import numpy as np
+from PIL import Image as PilImage
+from .filters import box_sizes, gaussian_kernel, BOX_BLUR_MIN_RADIUS
+from .watermark import apply_watermark
+
+# Output rows per strip by default
+STRIP_ROWS = 256
+
+# Scanlines filtered per batch, and size of the IDAT chunks written by PngStripWriter
+PNG_FILTER_ROWS = 16
+PNG_CHUNK_SIZE = 64 * 1024
+
+# PNG color types by PIL mode (8 bits per sample)
+PNG_COLOR_TYPES = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+
+# Support of the LANCZOS filter, in input pixels around each output pixel (as in PIL)
+LANCZOS_SUPPORT = 3.0
+
+
+def supports(steps):
+    """Whether compiled steps can run strip by strip: one optional geometry step, then filters and watermarks."""
+    kinds = [step[0] for step in steps]
+    if kinds and kinds[0] in ('crop', 'resample'):
+        kinds = kinds[1:]
+    return all(kind in ('color', 'convolve', 'watermark') for kind in kinds)
+
+
+def filter_halo(step):
+    """Rows of context a filter step needs above and below a strip."""
+    if step[0] != 'convolve':
+        return 0
+    radius = step[2]['radius']
+    if radius >= BOX_BLUR_MIN_RADIUS:
+        return sum(size // 2 + 1 for size in box_sizes(radius))
+    return len(gaussian_kernel(radius)) // 2
+
+
+def _geometry_rows(img, step, top, bottom):
+    """Rows [top, bottom) of the geometry step's output."""
+    if step is None:
+        return img.crop((0, top, img.width, bottom))
+    if step[0] == 'crop':
+        left, upper, right, _ = step[1]
+        return img.crop((left, upper + top, right, upper + bottom))
+    box, size = step[1], step[2]
+    scale = (box[3] - box[1]) / size[1]
+    # Resampling reads source pixels around the box, so strips join seamlessly
+    return img.resize((size[0], bottom - top), PilImage.Resampling.LANCZOS, box=(box[0], box[1] + top * scale, box[2], box[1] + bottom * scale))
+
+
+def reduce_source(img, step, reducing_gap):
+    """
+    Reduce the whole source by the integer factor Image.resize would reduce it
+    by for a resample ``step`` with ``reducing_gap``, over the same box.
+
+    Returns:
+        (image, step): the reduced image and the step rescaled to it, or both
+        unchanged when resize would not reduce (Image.resize skips the reduction
+        for LA and RGBA images too).
+    """
+    if step is None or step[0] != 'resample' or reducing_gap is None or img.mode in ('LA', 'RGBA', '1', 'P'):
+        return img, step
+    box, size = step[1], step[2]
+    scale_x, scale_y = (box[2] - box[0]) / size[0], (box[3] - box[1]) / size[1]
+    factor_x, factor_y = int(scale_x / reducing_gap) or 1, int(scale_y / reducing_gap) or 1
+    if factor_x == 1 and factor_y == 1:
+        return img, step
+    # The box grown by the filter's support, in whole pixels (Image._get_safe_box)
+    support = LANCZOS_SUPPORT - 0.5
+    reduce_box = (
+        max(0, int(box[0] - support * scale_x)),
+        max(0, int(box[1] - support * scale_y)),
+        min(img.width, math.ceil(box[2] + support * scale_x)),
+        min(img.height, math.ceil(box[3] + support * scale_y)),
+    )
+    reduced = img.reduce((factor_x, factor_y), box=reduce_box)
+    box = (
+        (box[0] - reduce_box[0]) / factor_x,
+        (box[1] - reduce_box[1]) / factor_y,
+        (box[2] - reduce_box[0]) / factor_x,
+        (box[3] - reduce_box[1]) / factor_y,
+    )
+    return reduced, ('resample', box, size)
+
+
+def iter_strips(img, steps, apply_step, strip_rows=STRIP_ROWS, reducing_gap=None):
+    """
+    Yield the output of the compiled steps as strips of up to ``strip_rows`` rows, top to bottom.
+
+    Args:
+        apply_step: The engine's function applying one step to an image.
+        reducing_gap: The reducing gap the engine resamples with (see reduce_source).
+    """
+    geometry = steps[0] if steps and steps[0][0] in ('crop', 'resample') else None
+    filter_steps = steps[1:] if geometry else steps
+    img, geometry = reduce_source(img, geometry, reducing_gap)
+    width, height = steps[-1][-1] if steps else img.size
+    halo = sum(filter_halo(step) for step in filter_steps)
+
+    for top in range(0, height, strip_rows):
+        bottom = min(height, top + strip_rows)
+        upper, lower = max(0, top - halo), min(height, bottom + halo)
+        strip = _geometry_rows(img, geometry, upper, lower)
+        for step in filter_steps:
+            if step[0] == 'watermark':
+                # Placed in the whole output, not in the strip
+                strip = apply_watermark(strip, step[1], step[2], (width, height), upper)
+            else:
+                strip = apply_step(strip, step)
+        if (upper, lower) != (top, bottom):
+            strip = strip.crop((0, top - upper, width, bottom - upper))
+        yield strip
+
+
+class PngStripWriter:
+    """Write a PNG one strip at a time, compressing scanlines as they arrive."""
+    def __init__(self, file, size, mode, level=6):
+        if mode not in PNG_COLOR_TYPES:
+            raise ValueError(f"Cannot stream a {mode} image as PNG.")
+        self.file = file
+        self.mode = mode
+        self.bands = len(mode)
+        self.previous = np.zeros(size[0] * self.bands, dtype=np.int16)
+        self.compressor = zlib.compressobj(level)
+        self.pending = []
+        self.pending_size = 0
+        file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, PNG_COLOR_TYPES[mode], 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.file.write(struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data)))
+
+    def _queue(self, data):
+        if data:
+            self.pending.append(data)
+            self.pending_size += len(data)
+        if self.pending_size >= PNG_CHUNK_SIZE:
+            self._chunk(b'IDAT', b''.join(self.pending))
+            self.pending, self.pending_size = [], 0
+
+    def write(self, strip):
+        if strip.mode != self.mode:
+            strip = strip.convert(self.mode)
+        pixels = np.asarray(strip).reshape(strip.height, -1)
+        # A few rows at a time keeps the int16 temporaries small on very wide images
+        for top in range(0, pixels.shape[0], PNG_FILTER_ROWS):
+            self._write_rows(pixels[top:top + PNG_FILTER_ROWS].astype(np.int16))
+
+    def _write_rows(self, rows):
+        # Paeth filter, vectorized: it only depends on the raw neighbours of each byte
+        above = np.vstack([self.previous, rows[:-1]])
+        left = np.zeros_like(rows)
+        left[:, self.bands:] = rows[:, :-self.bands]
+        upper_left = np.zeros_like(rows)
+        upper_left[:, self.bands:] = above[:, :-self.bands]
+        estimate = left + above - upper_left
+        distance_left = np.abs(estimate - left)
+        distance_above = np.abs(estimate - above)
+        distance_upper_left = np.abs(estimate - upper_left)
+        predictor = np.where(
+            (distance_left <= distance_above) & (distance_left <= distance_upper_left), left,
+            np.where(distance_above <= distance_upper_left, above, upper_left),
+        )
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 4  # Paeth
+        filtered[:, 1:] = (rows - predictor) & 0xFF
+        self.previous = rows[-1]
+        self._queue(self.compressor.compress(filtered.tobytes()))
+
+    def close(self):
+        self._queue(self.compressor.flush())
+        if self.pending:
+            self._chunk(b'IDAT', b''.join(self.pending))
+        self._chunk(b'IEND', b'')
+
+
+def render_strips(img, steps, image_format, apply_step, encode, strip_rows=STRIP_ROWS, reducing_gap=None):
+    """
+    Run compiled steps strip by strip and encode the result.
+
+    Args:
+        apply_step: The engine's function applying one step to an image.
+        encode: Encodes a whole image, for formats that cannot be streamed.
+        reducing_gap: The reducing gap the engine resamples with (see reduce_source).
+
+    Returns:
+        (bytes, output size)
+    """
+    size = steps[-1][-1] if steps else img.size
+    strips = iter_strips(img, steps, apply_step, strip_rows, reducing_gap)
+    first = next(strips)
+
+    if image_format == 'png' and first.mode in PNG_COLOR_TYPES:
+        buffer = io.BytesIO()
+        writer = PngStripWriter(buffer, size, first.mode)
+        writer.write(first)
+        for strip in strips:
+            writer.write(strip)
+        writer.close()
+        return buffer.getvalue(), size
+
+    output = PilImage.new(first.mode, size)
+    output.paste(first, (0, 0))
+    top = first.height
+    for strip in strips:
+        output.paste(strip, (0, top))
+        top += strip.height
+    return encode(output), size
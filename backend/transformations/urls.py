@@ -0,0 +1,17 @@
+# transformations/urls.py
+from django.urls import path, include
+from rest_framework.routers import SimpleRouter
+from .views import ImageTransformView, ImageDeliveryView, ImageUrlTransformView, DerivativeDeliveryView, TransformCacheStatsView, TransformPoolStatsView, BatchJobViewSet
+
+router = SimpleRouter()
+router.register(r'batch-jobs', BatchJobViewSet, basename='batch-job')
+
+urlpatterns = [
+    path('images/<uuid:image_id>/transform/', ImageTransformView.as_view(), name='image-transform'),
+    path('images/<uuid:image_id>/delivery/', ImageDeliveryView.as_view(), name='image-delivery'),
+    path('images/<uuid:image_id>/t/<str:spec>/', ImageUrlTransformView.as_view(), name='image-url-transform'),
+    path('derivatives/<uuid:derivative_id>/', DerivativeDeliveryView.as_view(), name='derivative-delivery'),
+    path('transform-cache/stats/', TransformCacheStatsView.as_view(), name='transform-cache-stats'),
+    path('transform-pool/stats/', TransformPoolStatsView.as_view(), name='transform-pool-stats'),
+    path('', include(router.urls)),
+]
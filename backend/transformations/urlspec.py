@@ -0,0 +1,119 @@
+"""
+Compact transformation specs, for transforms addressed by URL.
+
+A spec is one path segment of comma-separated ``key_value`` parameters, e.g.
+``w_320,h_240,c_fill,f_webp``:
+    w_<pixels>, h_<pixels>      resize to a width, a height or both
+    c_<scale|fit|fill>          how a resize to both sides fits (fit: contain)
+    cr_<x>:<y>:<width>:<height> crop, before the resize
+    r_<degrees>                 rotate clockwise
+    fl_<v|h|vh>                 flip top to bottom, mirror left to right, or both
+    e_<name>[:<value>...]       filter, values in FILTER_PARAMS order (e.g. e_sharpen:1.5:2)
+    wm_<position>[:<scale>[:<opacity>[:<margin>]]]   watermark
+    q_<quality>, q_ssim:<target>                     compress
+    f_<format>, f_auto          output format (auto, or none: negotiated from Accept)
+
+Parameters describe one pass, so their order does not matter: they are
+compiled into operations in a fixed order (crop, resize, rotate, flips,
+filters, watermark, compress, format). Only filters keep the order they are
+given in, since they do not commute. Equivalent specs therefore compile to the
+same normalized pipeline, and share its cache key.
+
+Like the engine, this module does not depend on Django.
+"""
+from .engine import TransformError, normalize_pipeline
+from .filters import COLOR_FILTERS, FILTER_PARAMS
+
+# Longest spec accepted
+MAX_SPEC_LENGTH = 256
+
+# Fit modes, by spec value
+FIT_MODES = {'scale': 'scale', 'fit': 'contain', 'contain': 'contain', 'fill': 'fill'}
+
+# Flips, by spec letter
+FLIPS = {'v': 'flip', 'h': 'mirror'}
+
+# Parameters that may be given more than once
+REPEATABLE = ('e',)
+
+
+def _values(key, value, names, required=1):
+    """Split a ``:``-separated value into a dict keyed by ``names``."""
+    values = value.split(':')
+    if not required <= len(values) <= len(names) or not all(values):
+        if len(names) == 1:
+            raise TransformError(f"'{key}' takes one value.")
+        if required == len(names):
+            raise TransformError(f"'{key}' takes {required} values separated by ':'.")
+        raise TransformError(f"'{key}' takes {required} to {len(names)} values separated by ':'.")
+    return dict(zip(names, values))
+
+
+def _filter(value):
+    name, _, values = value.partition(':')
+    params = {'op': 'filter', 'name': name}
+    if values and name in FILTER_PARAMS:
+        params.update(_values(f'e_{name}', values, tuple(FILTER_PARAMS[name])))
+    elif values and name in COLOR_FILTERS:
+        raise TransformError(f"Filter '{name}' takes no values.")
+    return params
+
+
+def _compress(value):
+    if value.startswith('ssim:'):
+        return {'op': 'compress', 'target': value[len('ssim:'):]}
+    return {'op': 'compress', 'quality': value}
+
+
+def parse_spec(spec):
+    """
+    Compile a compact spec into a normalized pipeline.
+
+    Raises:
+        TransformError: If the spec or an operation in it is invalid.
+    """
+    if not spec or len(spec) > MAX_SPEC_LENGTH:
+        raise TransformError(f"A transformation spec must have 1 to {MAX_SPEC_LENGTH} characters.")
+    params, filters = {}, []
+    for part in spec.split(','):
+        key, _, value = part.partition('_')
+        if not value:
+            raise TransformError(f"'{part}' must be written key_value.")
+        if key in REPEATABLE:
+            filters.append(_filter(value))
+        elif key in params:
+            raise TransformError(f"'{key}' is given twice.")
+        else:
+            params[key] = value
+
+    operations = []
+    if 'cr' in params:
+        operations.append({'op': 'crop', **_values('cr', params.pop('cr'), ('x', 'y', 'width', 'height'), required=4)})
+    if 'w' in params or 'h' in params:
+        fit = params.pop('c', 'scale')
+        if fit not in FIT_MODES:
+            raise TransformError(f"'c' must be one of {', '.join(FIT_MODES)}.")
+        operations.append({'op': 'resize', 'width': params.pop('w', None), 'height': params.pop('h', None), 'fit': FIT_MODES[fit]})
+    elif 'c' in params:
+        raise TransformError("'c' needs 'w' or 'h'.")
+    if 'r' in params:
+        operations.append({'op': 'rotate', 'degrees': params.pop('r')})
+    if 'fl' in params:
+        flips = params.pop('fl')
+        if set(flips) - set(FLIPS) or len(set(flips)) != len(flips):
+            raise TransformError("'fl' must be v, h or vh.")
+        operations.extend({'op': name} for letter, name in FLIPS.items() if letter in flips)
+    operations.extend(filters)
+    if 'wm' in params:
+        operations.append({'op': 'watermark', **_values('wm', params.pop('wm'), ('position', 'scale', 'opacity', 'margin'))})
+    if 'q' in params:
+        operations.append(_compress(params.pop('q')))
+    image_format = params.pop('f', 'auto')
+    if image_format != 'auto':
+        operations.append({'op': 'format', 'format': image_format})
+
+    if params:
+        raise TransformError(f"Unknown parameter '{next(iter(params))}'.")
+    if not operations:
+        raise TransformError("A transformation spec must apply at least one operation.")
+    return normalize_pipeline(operations)
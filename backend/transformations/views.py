@@ -1,3 +1,248 @@
-from django.shortcuts import render
+from rest_framework import status, permissions, viewsets, mixins
+from rest_framework.decorators import action
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import quote_etag
+from django.shortcuts import get_object_or_404
+from image_management.models import Image
+from django.conf import settings
+from PIL import Image as PilImage
+from .engine import TransformError, CONTENT_TYPES
+from .models import BatchJob, Derivative
+from .delivery import serve, serve_bytes, strong_etag, content_etag, not_modified, IMMUTABLE_CACHE_CONTROL
+from .serializers import TransformRequestSerializer, DerivativeSerializer, BatchJobSerializer, BatchJobFailureSerializer
+from .services import transform, deliver, deliver_spec, delivery_format, url_spec_cache_info
+from .cache import get_cache
+from .singleflight import get_single_flight
+from .pool import PoolSaturated, get_pool
+import logging
 
-# Create your views here.
+logger = logging.getLogger(__name__)
+
+# Errors a render can raise that are answered with an error response rather than a 500
+RENDER_ERRORS = (TransformError, PoolSaturated, OSError, PilImage.DecompressionBombError)
+
+
+# Content negotiation that keeps the first renderer whatever the Accept header says: views using it
+# answer with image bytes negotiated by format, and only fall back to the renderer for errors. They
+# also have a single renderer, else DRF adds Vary: Accept to responses that do not depend on it
+class ImageContentNegotiation(BaseContentNegotiation):
+    def select_parser(self, request, parsers):
+        return parsers[0] if parsers else None
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def render_error_response(image, error):
+    """Response for an error raised while rendering ``image``."""
+    if isinstance(error, TransformError):
+        raise ValidationError({'transformations': [str(error)]})
+    if isinstance(error, PoolSaturated):
+        return Response(
+            {'status': 'error', 'message': 'Too many transformations in progress, retry later.'},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={'Retry-After': str(error.retry_after)},
+        )
+    if isinstance(error, PilImage.DecompressionBombError):
+        return Response({'status': 'error', 'message': 'The image is too large to transform.'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    logger.error(f"Failed to transform image {image.pk}: {error}")
+    return Response({'status': 'error', 'message': 'Could not read the image.'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+
+def image_response(image, result, negotiated=False):
+    """Serve rendered bytes; negotiated responses vary with the Accept header."""
+    response = HttpResponse(result.data, content_type=result.content_type)
+    response['Content-Disposition'] = f'inline; filename="{image.pk}.{result.format}"'
+    if negotiated:
+        patch_vary_headers(response, ['Accept'])
+    return response
+
+
+# Image transformation view
+class ImageTransformView(APIView):
+    """
+        Apply an ordered pipeline of transformations to an image.
+            - Returns the transformed image, or stores it as a derivative when "store" is true.
+            - Without a "format" operation, the returned image is in the preferred format the Accept header allows (AVIF > WebP > its own).
+            - Renders run in the transform pool when it is enabled; a full pool answers 429 with Retry-After.
+    """
+    permission_classes = [permissions.AllowAny]
+    serializer_class = TransformRequestSerializer
+    content_negotiation_class = ImageContentNegotiation
+    renderer_classes = [JSONRenderer]
+
+    def post(self, request, image_id):
+        image = get_object_or_404(Image, pk=image_id)
+        if image.status != Image.Status.READY:
+            return Response({'status': 'error', 'message': 'Image is not ready yet.'}, status=status.HTTP_409_CONFLICT)
+
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['transformations']
+        try:
+            if serializer.validated_data['store']:
+                result, derivative = transform(image, operations, store=True, offload=True)
+                return Response(DerivativeSerializer(derivative, context={'request': request}).data, status=status.HTTP_201_CREATED)
+            result, negotiated = deliver(image, request.headers.get('Accept'), operations, offload=True)
+        except RENDER_ERRORS as e:
+            return render_error_response(image, e)
+        return image_response(image, result, negotiated)
+
+
+# Image delivery view
+class ImageDeliveryView(APIView):
+    """
+        Serve an image in the preferred format the client accepts (AVIF > WebP > its own).
+            - Only that format is rendered, once, and cached; responses vary with the Accept header.
+            - Strong ETag (the hash of the bytes served) and Last-Modified: conditional requests get 304.
+            - When the original itself is served, its recorded content hash answers conditional requests without reading it.
+            - Single byte ranges are served as 206.
+    """
+    permission_classes = [permissions.AllowAny]
+    content_negotiation_class = ImageContentNegotiation
+    renderer_classes = [JSONRenderer]
+
+    def get(self, request, image_id):
+        image = get_object_or_404(Image, pk=image_id)
+        if image.status != Image.Status.READY:
+            return Response({'status': 'error', 'message': 'Image is not ready yet.'}, status=status.HTTP_409_CONFLICT)
+        accept = request.headers.get('Accept')
+        if image.content_hash and delivery_format(image, accept, original=True)[1]:
+            response = not_modified(
+                request, quote_etag(image.content_hash), image.created_at, settings.IMAGE_DELIVERY_CACHE_CONTROL, vary=['Accept'],
+            )
+            if response is not None:
+                return response
+        try:
+            result, negotiated = deliver(image, accept, offload=True)
+        except RENDER_ERRORS as e:
+            return render_error_response(image, e)
+        return serve_bytes(
+            request, result.data, result.content_type,
+            etag=content_etag(result.data),
+            modified_at=image.created_at,
+            cache_control=settings.IMAGE_DELIVERY_CACHE_CONTROL,
+            vary=['Accept'] if negotiated else None,
+            filename=f'{image.pk}.{result.format}',
+        )
+
+
+# URL transform view
+class ImageUrlTransformView(APIView):
+    """
+        Serve a transformation addressed by URL, e.g. images/<id>/t/w_320,h_240,c_fill,f_webp/ (see urlspec.py).
+            - Parameter order does not matter: equivalent specs share one cached render.
+            - Without f_<format>, the format is negotiated from the Accept header, as for delivery.
+            - Strong ETag (the hash of the bytes served): conditional and range requests as for delivery.
+    """
+    permission_classes = [permissions.AllowAny]
+    content_negotiation_class = ImageContentNegotiation
+    renderer_classes = [JSONRenderer]
+
+    def get(self, request, image_id, spec):
+        image = get_object_or_404(Image, pk=image_id)
+        if image.status != Image.Status.READY:
+            return Response({'status': 'error', 'message': 'Image is not ready yet.'}, status=status.HTTP_409_CONFLICT)
+        try:
+            result, negotiated = deliver_spec(image, request.headers.get('Accept'), spec, offload=True)
+        except RENDER_ERRORS as e:
+            return render_error_response(image, e)
+        return serve_bytes(
+            request, result.data, result.content_type,
+            etag=content_etag(result.data),
+            modified_at=image.created_at,
+            cache_control=settings.IMAGE_DELIVERY_CACHE_CONTROL,
+            vary=['Accept'] if negotiated else None,
+            filename=f'{image.pk}.{result.format}',
+        )
+
+
+# Derivative delivery view
+class DerivativeDeliveryView(APIView):
+    """
+        Serve a stored derivative.
+            - The URL's content never changes, so it is cacheable for a year ("immutable").
+            - Strong ETag and Last-Modified are answered with 304 without reading the file; single byte ranges get 206.
+    """
+    permission_classes = [permissions.AllowAny]
+    content_negotiation_class = ImageContentNegotiation
+    renderer_classes = [JSONRenderer]
+
+    def get(self, request, derivative_id):
+        derivative = get_object_or_404(Derivative.objects.select_related('image'), pk=derivative_id)
+
+        def read(start, end):
+            with derivative.file.open('rb') as file:
+                file.seek(start)
+                return file.read(end - start)
+
+        return serve(
+            request, read, derivative.size_bytes, CONTENT_TYPES[derivative.format],
+            etag=strong_etag(derivative.image.content_hash or derivative.image_id, derivative.spec_hash, derivative.format),
+            modified_at=derivative.created_at,
+            cache_control=IMMUTABLE_CACHE_CONTROL,
+            filename=f'{derivative.pk}.{derivative.format}',
+        )
+
+
+# Derivative cache stats view
+class TransformCacheStatsView(APIView):
+    """
+        Report hit, miss and eviction counters of the derivative cache (admin only).
+            - Counters are per process; tier sizes are read from the tiers themselves.
+            - 'single_flight' counts renders computed and renders saved by coalescing.
+            - 'url_specs' reports the cache of compiled URL specs.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        stats = get_cache().stats()
+        stats['single_flight'] = get_single_flight().stats()
+        stats['url_specs'] = url_spec_cache_info()._asdict()
+        return Response(stats, status=status.HTTP_200_OK)
+
+
+# Transform pool stats view
+class TransformPoolStatsView(APIView):
+    """
+        Report saturation of this process's transform pool (admin only).
+            - 'pending' is renders running or queued, 'rejected' the ones refused with a 429.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(get_pool().stats(), status=status.HTTP_200_OK)
+
+
+# Batch job viewset
+class BatchJobViewSet(mixins.CreateModelMixin,
+                      mixins.RetrieveModelMixin,
+                      mixins.ListModelMixin,
+                      viewsets.GenericViewSet):
+    """
+       ViewSet for batch transformation jobs.
+
+       POST starts a job applying one pipeline to every image matching the
+       filters (your own images, or all images for staff), GET reports its
+       progress counters and GET failures/ lists the images that failed.
+    """
+    serializer_class = BatchJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = BatchJob.objects.order_by('-created_at')
+        return queryset if user.is_staff else queryset.filter(owner=user)
+
+    @action(detail=True, methods=['get'])
+    def failures(self, request, pk=None):
+        """List the images the job could not transform."""
+        job = self.get_object()
+        page = self.paginate_queryset(job.failures.order_by('created_at'))
+        return self.get_paginated_response(BatchJobFailureSerializer(page, many=True).data)
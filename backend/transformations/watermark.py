@@ -0,0 +1,139 @@
+"""
+Watermark compositing.
+
+The watermark asset is prepared once per (size bucket, opacity) and kept in an
+LRU: decoded, resized and with its alpha premultiplied into the color, as
+16-bit arrays ready for blending. Widths are rounded to SIZE_BUCKET pixels so
+outputs of similar sizes share a layer.
+
+Blending only touches the region the watermark covers: that region is cropped
+out of the destination, blended with integer arithmetic
+    out = (color * alpha + destination * (255 - alpha)) / 255
+and pasted back, instead of compositing a full-frame overlay. Strip renders
+(see tiling.py) blend each strip with the rows of the layer that fall inside it.
+
+Compiled watermark operations carry the asset's version (asset_version, a digest
+of its content), so renders made with a replaced asset get new cache keys.
+"""
+import functools
+import hashlib
+import os
+import numpy as np
+from PIL import Image as PilImage
+
+# Watermark widths are rounded to a multiple of this many pixels
+SIZE_BUCKET = 16
+
+# Prepared overlays kept in memory
+OVERLAY_CACHE_SIZE = 64
+
+POSITIONS = ('top-left', 'top-right', 'bottom-left', 'bottom-right', 'center')
+
+
+# Size of the reads used to hash the asset
+DIGEST_CHUNK_SIZE = 64 * 1024
+
+
+@functools.lru_cache(maxsize=8)
+def _digest(path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(DIGEST_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def asset_version(path):
+    """
+    Digest of the watermark asset's content, hashed again only when the file's
+    mtime or size changes. None if the file cannot be read.
+    """
+    try:
+        stat = os.stat(path)
+        return _digest(path, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+@functools.lru_cache(maxsize=8)
+def _asset(path, mtime):
+    """The decoded watermark asset, in RGBA (``mtime`` makes a replaced file a new entry)."""
+    with PilImage.open(path) as img:
+        return img.convert('RGBA')
+
+
+@functools.lru_cache(maxsize=OVERLAY_CACHE_SIZE)
+def _overlay(path, mtime, width, opacity):
+    """
+    The asset resized to ``width`` with ``opacity`` applied, as uint16 arrays:
+    color premultiplied by alpha (h, w, 3), 255 - alpha (h, w, 1) and alpha (h, w, 1).
+    """
+    asset = _asset(path, mtime)
+    height = max(1, round(asset.height * width / asset.width))
+    pixels = np.asarray(asset.resize((width, height), PilImage.Resampling.LANCZOS)).astype(np.uint16)
+    alpha = (pixels[:, :, 3:] * round(opacity * 255) + 127) // 255
+    return pixels[:, :, :3] * alpha, 255 - alpha, alpha
+
+
+def overlay(path, size, scale, opacity):
+    """
+    Prepared overlay for an image of ``size``: ``scale`` times its width (less if
+    the image is too short), rounded down to a multiple of SIZE_BUCKET.
+    """
+    mtime = os.path.getmtime(path)
+    asset = _asset(path, mtime)
+    width = min(size[0] * scale, size[1] * asset.width / asset.height)
+    width = max(SIZE_BUCKET, int(width // SIZE_BUCKET) * SIZE_BUCKET)
+    return _overlay(path, mtime, width, opacity)
+
+
+def overlay_cache_info():
+    """Hits and misses of the prepared overlay cache."""
+    return _overlay.cache_info()
+
+
+def _fit(layer_size, size, params):
+    """Top-left corner of the layer in an image of ``size``, or None if it does not fit."""
+    width, height = layer_size
+    margin = params['margin']
+    if width + 2 * margin > size[0] or height + 2 * margin > size[1]:
+        margin = 0
+        if width > size[0] or height > size[1]:
+            return None
+    vertical, _, horizontal = params['position'].partition('-')
+    x = {'left': margin, 'right': size[0] - width - margin}.get(horizontal, (size[0] - width) // 2)
+    y = {'top': margin, 'bottom': size[1] - height - margin}.get(vertical, (size[1] - height) // 2)
+    return x, y
+
+
+def apply_watermark(img, path, params, size=None, top=0):
+    """
+    Blend the watermark into ``img``, in place where possible, and return it.
+
+    Args:
+        params: position, scale (share of the image width), opacity and margin (pixels).
+        size: Size of the whole image when ``img`` is a strip of it starting at
+            row ``top``; the watermark is placed in the whole image, and only its
+            rows inside the strip are blended.
+    """
+    size = size or img.size
+    color, inverse, alpha = overlay(path, size, params['scale'], params['opacity'])
+    corner = _fit((color.shape[1], color.shape[0]), size, params)
+    if corner is None:
+        return img
+
+    # Converted even when the strip misses the layer, so every strip has the same mode
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.mode else 'RGB')
+    first, last = max(0, top - corner[1]), min(color.shape[0], top + img.height - corner[1])
+    if first >= last:
+        return img
+    color, inverse, alpha = color[first:last], inverse[first:last], alpha[first:last]
+    box = (corner[0], corner[1] + first - top, corner[0] + color.shape[1], corner[1] + last - top)
+    region = np.asarray(img.crop(box)).astype(np.uint16)
+    blended = np.empty(region.shape, dtype=np.uint8)
+    blended[:, :, :3] = (color + region[:, :, :3] * inverse + 127) // 255
+    if img.mode == 'RGBA':
+        blended[:, :, 3:] = alpha + (region[:, :, 3:] * inverse + 127) // 255
+    img.paste(PilImage.fromarray(blended), box[:2])
+    return img
@@ -30,6 +30,7 @@ class User(AbstractUser):
             models.Index(fields=['email'], name='idx_user_email'),
             models.Index(fields=['created_at'], name='idx_user_created_at'),
             models.Index(fields=['updated_at'], name='idx_user_updated_at'),
+            models.Index(fields=['created_at', 'user_id'], name='idx_user_created_at_id'),  # Keyset pagination
         ]
         
     def __str__(self):
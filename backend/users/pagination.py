@@ -1,7 +1,17 @@
 # pagination.py
 
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError as DjangoValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 class CustomPagination(PageNumberPagination):
     """
@@ -24,3 +34,165 @@ class CustomPagination(PageNumberPagination):
             'count': self.page.paginator.count,  # Total number of items
             'results': data  # The serialized data for the current page
         })
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique sort key, newest first by default: (created_at, pk).
+
+    A page after a cursor is fetched with a range condition on the key, e.g.
+    created_at <= c AND (created_at < c OR pk < k), so with a composite index on
+    the key every page costs one index range scan of page_size rows, however
+    deep it is. There is no COUNT(*) and no OFFSET.
+
+    The next and previous cursors are opaque tokens carrying the key of the
+    last (or first) row of the page. A queryset ordered already (e.g. by a
+    filter's ordering parameter) is paginated on that ordering, with the primary
+    key appended as a tie breaker; sort fields must be non-null model fields.
+
+    The total count is only returned with ?count=true. It is then estimated from
+    the planner statistics for an unfiltered table on PostgreSQL, or counted and
+    cached for PAGINATION_COUNT_CACHE_TIMEOUT seconds per query.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = ('-created_at', '-pk')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.count = self.get_count(queryset) if request.query_params.get(self.count_query_param) == 'true' else None
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['reverse']
+        ordering = [self._reversed(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            try:
+                queryset = queryset.filter(self._after(ordering, cursor['key']))
+            except (DjangoValidationError, ValueError, TypeError):
+                raise NotFound('Invalid cursor.')
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, queryset):
+        """The queryset's own ordering with the primary key appended, else the default ordering."""
+        ordering = [field for field in queryset.query.order_by if isinstance(field, str)]
+        if not ordering:
+            return tuple(self.ordering)
+        if ordering[-1].lstrip('-') not in ('pk', queryset.model._meta.pk.name):
+            ordering.append('-pk' if ordering[-1].startswith('-') else 'pk')
+        return tuple(ordering)
+
+    @staticmethod
+    def _reversed(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _after(ordering, key):
+        """Condition selecting the rows after ``key`` in ``ordering``, led by a range on its first field."""
+        names = [field.lstrip('-') for field in ordering]
+        operators = ['lt' if field.startswith('-') else 'gt' for field in ordering]
+        condition = Q()
+        for index in range(len(ordering)):
+            equal = {name: value for name, value in zip(names[:index], key[:index])}
+            condition |= Q(**equal, **{f'{names[index]}__{operators[index]}': key[index]})
+        # The leading range lets the database scan the index from the cursor on
+        return Q(**{f'{names[0]}__{operators[0]}e': key[0]}) & condition
+
+    def position(self, obj):
+        """Key of ``obj`` in the ordering, as JSON values."""
+        key = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            elif not isinstance(value, (int, float)):
+                value = str(value)
+            key.append(value)
+        return key
+
+    def encode_cursor(self, key, reverse):
+        payload = json.dumps({'o': self.ordering, 'k': key, 'r': int(reverse)}, separators=(',', ':'))
+        token = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        """Return {'key', 'reverse'} from the request's cursor, or None on the first page."""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            key, reverse = payload['k'], bool(payload['r'])
+            valid = payload['o'] == list(self.ordering) and isinstance(key, list) and len(key) == len(self.ordering)
+        except (TypeError, ValueError, KeyError):
+            valid = False
+        if not valid:
+            raise NotFound('Invalid cursor.')
+        return {'key': key, 'reverse': reverse}
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.position(self.page[0]), reverse=True)
+
+    def get_count(self, queryset):
+        """Estimated or cached total, without counting on every request."""
+        query = queryset.query
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] >= 0:  # -1 until the table is first analyzed
+                return row[0]
+        queryset = queryset.order_by()
+        try:
+            sql = str(queryset.query)
+        except EmptyResultSet:
+            return 0
+        key = 'pagination-count:' + hashlib.sha256(sql.encode()).hexdigest()
+        return cache.get_or_set(key, queryset.count, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+
+    def get_paginated_response(self, data):
+        """
+        Return the same shape as CustomPagination: 'links', 'count' (None unless
+        requested with ?count=true) and 'results'.
+        """
+        return Response({
+            'links': {
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link()
+            },
+            'count': self.count,
+            'results': data
+        })
@@ -1,3 +1,130 @@
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlsplit
 from django.test import TestCase
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from .models import User
+from .pagination import KeysetPagination
 
-# Create your tests here.
+NAMES = ('ada', 'bob', 'cy')
+
+
+def cursor_of(link):
+    """The cursor parameter of a next or previous link."""
+    return parse_qs(urlsplit(link).query).get('cursor', [None])[0] if link else None
+
+
+def token(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+# Keyset pagination tests
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for index in range(23):
+            user = User.objects.create_user(email=f'user{index}@example.com', first_name=NAMES[index % len(NAMES)])
+            # Pairs of users share a timestamp, so pages also split on the primary key tie breaker
+            User.objects.filter(pk=user.pk).update(created_at=start + timedelta(minutes=index // 2))
+
+    def paginate(self, queryset, **params):
+        """Return (primary keys of the page, next cursor, previous cursor)."""
+        paginator = KeysetPagination()
+        request = Request(APIRequestFactory().get('/users/', {key: value for key, value in params.items() if value is not None}))
+        page = paginator.paginate_queryset(queryset, request)
+        return [user.pk for user in page], cursor_of(paginator.get_next_link()), cursor_of(paginator.get_previous_link())
+
+    def walk(self, queryset, page_size):
+        """Pages read by following next cursors from the first page, then previous cursors back."""
+        forward, backward = [], []
+        keys, next_cursor, previous_cursor = self.paginate(queryset, page_size=page_size)
+        self.assertIsNone(previous_cursor)
+        forward.append(keys)
+        while next_cursor:
+            keys, next_cursor, previous_cursor = self.paginate(queryset, page_size=page_size, cursor=next_cursor)
+            forward.append(keys)
+        while previous_cursor:
+            keys, _, previous_cursor = self.paginate(queryset, page_size=page_size, cursor=previous_cursor)
+            backward.append(keys)
+        return forward, backward
+
+    def assertWalks(self, queryset, expected, page_size=5):
+        forward, backward = self.walk(queryset, page_size)
+        pages = [expected[index:index + page_size] for index in range(0, len(expected), page_size)]
+        self.assertEqual(forward, pages)
+        # Back from the last page to the first, one page at a time
+        self.assertEqual(backward, pages[-2::-1])
+
+    def test_newest_first_by_default(self):
+        expected = list(User.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+        self.assertWalks(User.objects.all(), expected)
+
+    def test_no_empty_last_page(self):
+        expected = list(User.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+        self.assertWalks(User.objects.all(), expected, page_size=len(expected))
+
+    def test_queryset_ordering_with_mixed_directions(self):
+        for ordering in (('first_name', '-created_at'), ('-first_name', 'created_at'), ('first_name', 'created_at', '-pk')):
+            with self.subTest(ordering=ordering):
+                expected = list(User.objects.order_by(*ordering, '-pk' if ordering[-1].startswith('-') else 'pk').values_list('pk', flat=True))
+                self.assertWalks(User.objects.order_by(*ordering), expected, page_size=4)
+
+    def test_previous_cursor_of_the_first_page_after_going_back(self):
+        _, next_cursor, _ = self.paginate(User.objects.all(), page_size=5)
+        _, _, previous_cursor = self.paginate(User.objects.all(), page_size=5, cursor=next_cursor)
+        keys, next_again, previous_again = self.paginate(User.objects.all(), page_size=5, cursor=previous_cursor)
+        self.assertEqual(keys, list(User.objects.order_by('-created_at', '-pk').values_list('pk', flat=True)[:5]))
+        self.assertIsNone(previous_again)
+        self.assertEqual(next_again, next_cursor)
+
+    def test_invalid_cursors(self):
+        _, next_cursor, _ = self.paginate(User.objects.all(), page_size=5)
+        key = json.loads(base64.urlsafe_b64decode(next_cursor + '=' * (-len(next_cursor) % 4)))['k']
+        cursors = {
+            'not base64': '!!!',
+            'not json': token('x')[:-2],
+            'missing fields': token({'k': key}),
+            'other ordering': token({'o': ['first_name', '-pk'], 'k': key, 'r': 0}),
+            'short key': token({'o': ['-created_at', '-pk'], 'k': key[:1], 'r': 0}),
+            'bad value': token({'o': ['-created_at', '-pk'], 'k': ['yesterday', key[1]], 'r': 0}),
+        }
+        for name, cursor in cursors.items():
+            with self.subTest(name):
+                with self.assertRaises(NotFound):
+                    self.paginate(User.objects.all(), cursor=cursor)
+        # A cursor is only valid for the ordering it was issued for
+        with self.assertRaises(NotFound):
+            self.paginate(User.objects.order_by('first_name'), cursor=next_cursor)
+
+    def test_count_only_on_request(self):
+        paginator = KeysetPagination()
+        paginator.paginate_queryset(User.objects.all(), Request(APIRequestFactory().get('/users/')))
+        self.assertIsNone(paginator.get_paginated_response([]).data['count'])
+        paginator.paginate_queryset(User.objects.all(), Request(APIRequestFactory().get('/users/', {'count': 'true'})))
+        self.assertEqual(paginator.get_paginated_response([]).data['count'], 23)
+
+
+# User list view tests
+class UserListViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for index in range(3):
+            User.objects.create_user(email=f'user{index}@example.com')
+
+    def test_follows_next_links(self):
+        response = self.client.get('/users/auth/list/', {'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        emails = [user['email'] for user in response.data['results']]
+        response = self.client.get(response.data['links']['next'])
+        self.assertEqual(response.status_code, 200)
+        emails += [user['email'] for user in response.data['results']]
+        self.assertIsNone(response.data['links']['next'])
+        self.assertEqual(sorted(emails), [f'user{index}@example.com' for index in range(3)])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/users/auth/list/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
@@ -5,10 +5,10 @@ from rest_framework import permissions
 from rest_framework.views import APIView
 from rest_framework.request import Request
 from .serializers import UserSerializer, UserRegistrationSerializer
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import ValidationError, NotFound
 from .tokens import generate_tokens, blacklist_token
 from django.contrib.auth import authenticate
-from .pagination import CustomPagination
+from .pagination import KeysetPagination
 import logging
 from typing import Any
 
@@ -236,15 +236,15 @@ class UserListView(APIView):
     """API view for listing all registered users."""
     permission_classes = [permissions.AllowAny]
     serializer_class = UserSerializer
-    pagination_class = CustomPagination
+    pagination_class = KeysetPagination
     
     def get(self, request):
-        """Retrieve a paginated list of all users."""
+        """Retrieve a paginated list of all users, newest first."""
         try:
             users = User.objects.all() # Get all users
             
-            # An instance of the custom pagination class
-            paginator = CustomPagination()
+            # An instance of the keyset pagination class (ordered by created_at, then user_id)
+            paginator = self.pagination_class()
             
             # Paginate the queryset and get the serialized data for the current page
             page = paginator.paginate_queryset(users, request)
@@ -264,6 +264,8 @@ class UserListView(APIView):
             logger.debug(f"User list response data: {response_data}")
             return Response(response_data, status=status.HTTP_200_OK)
         
+        except NotFound:
+            raise  # Invalid cursor
         except Exception as e:
             logger.error(f"Error retrieving user list: {str(e)}")
             response_data = {